@@ -1,38 +1,100 @@
 import json
 import base64
 import uuid
-from datetime import timezone
+from dataclasses import dataclass
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from MindMates import broadcast, presence, reactions, write_behind
+from MindMates.db_executor import database_sync_to_async
+from MindMates.throttle import FlowControlMixin
 from django.core.files.base import ContentFile
 from django.db import transaction
 from django.contrib.auth.models import AnonymousUser
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from .models import Conversation, Message
-from django.core.serializers.json import DjangoJSONEncoder
+from .uploads import ChunkedUpload, UploadError, MAX_CHUNK_SIZE
+from MediaFiles import access, blobs
 from django.utils import timezone
 
-class ChatConsumer(AsyncWebsocketConsumer):
+# Text messages are inserted in batches when write-behind is enabled
+message_buffer = write_behind.WriteBehindBuffer(Message, after_flush=Conversation.record_messages)
+
+@dataclass(frozen=True)
+class ConversationContext:
+    """What a chat connection needs to know about its conversation, loaded once after auth.
+
+    Frames are handled against this snapshot instead of re-reading the
+    conversation and both users; a ``conversation.changed`` group event
+    (see Chats.signals) makes the consumer reload it.
+    """
+    conversation_id: int
+    room_group_name: str
+    initiator: dict
+    receiver: dict
+
+    FIELDS = ("initiator_id", "initiator__username", "receiver_id", "receiver__username")
+
+    @classmethod
+    def load(cls, conversation_id):
+        return cls.from_row(conversation_id, Conversation.objects.filter(id=conversation_id).values(*cls.FIELDS).first())
+
+    @classmethod
+    def from_row(cls, conversation_id, row):
+        if row is None:
+            return None
+        return cls(
+            conversation_id=int(conversation_id),
+            room_group_name=f"chat_{conversation_id}",
+            initiator={"id": row["initiator_id"], "username": row["initiator__username"]},
+            receiver={"id": row["receiver_id"], "username": row["receiver__username"]},
+        )
+
+    def has_participant(self, user_id):
+        return user_id in (self.initiator["id"], self.receiver["id"])
+
+    def other(self, user_id):
+        return self.receiver if user_id == self.initiator["id"] else self.initiator
+
+
+# Most changes a reconnecting client is sent in one replay frame
+REPLAY_LIMIT = 500
+
+
+class ChatConsumer(FlowControlMixin, AsyncWebsocketConsumer):
     async def connect(self):
         # Accept connection immediately
         await self.accept()
         self.awaiting_auth = True
         self.conversation_id = self.scope['url_route']['kwargs'].get('conversation_id')
         self.user = None
+        self.context = None
+        self.upload = None
         print(f"New WebSocket connection for conversation: {self.conversation_id}")
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
+            # --- Binary upload chunks ---
+            if bytes_data is not None:
+                if self.awaiting_auth:
+                    await self.close(code=4001)
+                    return
+                await self.handle_upload_chunk(bytes_data)
+                return
+
             data = json.loads(text_data)
             
             # --- Authentication ---
             if self.awaiting_auth:
-                if data.get("type") == "auth" and await self.authenticate_token(data.get("token")):
-                    if await self.verify_conversation_access():
-                        self.room_group_name = f"chat_{self.conversation_id}"
+                if data.get("type") == "auth" and await self.authenticate(data.get("token")):
+                    if self.context is not None and self.context.has_participant(self.user.id):
+                        self.room_group_name = self.context.room_group_name
                         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
                         self.awaiting_auth = False
                         print(f"User {self.user.username} connected successfully")
+                        await self.join_presence()
+                        # Reconnect: catch the client up from the last message it saw
+                        if data.get("last_message_id") is not None:
+                            await self.send_replay(int(data["last_message_id"]))
                         return
                     else:
                         print("Permission denied for conversation")
@@ -42,6 +104,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     print("Authentication failed")
                     await self.close(code=4001)  # 4001 = auth failed
                     return
+
+            # Over-limit frames get a throttled reply instead of being handled
+            if await self.rate_limited(data):
+                return
             
             # --- Chat message ---
             if data.get("type") == "chat_message":
@@ -49,7 +115,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             
             # --- Other actions ---
             if data.get("type") == "mark_read":
-                await self.mark_message_as_read(data['message_id'])
+                await self.handle_mark_read(data['message_id'])
             if data.get("type") == "edit_message":
                 await self.handle_edit_message(data)
             if data.get("type") == "delete_message":
@@ -60,6 +126,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     await self.broadcast_message(saved_msg)
             if data.get("type") == "like_message":
                 await self.handle_like(data['message_id'])
+            if data.get("type") == "upload_init":
+                await self.handle_upload_init(data)
+            if data.get("type") == "upload_commit":
+                await self.handle_upload_commit(data)
+            if data.get("type") == "upload_abort":
+                self.discard_upload()
+            if data.get("type") == "heartbeat":
+                if await self.acknowledge(data):
+                    return
+                await presence.heartbeat_async(self.user.id, self.presence_rooms)
+                await self.send(text_data=json.dumps({"type": "heartbeat_ack"}))
         
         except Exception as e:
             print(f"Error in receive: {e}")
@@ -72,72 +149,189 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if not content and not file_data:
             return
         
-        conversation, saved_message = await self.save_message(content, file_data)
-        if not conversation:
+        if file_data:
+            saved_message = await self.save_message(content, file_data)
+        elif write_behind.ENABLED:
+            await self.queue_text_message(content, data.get("client_id"))
+            return
+        else:
+            saved_message = await self.create_text_message(content)
+        if not saved_message:
             await self.close(code=4003)
             return
         
-        message_data = {
+        await self.broadcast_message(self.message_payload(saved_message))
+
+    def message_payload(self, message):
+        return {
             "type": "chat_message",
-            "message_id": saved_message.id,
-            "content": saved_message.content,
-            "file_url": saved_message.file.url if saved_message.file else None,
-            "sender": await self.get_user_data(self.user),
-            "receiver": await self.get_other_user_data(conversation),
-            "timestamp": saved_message.created_at.isoformat(),
+            "message_id": message.id,
+            "content": message.content,
+            "file_url": message.file.url if message.file else None,
+            "sender": self.get_user_data(self.user),
+            "receiver": self.context.other(self.user.id),
+            "timestamp": message.created_at.isoformat(),
             "is_read": False
         }
-        await self.broadcast_message(message_data)
+
+    async def queue_text_message(self, content, client_id=None):
+        """Write-behind path: broadcast and ack once the batch holding the message is committed."""
+        message = Message(
+            conversation_id=self.context.conversation_id, sender=self.user,
+            content=content, created_at=timezone.now(),
+        )
+        try:
+            await message_buffer.add(message)
+        except Exception as e:
+            print(f"Error saving message: {e}")
+            await self.send(text_data=json.dumps({"type": "message_failed", "client_id": client_id}))
+            return
+        await self.broadcast_message(self.message_payload(message))
+        await self.send(text_data=json.dumps({
+            "type": "message_ack", "client_id": client_id, "message_id": message.pk,
+        }))
 
     async def broadcast_message(self, message):
         await self.channel_layer.group_send(
             self.room_group_name,
-            {"type": "chat_message", "data": message}
+            broadcast.chat_event(message)
         )
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps(event["data"], cls=DjangoJSONEncoder))
+        await self.send(text_data=event["text"])
+
+    # --- Presence ---
+    async def join_presence(self):
+        """Count this connection as present and tell the client whether the other participant is.
+
+        ``online`` means connected anywhere, ``here`` connected to this conversation.
+        """
+        self.presence_rooms = [presence.ANYWHERE, self.room_group_name]
+        came_online = await presence.join_async(self.user.id, self.presence_rooms)
+        other_id = self.context.other(self.user.id)["id"]
+        await self.send(text_data=json.dumps({
+            "type": "presence",
+            "user_id": other_id,
+            "online": bool(await presence.online_async(presence.ANYWHERE, [other_id])),
+            "here": bool(await presence.online_async(self.room_group_name, [other_id])),
+            "heartbeat_interval": presence.HEARTBEAT_INTERVAL,
+        }))
+        if self.room_group_name in came_online:
+            await self.broadcast_message({"type": "presence", "user_id": self.user.id, "online": True, "here": True})
+
+    async def leave_presence(self):
+        went_offline = await presence.leave_async(self.user.id, self.presence_rooms)
+        if self.room_group_name in went_offline:
+            await self.broadcast_message({
+                "type": "presence",
+                "user_id": self.user.id,
+                "online": presence.ANYWHERE not in went_offline,
+                "here": False,
+            })
 
     # --- JWT Auth ---
     @database_sync_to_async
-    def authenticate_token(self, token):
+    def authenticate(self, token):
+        """Resolve the JWT user and load the conversation context in a single executor hop."""
         try:
             jwt_auth = JWTAuthentication()
             validated_token = jwt_auth.get_validated_token(token)
             self.user = jwt_auth.get_user(validated_token)
             self.scope["user"] = self.user
-            return True
         except Exception:
             return False
+        self.context = ConversationContext.load(self.conversation_id)
+        return True
+
+    # --- Reconnect replay ---
+    async def send_replay(self, last_message_id):
+        messages, has_more, conversation = await self.load_replay(last_message_id)
+        if conversation is None:
+            # Unknown anchor: the client has to reload the history
+            await self.send(text_data=json.dumps({"type": "replay", "reset": True}))
+            return
+        await self.send(text_data=broadcast.encode({
+            "type": "replay",
+            "messages": [self.replay_entry(m) for m in messages],
+            "has_more": has_more,
+            "read_cursors": [
+                {"user_id": conversation.initiator_id, "last_read_id": conversation.initiator_last_read_id},
+                {"user_id": conversation.receiver_id, "last_read_id": conversation.receiver_last_read_id},
+            ],
+        }))
 
-    # --- Conversation access ---
     @database_sync_to_async
-    def verify_conversation_access(self):
-        try:
-            conversation = Conversation.objects.get(id=self.conversation_id)
-            return self.user in [conversation.initiator, conversation.receiver]
-        except Conversation.DoesNotExist:
-            return False
+    def load_replay(self, last_message_id):
+        """Messages created, edited, deleted or liked since ``last_message_id`` was sent.
+
+        One range scan on (conversation, updated_at), oldest change first,
+        capped at REPLAY_LIMIT; ``has_more`` tells the client to page the
+        rest through the REST history instead.
+        """
+        conversation_id = self.context.conversation_id
+        anchor = Message.objects.filter(id=last_message_id, conversation_id=conversation_id).values_list(
+            'created_at', flat=True
+        ).first()
+        if anchor is None:
+            return [], False, None
+        conversation = Conversation.objects.get(pk=conversation_id)
+        messages = list(
+            Message.objects.filter(conversation_id=conversation_id, updated_at__gte=anchor)
+            .select_related('sender').order_by('updated_at', 'id')[:REPLAY_LIMIT + 1]
+        )
+        for message in messages:
+            message.conversation = conversation
+        return messages[:REPLAY_LIMIT], len(messages) > REPLAY_LIMIT, conversation
+
+    def replay_entry(self, message):
+        if message.is_deleted:
+            return {"message_id": message.id, "is_deleted": True}
+        return {
+            "message_id": message.id,
+            "content": message.content,
+            "file_url": message.file.url if message.file else None,
+            "sender": self.get_user_data(message.sender),
+            "timestamp": message.created_at.isoformat(),
+            "is_edited": message.is_edited,
+            "like_count": message.like_count,
+            "is_read": message.is_read,
+        }
+
+    async def conversation_changed(self, event):
+        """The conversation or one of its participants changed: reload the cached context."""
+        self.context = await database_sync_to_async(ConversationContext.load)(self.conversation_id)
+        if self.context is None or not self.context.has_participant(self.user.id):
+            await self.close(code=4003)
 
     # --- Save message ---
+    @database_sync_to_async
+    def create_text_message(self, content):
+        try:
+            # Message.save() refreshes the conversation summary in the same transaction
+            return Message.objects.create(
+                conversation_id=self.context.conversation_id, sender=self.user, content=content
+            )
+        except Exception as e:
+            print(f"Error saving message: {e}")
+            return None
+
     @database_sync_to_async
     def save_message(self, content, file_data=None):
+        """Legacy path for a base64 file inlined in a chat_message frame."""
         try:
-            conversation = Conversation.objects.get(id=self.conversation_id)
-            message = Message(conversation=conversation, sender=self.user, content=content)
+            message = Message(conversation_id=self.context.conversation_id, sender=self.user, content=content)
             
             if file_data:
                 fmt, file_str = file_data.split(';base64,')
                 ext = fmt.split('/')[-1]
-                message.file = ContentFile(base64.b64decode(file_str), name=f"{uuid.uuid4()}.{ext}")
+                message.file = blobs.store(ContentFile(base64.b64decode(file_str), name=f"{uuid.uuid4()}.{ext}")).name
             
+            # Message.save() refreshes the conversation summary in the same transaction
             message.save()
-            conversation.updated_at = timezone.now()
-            conversation.save(update_fields=["updated_at"])
-            return conversation, message
+            return message
         except Exception as e:
             print(f"Error saving message: {e}")
-            return None, None
+            return None
 
     async def message_edited(self, event):
         """Send edited message data to connected clients."""
@@ -154,30 +348,31 @@ class ChatConsumer(AsyncWebsocketConsumer):
             "type": "message_deleted",
             "message_id": event["message_id"],
         }))
-    @database_sync_to_async
     def get_user_data(self, user):
         return {"id": user.id, "username": user.username}
 
-    @database_sync_to_async
-    def get_other_user_data(self, conversation):
-        other = conversation.receiver if self.user == conversation.initiator else conversation.initiator
-        return {"id": other.id, "username": other.username}
+    async def handle_mark_read(self, message_id):
+        if await self.mark_message_as_read(message_id):
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {"type": "message.read", "reader_id": self.user.id, "last_read_id": message_id}
+            )
 
     @database_sync_to_async
     def mark_message_as_read(self, message_id):
-        try:
-            message = Message.objects.select_related("conversation").get(
-                id=message_id, conversation_id=self.conversation_id
-            )
-            if message.conversation.receiver_id == self.user.id:
-                message.is_read = True
-                message.save()
-                return True
-            return False
-        except Message.DoesNotExist:
+        """Advance this user's read cursor up to ``message_id``; False if it did not move."""
+        if not Message.objects.filter(id=message_id, conversation_id=self.context.conversation_id).exists():
             return False
+        return Conversation.mark_read(self.context.conversation_id, self.user.id, message_id)
+
+    async def message_read(self, event):
+        """A participant's read cursor moved: everything up to last_read_id is read."""
+        await self.send(text_data=json.dumps({
+            "type": "message_read",
+            "reader_id": event["reader_id"],
+            "last_read_id": event["last_read_id"],
+        }))
 
-  
     async def handle_edit_message(self, data):
         success = await self.edit_message_db(data["message_id"], data["new_content"])
         if success:
@@ -212,23 +407,28 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def delete_message_db(self, message_id):
-        try:
-            msg = Message.objects.get(id=message_id, sender=self.user)
-            msg.is_deleted = True
-            msg.deleted_at = timezone.now()
-            msg.save()
-            return True
-        except Message.DoesNotExist:
-            return False
+        now = timezone.now()
+        with transaction.atomic():
+            updated = Message.objects.filter(
+                id=message_id, sender=self.user, conversation_id=self.context.conversation_id,
+            ).update(is_deleted=True, deleted_at=now, updated_at=now)
+            if not updated:
+                return False
+            # The inbox must stop showing the message as the last one, or counting it as unread
+            conversation = Conversation.objects.select_for_update().get(pk=self.context.conversation_id)
+            if conversation.summary_includes(message_id, self.user.id):
+                conversation.refresh_summary()
+        return True
 
     @database_sync_to_async
     def handle_file_upload(self, file_data, content):
         try:
-            conversation = Conversation.objects.get(id=self.conversation_id)
             fmt, file_str = file_data.split(';base64,')
             ext = fmt.split('/')[-1]
-            file = ContentFile(base64.b64decode(file_str), name=f"{uuid.uuid4()}.{ext}")
-            message = Message.objects.create(conversation=conversation, sender=self.user, content=content, file=file)
+            file = blobs.store(ContentFile(base64.b64decode(file_str), name=f"{uuid.uuid4()}.{ext}")).name
+            message = Message.objects.create(
+                conversation_id=self.context.conversation_id, sender=self.user, content=content, file=file
+            )
             return {
                 "type": "chat_message",
                 "message": {
@@ -243,31 +443,132 @@ class ChatConsumer(AsyncWebsocketConsumer):
             print(f"File upload error: {e}")
             return None
 
+    # --- Binary chunked uploads ---
+    # upload_init (JSON) -> sequenced binary chunks -> upload_commit (JSON).
+    # Chunks go straight to a temp file; only one upload is open per connection.
+    # An upload_init carrying the sha256 of a stored file the sender can already read
+    # posts the message straight away and no chunks are sent.
+    async def handle_upload_init(self, data):
+        if self.upload is not None:
+            await self.send_upload_error(data.get("upload_id"), UploadError("Another upload is in progress", status=409))
+            return
+        if data.get("sha256"):
+            blob = await database_sync_to_async(access.acquire_readable)(self.user, data["sha256"])
+            if blob is not None:
+                await self.post_uploaded_file(data.get("upload_id"), blob.name, data.get("content", ""))
+                return
+        try:
+            self.upload = ChunkedUpload(data.get("upload_id"), data.get("file_name"), data.get("size"))
+        except UploadError as e:
+            await self.send_upload_error(data.get("upload_id"), e)
+            return
+        await self.send(text_data=json.dumps({
+            "type": "upload_ready",
+            "upload_id": self.upload.upload_id,
+            "max_chunk_size": MAX_CHUNK_SIZE,
+        }))
+
+    async def handle_upload_chunk(self, frame):
+        if self.upload is None:
+            await self.send_upload_error(None, UploadError("No upload in progress"))
+            return
+        # Chunks spend tokens like any other frame; the client resumes from expected_seq after retry_after
+        if await self.rate_limited(
+            {"type": "upload_chunk"}, upload_id=self.upload.upload_id, expected_seq=self.upload.next_seq
+        ):
+            self.upload.resending = True
+            return
+        try:
+            # Disk writes block; keep them off the event loop
+            await sync_to_async(self.upload.append_frame, thread_sensitive=False)(frame)
+        except UploadError as e:
+            upload_id = self.upload.upload_id
+            self.discard_upload()
+            await self.send_upload_error(upload_id, e)
+
+    async def handle_upload_commit(self, data):
+        upload = self.upload
+        if upload is None or upload.upload_id != data.get("upload_id"):
+            await self.send_upload_error(data.get("upload_id"), UploadError("Unknown upload"))
+            return
+        if not upload.complete:
+            await self.send_upload_error(upload.upload_id, UploadError(f"Received {upload.received} of {upload.size} bytes"))
+            return
+        self.upload = None
+        try:
+            # The digest was computed as the chunks arrived; identical bytes are stored once
+            blob = await blobs.store_async(upload.as_file(), upload.sha256.hexdigest(), upload.extension)
+        finally:
+            upload.discard()
+        await self.post_uploaded_file(upload.upload_id, blob.name, data.get("content", ""))
+
+    async def post_uploaded_file(self, upload_id, file_name, content):
+        message = await self.save_uploaded_message(file_name, content)
+        await self.broadcast_message({
+            "type": "chat_message",
+            "upload_id": upload_id,
+            "message_id": message.id,
+            "content": message.content,
+            "file_url": message.file.url,
+            "sender": {"id": self.user.id, "username": self.user.username},
+            "timestamp": message.created_at.isoformat(),
+            "is_read": False
+        })
+
+    async def send_upload_error(self, upload_id, error):
+        await self.send(text_data=json.dumps({
+            "type": "upload_error",
+            "upload_id": upload_id,
+            "error": error.message,
+            "status": error.status,
+        }))
+
+    def discard_upload(self):
+        if getattr(self, "upload", None) is not None:
+            self.upload.discard()
+            self.upload = None
+
+    @database_sync_to_async
+    def save_uploaded_message(self, file_name, content):
+        return Message.objects.create(
+            conversation_id=self.context.conversation_id, sender=self.user, content=content, file=file_name
+        )
+
+    async def handle_like(self, message_id):
+        result = await self.toggle_like(message_id)
+        if result:
+            await self.channel_layer.group_send(self.room_group_name, result)
+
     @database_sync_to_async
-    def handle_like(self, message_id):
+    def toggle_like(self, message_id):
         try:
-            message = Message.objects.get(id=message_id)
-            user = self.user
-            with transaction.atomic():
-                if user in message.likes.all():
-                    message.likes.remove(user)
-                    action = "unliked"
-                else:
-                    message.likes.add(user)
-                    action = "liked"
-                message.update_like_count()
+            liked, like_count = reactions.toggle_like(
+                Message, message_id, self.user.id, conversation_id=self.context.conversation_id
+            )
             return {
                 "type": "message.liked",
                 "message_id": message_id,
-                "user_id": user.id,
-                "action": action,
-                "like_count": message.like_count
+                "user_id": self.user.id,
+                "action": "liked" if liked else "unliked",
+                "like_count": like_count
             }
         except Exception as e:
             print(f"Like error: {e}")
             return None
 
+    async def message_liked(self, event):
+        await self.send(text_data=json.dumps({
+            "type": "message_liked",
+            "message_id": event["message_id"],
+            "user_id": event["user_id"],
+            "action": event["action"],
+            "like_count": event["like_count"],
+        }))
+
     async def disconnect(self, close_code):
+        self.discard_upload()
         if hasattr(self, "room_group_name"):
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if getattr(self, "presence_rooms", None):
+            await self.leave_presence()
         print(f"User disconnected with code {close_code}")
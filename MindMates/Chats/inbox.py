@@ -0,0 +1,46 @@
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Greatest, Least
+from MindMates import presence
+from Users.models import User
+from .models import Conversation
+
+
+def build_inbox(user, search=None):
+    """Every other user annotated with their DM with ``user`` and its latest message.
+
+    The conversation lookups are correlated subqueries against the
+    denormalized conversation summary, so the whole inbox is a single
+    SELECT no matter how many users exist.
+    """
+    convo = Conversation.objects.filter(
+        low_user_id=Least(Value(user.id), OuterRef('pk')),
+        high_user_id=Greatest(Value(user.id), OuterRef('pk')),
+    )
+
+    users = User.objects.exclude(id=user.id)
+    if search:
+        users = users.filter(username__icontains=search)
+
+    # The conversation row carries its own last-message summary
+    return users.annotate(
+        conversation_id=Subquery(convo.values('id')[:1]),
+        last_message=Subquery(convo.values('last_message_preview')[:1]),
+        last_message_at=Subquery(convo.values('last_message_at')[:1]),
+    ).only('id', 'username').order_by('id')
+
+
+def inbox_entries(users):
+    """Serialize an evaluated page of ``build_inbox`` rows, with presence looked up in one batch."""
+    online = set(presence.online(presence.ANYWHERE, [u.id for u in users]))
+    return [inbox_entry(u, online=u.id in online) for u in users]
+
+
+def inbox_entry(u, online=False):
+    return {
+        "conversation_id": u.conversation_id,
+        "user_id": u.id,
+        "name": u.username,
+        "online": online,
+        "lastMessage": u.last_message if u.last_message_at else "Start chatting",
+        "time": u.last_message_at.isoformat() if u.last_message_at else "",
+    }
@@ -0,0 +1,77 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from Chats.models import ArchivedMessage, Conversation, Message
+from Communities.models import ArchivedCommunityMessage, CommunityMessage
+from MediaFiles import blobs
+
+ARCHIVED_FIELDS = {
+    Message: ['id', 'conversation_id', 'sender_id', 'file', 'content', 'created_at', 'is_edited', 'like_count'],
+    CommunityMessage: [
+        'id', 'community_id', 'sender_id', 'content', 'file', 'file_name', 'file_url', 'file_size',
+        'created_at', 'is_edited', 'like_count',
+    ],
+}
+ARCHIVE_MODELS = {Message: ArchivedMessage, CommunityMessage: ArchivedCommunityMessage}
+
+
+class Command(BaseCommand):
+    help = (
+        "Move chat and community messages older than MESSAGE_ARCHIVE_AFTER_DAYS into the archive tables "
+        "and hard-delete messages soft-deleted more than SOFT_DELETE_PURGE_AFTER_DAYS ago."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.MESSAGE_ARCHIVE_AFTER_DAYS)
+        parser.add_argument('--purge-after-days', type=int, default=settings.SOFT_DELETE_PURGE_AFTER_DAYS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        archive_before = now - timedelta(days=options['older_than_days'])
+        purge_before = now - timedelta(days=options['purge_after_days'])
+
+        for model in (Message, CommunityMessage):
+            purge = model.objects.filter(is_deleted=True).filter(
+                Q(deleted_at__lt=purge_before) | Q(deleted_at__isnull=True, created_at__lt=purge_before)
+            )
+            cold = model.objects.filter(is_deleted=False, created_at__lt=archive_before)
+            if model is Message:
+                # A conversation's last message stays hot: the inbox and conversation list point at it
+                pinned = Conversation.objects.filter(last_message__isnull=False).values('last_message_id')
+                purge = purge.exclude(id__in=pinned)
+                cold = cold.exclude(id__in=pinned)
+
+            if options['dry_run']:
+                self.stdout.write(f"{model.__name__}: would purge {purge.count()}, archive {cold.count()}")
+                continue
+            purged = self.in_batches(purge, options['batch_size'], self.purge_batch)
+            archived = self.in_batches(cold, options['batch_size'], self.archive_batch)
+            self.stdout.write(f"{model.__name__}: purged {purged}, archived {archived}")
+
+    def in_batches(self, queryset, batch_size, handle_batch):
+        """Work through ``queryset`` one short transaction per batch, so hot-table locks stay brief."""
+        done = 0
+        while True:
+            with transaction.atomic():
+                ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    return done
+                handle_batch(queryset.model, ids)
+            done += len(ids)
+
+    def purge_batch(self, model, ids):
+        doomed = model.objects.filter(id__in=ids)
+        blobs.release(doomed.exclude(file='').exclude(file__isnull=True).values_list('file', flat=True))
+        doomed.delete()
+
+    def archive_batch(self, model, ids):
+        fields = ARCHIVED_FIELDS[model]
+        archive = ARCHIVE_MODELS[model]
+        rows = model.objects.filter(id__in=ids).values(*fields)
+        archive.objects.bulk_create([archive(**row) for row in rows], ignore_conflicts=True)
+        model.objects.filter(id__in=ids).delete()
@@ -0,0 +1,59 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Serve the ASGI application from several Daphne worker processes sharing one listening socket."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--bind', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8000)
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        backend = settings.CHANNEL_LAYERS['default']['BACKEND']
+        if workers > 1 and backend == 'channels.layers.InMemoryChannelLayer':
+            raise CommandError(
+                "The in-memory channel layer only reaches sockets in its own process; "
+                "set REDIS_URL to run more than one worker."
+            )
+
+        # The kernel spreads incoming connections over every worker accepting on this socket
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((options['bind'], options['port']))
+        sock.listen(1024)
+        fd = sock.fileno()
+
+        module, _, attr = settings.ASGI_APPLICATION.rpartition('.')
+        command = [
+            sys.executable, '-m', 'daphne', '--fd', str(fd),
+            # Daphne's keepalive pings close sockets whose peer has gone away without a FIN
+            '--ping-interval', str(settings.WS_PING_INTERVAL), '--ping-timeout', str(settings.WS_PING_TIMEOUT),
+            f'{module}:{attr}',
+        ]
+        procs = {}
+        for _ in range(workers):
+            proc = subprocess.Popen(command, pass_fds=(fd,))
+            procs[proc.pid] = proc
+        self.stdout.write(f"Serving on {options['bind']}:{options['port']} with {workers} workers ({backend})")
+
+        try:
+            while procs:
+                pid, status = os.wait()
+                if procs.pop(pid, None) is not None:
+                    self.stderr.write(f"Worker {pid} exited with code {os.waitstatus_to_exitcode(status)}")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for proc in procs.values():
+                proc.send_signal(signal.SIGTERM)
+            for proc in procs.values():
+                proc.wait()
+            sock.close()
@@ -0,0 +1,59 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_summary(apps, schema_editor):
+    Conversation = apps.get_model("Chats", "Conversation")
+    Message = apps.get_model("Chats", "Message")
+    for convo in Conversation.objects.iterator():
+        messages = Message.objects.filter(conversation_id=convo.pk)
+        last = messages.order_by("-created_at", "-id").first()
+        unread = messages.filter(is_read=False)
+        Conversation.objects.filter(pk=convo.pk).update(
+            last_message=last,
+            last_message_preview=last.content[:255] if last else "",
+            last_message_at=last.created_at if last else None,
+            initiator_unread_count=unread.exclude(sender_id=convo.initiator_id).count(),
+            receiver_unread_count=unread.exclude(sender_id=convo.receiver_id).count(),
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("Chats", "0008_conversation_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="last_message",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="Chats.message",
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="last_message_preview",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="last_message_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="initiator_unread_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="receiver_unread_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+from MindMates.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("Chats", "0009_conversation_summary"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="conversation",
+            index=models.Index(fields=["initiator", "receiver"], name="chats_convo_pair_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="conversation",
+            index=models.Index(fields=["initiator", "-updated_at"], name="chats_convo_init_upd_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="conversation",
+            index=models.Index(fields=["receiver", "-updated_at"], name="chats_convo_recv_upd_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="message",
+            index=models.Index(fields=["conversation", "created_at", "id"], name="chats_msg_convo_created_idx"),
+        ),
+    ]
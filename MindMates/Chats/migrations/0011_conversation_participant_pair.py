@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_pairs(apps, schema_editor):
+    """Fill in the canonical pair and fold duplicate DMs into the oldest one."""
+    Conversation = apps.get_model("Chats", "Conversation")
+    Message = apps.get_model("Chats", "Message")
+    keepers = {}
+    for convo in Conversation.objects.order_by("id").iterator():
+        pair = tuple(sorted((convo.initiator_id, convo.receiver_id)))
+        keeper = keepers.setdefault(pair, convo)
+        if keeper.pk != convo.pk:
+            Message.objects.filter(conversation_id=convo.pk).update(conversation_id=keeper.pk)
+            convo.delete()
+            continue
+        Conversation.objects.filter(pk=convo.pk).update(low_user_id=pair[0], high_user_id=pair[1])
+
+    for keeper in keepers.values():
+        messages = Message.objects.filter(conversation_id=keeper.pk)
+        if not messages.exists():
+            continue
+        last = messages.order_by("-created_at", "-id").first()
+        unread = messages.filter(is_read=False)
+        Conversation.objects.filter(pk=keeper.pk).update(
+            last_message=last,
+            last_message_preview=last.content[:255],
+            last_message_at=last.created_at,
+            initiator_unread_count=unread.exclude(sender_id=keeper.initiator_id).count(),
+            receiver_unread_count=unread.exclude(sender_id=keeper.receiver_id).count(),
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("Chats", "0010_hot_path_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="low_user",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="high_user",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.RunPython(backfill_pairs, migrations.RunPython.noop),
+    ]
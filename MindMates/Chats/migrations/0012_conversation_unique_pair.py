@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # Kept apart from the backfill so PostgreSQL has no pending FK trigger
+    # events on the table when it is altered.
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("Chats", "0011_conversation_participant_pair"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="conversation",
+            name="low_user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="conversation",
+            name="high_user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="conversation",
+            constraint=models.UniqueConstraint(
+                fields=("low_user", "high_user"), name="chats_convo_unique_pair"
+            ),
+        ),
+        # Superseded by the unique pair key
+        migrations.RemoveIndex(
+            model_name="conversation",
+            name="chats_convo_pair_idx",
+        ),
+    ]
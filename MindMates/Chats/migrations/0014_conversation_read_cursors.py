@@ -0,0 +1,44 @@
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_read_cursors(apps, schema_editor):
+    """Turn per-message is_read flags into one cursor per participant."""
+    Conversation = apps.get_model("Chats", "Conversation")
+    Message = apps.get_model("Chats", "Message")
+    for convo in Conversation.objects.iterator():
+        messages = Message.objects.filter(conversation_id=convo.pk)
+        cursors = {}
+        for reader_id, other_id in (
+            (convo.initiator_id, convo.receiver_id),
+            (convo.receiver_id, convo.initiator_id),
+        ):
+            incoming = messages.filter(sender_id=other_id)
+            last_read = incoming.filter(is_read=True).aggregate(last=Max("id"))["last"] or 0
+            cursors[reader_id] = (last_read, incoming.filter(id__gt=last_read).count())
+        Conversation.objects.filter(pk=convo.pk).update(
+            initiator_last_read_id=cursors[convo.initiator_id][0],
+            initiator_unread_count=cursors[convo.initiator_id][1],
+            receiver_last_read_id=cursors[convo.receiver_id][0],
+            receiver_unread_count=cursors[convo.receiver_id][1],
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("Chats", "0013_uploadsession"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="initiator_last_read_id",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="receiver_last_read_id",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_read_cursors, migrations.RunPython.noop),
+    ]
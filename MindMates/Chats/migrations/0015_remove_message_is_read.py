@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Separate from the backfill so the column drop runs in its own transaction
+    dependencies = [
+        ("Chats", "0014_conversation_read_cursors"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="message",
+            name="is_read",
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+from django.db.models import F
+from MindMates.operations import AddIndexConcurrently
+
+
+def backfill_updated_at(apps, schema_editor):
+    Message = apps.get_model("Chats", "Message")
+    Message.objects.filter(updated_at__isnull=True).update(updated_at=F("created_at"))
+
+
+class Migration(migrations.Migration):
+    # Each step commits on its own so the index can be built concurrently
+    atomic = False
+
+    dependencies = [
+        ("Chats", "0015_remove_message_is_read"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="updated_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop, atomic=True),
+        migrations.AlterField(
+            model_name="message",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        AddIndexConcurrently(
+            model_name="message",
+            index=models.Index(fields=["conversation", "updated_at"], name="chats_msg_convo_updated_idx"),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations
+from MindMates.operations import full_text_index_sql
+
+forwards, backwards = full_text_index_sql("Chats_message", "chats_msg_search_idx")
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("Chats", "0016_message_updated_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards, atomic=False),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Chats', '0017_message_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('file', models.FileField(blank=True, upload_to='ChatsFiles/')),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField()),
+                ('is_edited', models.BooleanField(default=False)),
+                ('like_count', models.PositiveIntegerField(default=0)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='Chats.conversation')),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['conversation', 'created_at', 'id'], name='chats_archmsg_convo_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+from MindMates.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("Chats", "0018_archivedmessage"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="message",
+            index=models.Index(
+                condition=models.Q(("file", ""), _negated=True), fields=["file"], name="chats_msg_file_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="archivedmessage",
+            index=models.Index(
+                condition=models.Q(("file", ""), _negated=True), fields=["file"], name="chats_archmsg_file_idx"
+            ),
+        ),
+    ]
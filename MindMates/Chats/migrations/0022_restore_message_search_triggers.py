@@ -0,0 +1,17 @@
+from django.db import migrations
+from MindMates.operations import full_text_index_sql
+
+# 0021 rebuilt Chats_message on SQLite, which dropped the FTS triggers from 0017
+forwards, _ = full_text_index_sql("Chats_message", "chats_msg_search_idx")
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("Chats", "0021_message_created_at_default"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop, atomic=False),
+    ]
@@ -1,14 +1,171 @@
-from django.db import models
+import os
+import uuid
+from collections import Counter
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.utils import timezone
 # Create your models here.
+PREVIEW_LENGTH = 255
+
+
+class ConversationQuerySet(models.QuerySet):
+    def between(self, user_a, user_b):
+        """The DM between two users, whichever of them started it: one unique-index probe."""
+        low, high = sorted((getattr(user_a, 'pk', user_a), getattr(user_b, 'pk', user_b)))
+        return self.filter(low_user_id=low, high_user_id=high)
+
+    def get_or_create_between(self, initiator, receiver):
+        """Race-free get-or-create; concurrent creators collide on the unique pair key."""
+        low, high = sorted((initiator.pk, receiver.pk))
+        return self.get_or_create(
+            low_user_id=low, high_user_id=high,
+            defaults={'initiator': initiator, 'receiver': receiver},
+        )
+
+
 class Conversation(models.Model):
     initiator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='convo_starter')
     receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='convo_participate')
+    # Canonical (smaller id, larger id) participant pair, filled in by save()
+    low_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    high_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized summary, kept in step with every message insert
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default='')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    initiator_unread_count = models.PositiveIntegerField(default=0)
+    receiver_unread_count = models.PositiveIntegerField(default=0)
+    # Read cursors: id of the newest message each participant has read
+    initiator_last_read_id = models.PositiveBigIntegerField(default=0)
+    receiver_last_read_id = models.PositiveBigIntegerField(default=0)
     
+    objects = ConversationQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['low_user', 'high_user'], name='chats_convo_unique_pair'),
+        ]
+        indexes = [
+            # Conversation list: (initiator = u OR receiver = u) ORDER BY updated_at DESC
+            models.Index(fields=['initiator', '-updated_at'], name='chats_convo_init_upd_idx'),
+            models.Index(fields=['receiver', '-updated_at'], name='chats_convo_recv_upd_idx'),
+        ]
+
     def __str__(self):
         return f"Conversation between {self.initiator} and {self.receiver}"
+
+    def save(self, *args, **kwargs):
+        self.low_user_id, self.high_user_id = sorted((self.initiator_id, self.receiver_id))
+        super().save(*args, **kwargs)
+
+    def unread_count_for(self, user):
+        if user.id == self.initiator_id:
+            return self.initiator_unread_count
+        if user.id == self.receiver_id:
+            return self.receiver_unread_count
+        return 0
+
+    @staticmethod
+    def summary_update(messages):
+        """UPDATE kwargs that record the last of ``messages`` as the latest one in their conversation.
+
+        Each participant's unread counter is bumped in the same statement by
+        the number of those messages they did not send themselves.
+        """
+        last = messages[-1]
+        sent_by = Counter(m.sender_id for m in messages)
+
+        def unread(participant):
+            counter = f'{participant}_unread_count'
+            return Case(
+                *[When(**{f'{participant}_id': sender_id}, then=F(counter) + len(messages) - sent)
+                  for sender_id, sent in sent_by.items()],
+                default=F(counter) + len(messages),
+                output_field=models.PositiveIntegerField(),
+            )
+
+        return {
+            'last_message_id': last.id,
+            'last_message_preview': last.content[:PREVIEW_LENGTH],
+            'last_message_at': last.created_at,
+            'updated_at': last.created_at,
+            'initiator_unread_count': unread('initiator'),
+            'receiver_unread_count': unread('receiver'),
+        }
+
+    @classmethod
+    def record_messages(cls, messages):
+        """Summary bookkeeping for messages inserted in bulk, one UPDATE per conversation."""
+        by_conversation = {}
+        for message in sorted(messages, key=lambda m: (m.created_at, m.id)):
+            by_conversation.setdefault(message.conversation_id, []).append(message)
+        for conversation_id, batch in by_conversation.items():
+            cls.objects.filter(pk=conversation_id).update(**cls.summary_update(batch))
+
+    def last_read_id_for(self, user_id):
+        if user_id == self.initiator_id:
+            return self.initiator_last_read_id
+        if user_id == self.receiver_id:
+            return self.receiver_last_read_id
+        return 0
+
+    @classmethod
+    def mark_read(cls, conversation_id, reader_id, message_id):
+        """Advance the reader's cursor to ``message_id`` in a single UPDATE.
+
+        The reader's unread counter is recomputed from the new cursor in the
+        same statement. Cursors only move forward; returns False when there
+        was nothing to advance.
+        """
+        unread_after = Subquery(
+            Message.objects.filter(conversation_id=OuterRef('pk'), id__gt=message_id, is_deleted=False)
+            .exclude(sender_id=reader_id).order_by()
+            .values('conversation_id').annotate(n=Count('id')).values('n')[:1],
+            output_field=models.PositiveIntegerField(),
+        )
+
+        def advance(participant, value, current):
+            return Case(
+                When(**{f'{participant}_id': reader_id, f'{participant}_last_read_id__lt': message_id}, then=value),
+                default=current,
+                output_field=models.PositiveBigIntegerField(),
+            )
+
+        return cls.objects.filter(
+            Q(initiator_id=reader_id, initiator_last_read_id__lt=message_id)
+            | Q(receiver_id=reader_id, receiver_last_read_id__lt=message_id),
+            pk=conversation_id,
+        ).update(
+            initiator_last_read_id=advance('initiator', Value(message_id), F('initiator_last_read_id')),
+            receiver_last_read_id=advance('receiver', Value(message_id), F('receiver_last_read_id')),
+            initiator_unread_count=advance('initiator', Coalesce(unread_after, 0), F('initiator_unread_count')),
+            receiver_unread_count=advance('receiver', Coalesce(unread_after, 0), F('receiver_unread_count')),
+        ) > 0
+
+    def summary_includes(self, message_id, sender_id):
+        """Whether the summary reflects this message: it is the last one, or its recipient has not read it."""
+        recipient_id = self.receiver_id if sender_id == self.initiator_id else self.initiator_id
+        return message_id == self.last_message_id or message_id > self.last_read_id_for(recipient_id)
+
+    def refresh_summary(self):
+        """Recompute the last-message fields and unread counters, e.g. after a message was removed."""
+        live = self.messages.filter(is_deleted=False)
+        last = live.order_by('-created_at', '-id').first()
+        self.last_message = last
+        self.last_message_preview = last.content[:PREVIEW_LENGTH] if last else ''
+        self.last_message_at = last.created_at if last else None
+        self.initiator_unread_count = live.filter(id__gt=self.initiator_last_read_id).exclude(
+            sender_id=self.initiator_id).count()
+        self.receiver_unread_count = live.filter(id__gt=self.receiver_last_read_id).exclude(
+            sender_id=self.receiver_id).count()
+        self.save(update_fields=[
+            'last_message', 'last_message_preview', 'last_message_at', 'initiator_unread_count', 'receiver_unread_count',
+        ])
     
     
     
@@ -17,8 +174,10 @@ class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name="sent_messages")
     file =  models.FileField(upload_to='ChatsFiles/',blank=True)
     content = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
+    # Not auto_now_add: write-behind batches keep the time the message was broadcast with
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    # Bumped by every edit, delete and like; drives reconnect replay
+    updated_at = models.DateTimeField(auto_now=True)
     is_edited = models.BooleanField(default=False)
     is_deleted = models.BooleanField(default=False)
     deleted_at = models.DateTimeField(null=True, blank=True)
@@ -30,9 +189,101 @@ class Message(models.Model):
     like_count = models.PositiveIntegerField(default=0)
 
     class Meta:
-        ordering = ['-created_at']    
+        ordering = ['-created_at']
+        indexes = [
+            # History windows and keyset pages within a conversation
+            models.Index(fields=['conversation', 'created_at', 'id'], name='chats_msg_convo_created_idx'),
+            # Reconnect replay: everything in a conversation changed since a point in time
+            models.Index(fields=['conversation', 'updated_at'], name='chats_msg_convo_updated_idx'),
+            # Media access checks: which messages carry a given file
+            models.Index(fields=['file'], condition=~models.Q(file=''), name='chats_msg_file_idx'),
+        ]
     def __str__(self):
         return f"Message from {self.sender} in {self.conversation}"
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                Conversation.objects.filter(pk=self.conversation_id).update(**Conversation.summary_update([self]))
+            elif update_fields is None or 'content' in update_fields:
+                # Keep the preview in step when the latest message is edited
+                Conversation.objects.filter(pk=self.conversation_id, last_message_id=self.pk).update(
+                    last_message_preview=self.content[:PREVIEW_LENGTH]
+                )
+
+    @property
+    def is_read(self):
+        """Whether the other participant's read cursor has reached this message."""
+        conversation = self.conversation
+        recipient_id = conversation.receiver_id if self.sender_id == conversation.initiator_id else conversation.initiator_id
+        return conversation.last_read_id_for(recipient_id) >= self.id
+
     def update_like_count(self):
         self.like_count = self.likes.count()
         self.save(update_fields=['like_count'])
+
+
+class ArchivedMessage(models.Model):
+    """A cold Message moved out of the hot table by ``manage.py archive_messages``.
+
+    Keeps the original id and (created_at, id) position, so history
+    cursors carry on across the boundary; likes survive only as the count.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='archived_messages')
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    file = models.FileField(upload_to='ChatsFiles/', blank=True)
+    content = models.TextField()
+    created_at = models.DateTimeField()
+    is_edited = models.BooleanField(default=False)
+    like_count = models.PositiveIntegerField(default=0)
+
+    # Serializes like a Message
+    is_deleted = False
+    is_read = Message.is_read
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['conversation', 'created_at', 'id'], name='chats_archmsg_convo_idx'),
+            models.Index(fields=['file'], condition=~models.Q(file=''), name='chats_archmsg_file_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived message from {self.sender_id} in conversation {self.conversation_id}"
+
+
+class UploadSession(models.Model):
+    """A resumable upload being assembled on disk, finalized into a chat or community message.
+
+    A finalized session keeps its row, with ``message_id`` set, so a
+    retried finalize gets the same answer instead of a second message.
+    Sessions idle for RESUMABLE_UPLOAD_EXPIRY_HOURS are removed by
+    ``manage.py sweep_media``.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, null=True, blank=True)
+    community = models.ForeignKey('Communities.Community', on_delete=models.CASCADE, null=True, blank=True)
+    file_name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    content = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Id of the Message or CommunityMessage the upload was finalized into
+    message_id = models.PositiveBigIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.offset}/{self.size}) by {self.user}"
+
+    @property
+    def completed(self):
+        return self.message_id is not None
+
+    @property
+    def temp_path(self):
+        return os.path.join(settings.RESUMABLE_UPLOAD_DIR, str(self.id))
@@ -1,6 +1,128 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+from datetime import datetime
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
-class MessagePagination(PageNumberPagination):
+
+def encode_cursor(message):
+    """Opaque cursor for a message's position in (created_at, id) order."""
+    raw = f"{message.created_at.isoformat()}|{message.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor(); returns (created_at, id) or None if malformed."""
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+class MessageCursorPagination(BasePagination):
+    """Keyset pagination over ``(created_at, id)`` for message history.
+
+    With no cursor the newest page is returned; ``?before=`` walks back in
+    time and ``?after=`` forward. Every page is a single index range scan
+    with no OFFSET and no COUNT(*), so page 5,000 costs the same as page 1.
+    Rows within a page are in chronological order.
+    """
     page_size = 20
     page_size_query_param = 'page_size'
     max_page_size = 100
+    before_query_param = 'before'
+    after_query_param = 'after'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            size = self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def _decode(self, request, param):
+        cursor = request.query_params.get(param)
+        if cursor is None:
+            return None
+        position = decode_cursor(cursor)
+        if position is None:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+        before = self._decode(request, self.before_query_param)
+        after = self._decode(request, self.after_query_param)
+        # Views with an archive tier expose it as get_archive_queryset()
+        archive = view.get_archive_queryset() if hasattr(view, 'get_archive_queryset') else None
+
+        if after is not None:
+            rows = self._page(queryset, after, forward=True, size=size)
+            if archive is not None:
+                # Cheap when the cursor is already past the archived range
+                rows = self._merge(rows, self._page(archive, after, forward=True, size=size), forward=True)
+            self.has_newer = len(rows) > size
+            self.has_older = True
+            rows = rows[:size]
+        else:
+            rows = self._page(queryset, before, forward=False, size=size)
+            if archive is not None and len(rows) <= size:
+                # The hot table ran out: the rest of the page comes from the archive
+                rows = self._merge(rows, self._page(archive, before, forward=False, size=size), forward=False)
+            self.has_older = len(rows) > size
+            self.has_newer = before is not None
+            rows = rows[:size]
+            rows.reverse()
+
+        self.page = rows
+        return rows
+
+    @staticmethod
+    def _page(queryset, position, forward, size):
+        """Up to ``size + 1`` rows past ``position`` in the given direction, nearest first."""
+        if position is not None:
+            created_at, pk = position
+            if forward:
+                queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+            else:
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        ordering = ('created_at', 'id') if forward else ('-created_at', '-id')
+        return list(queryset.order_by(*ordering)[:size + 1])
+
+    @staticmethod
+    def _merge(rows, more, forward):
+        if not more:
+            return rows
+        return sorted(rows + more, key=lambda m: (m.created_at, m.pk), reverse=not forward)
+
+    def _link(self, param, other, message):
+        url = remove_query_param(self.request.build_absolute_uri(), other)
+        return replace_query_param(url, param, encode_cursor(message))
+
+    def get_previous_link(self):
+        if not self.page or not self.has_older:
+            return None
+        return self._link(self.before_query_param, self.after_query_param, self.page[0])
+
+    def get_next_link(self):
+        if not self.page or not self.has_newer:
+            return None
+        return self._link(self.after_query_param, self.before_query_param, self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class InboxPagination(PageNumberPagination):
+    # Opt-in: the sidebar is only paginated when the client asks for a page size
+    page_size = None
+    page_size_query_param = 'page_size'
+    max_page_size = 200
@@ -1,13 +1,37 @@
+from django.db.models import F, Prefetch, Window
+from django.db.models.functions import RowNumber
 from .models import Conversation, Message
+from .pagination import MessageCursorPagination, encode_cursor
 from Users.serializers import UserSerializer
 from rest_framework import serializers
+from MindMates.reactions import LikedListSerializer, is_liked
+from MediaFiles.fields import ImageVariantsField
+
+DEFAULT_MESSAGE_WINDOW = 50
+MAX_MESSAGE_WINDOW = 100
+
+
+def recent_messages_prefetch(limit=DEFAULT_MESSAGE_WINDOW):
+    """Prefetch the newest ``limit + 1`` messages of every conversation in one query.
+
+    The extra row tells ConversationSerializer whether older history exists.
+    """
+    ranked = Message.objects.filter(is_deleted=False).annotate(
+        row_number=Window(
+            RowNumber(),
+            partition_by=F('conversation_id'),
+            order_by=[F('created_at').desc(), F('id').desc()],
+        )
+    ).filter(row_number__lte=limit + 1).select_related('sender__userprofile').order_by('-created_at', '-id')
+    return Prefetch('messages', queryset=ranked, to_attr='recent_messages')
 
 class MessageSerializer(serializers.ModelSerializer):
     file_url = serializers.SerializerMethodField()
+    file_variants = ImageVariantsField(source='file')
     sender = UserSerializer(read_only=True)
     class Meta:
         model = Message
-        fields = ['id', 'sender', 'content', 'file', 'file_url', 'created_at', 'is_read']
+        fields = ['id', 'sender', 'content', 'file', 'file_url', 'file_variants', 'created_at', 'is_read']
         read_only_fields = ['sender', 'created_at', 'is_read']
         
     def get_file_url(self, obj):
@@ -21,32 +45,84 @@ class ConversationListSerializer(serializers.ModelSerializer):
     initiator = UserSerializer()
     receiver = UserSerializer()
     last_message = serializers.SerializerMethodField()
+    unread_count = serializers.SerializerMethodField()
     class Meta:
         model = Conversation
-        fields = ['initiator', 'receiver','created_at', 'last_message']
+        fields = ['id', 'initiator', 'receiver','created_at', 'updated_at', 'last_message', 'unread_count']
 
     def get_last_message(self, instance):
-        message = instance.messages.order_by('-created_at').first()
-        return MessageSerializer(message).data if message else None
+        # Served from the denormalized pointer; the view select_related()s it
+        message = instance.last_message
+        if message is None:
+            return None
+        # is_read reads the conversation's cursors; reuse this instance rather than fetch it again
+        message.conversation = instance
+        return MessageSerializer(message, context=self.context).data
+
+    def get_unread_count(self, instance):
+        request = self.context.get('request')
+        return instance.unread_count_for(request.user) if request else 0
 
 
 
 class ConversationSerializer(serializers.ModelSerializer):
+    """Conversation with a bounded window of its most recent messages.
+
+    Expects ``recent_messages`` to be prefetched (see
+    ``recent_messages_prefetch``); ``next_cursor`` continues the history
+    through the message list endpoint with ``?before=``. A window that
+    the hot table cannot fill is topped up from the archive, so
+    ``has_more`` stays true while archived history remains.
+    """
     initiator = UserSerializer()
     receiver = UserSerializer()
-    message_set = MessageSerializer(many=True, source='messages') 
+    message_set = serializers.SerializerMethodField()
+    has_more = serializers.SerializerMethodField()
+    next_cursor = serializers.SerializerMethodField()
     
     class Meta:
         model = Conversation
-        fields = ['initiator', 'receiver','message_set']
+        fields = ['id', 'initiator', 'receiver','message_set', 'has_more', 'next_cursor']
+
+    def _window(self, instance):
+        window = getattr(instance, '_message_window', None)
+        if window is not None:
+            return window
+        limit = self.context.get('message_limit', DEFAULT_MESSAGE_WINDOW)
+        messages = getattr(instance, 'recent_messages', None)
+        if messages is None:
+            messages = list(instance.messages.filter(is_deleted=False).select_related('sender__userprofile')
+                            .order_by('-created_at', '-id')[:limit + 1])
+        if len(messages) <= limit:
+            # The hot table ran out inside the window; only then is the archive consulted
+            last = messages[-1] if messages else None
+            messages = messages + MessageCursorPagination._page(
+                instance.archived_messages.select_related('sender__userprofile'),
+                (last.created_at, last.pk) if last else None, forward=False, size=limit - len(messages),
+            )
+        window = instance._message_window = (messages[:limit], len(messages) > limit)
+        return window
+
+    def get_message_set(self, instance):
+        messages, _ = self._window(instance)
+        return MessageSerializer(messages, many=True, context=self.context).data
+
+    def get_has_more(self, instance):
+        return self._window(instance)[1]
+
+    def get_next_cursor(self, instance):
+        messages, has_more = self._window(instance)
+        return encode_cursor(messages[-1]) if has_more else None
         
 class FileUploadSerializer(serializers.ModelSerializer):
     file = serializers.FileField(required=False)
     content = serializers.CharField(required=False, allow_blank=True)
+    # Digest of a file the sender can already read: re-share it without uploading
+    sha256 = serializers.CharField(required=False, write_only=True)
     
     class Meta:
         model = Message
-        fields = ['content', 'file']
+        fields = ['content', 'file', 'sha256']
     
 class MessageLikeSerializer(serializers.ModelSerializer):
     is_liked = serializers.SerializerMethodField()
@@ -54,7 +130,7 @@ class MessageLikeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = ['id', 'like_count', 'is_liked']
+        list_serializer_class = LikedListSerializer
     
     def get_is_liked(self, obj):
-        request = self.context.get('request')
-        return request and request.user in obj.likes.all()
\ No newline at end of file
+        return is_liked(self, obj)
\ No newline at end of file
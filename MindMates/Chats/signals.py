@@ -0,0 +1,45 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Conversation
+
+# Saves touching only other fields (summary counters, last_login, ...) leave
+# the consumers' cached ConversationContext valid
+CONVERSATION_CONTEXT_FIELDS = {'initiator', 'receiver', 'low_user', 'high_user'}
+USER_CONTEXT_FIELDS = {'username', 'is_active'}
+
+
+def notify_conversations_changed(conversation_ids):
+    """Tell connected ChatConsumers to reload their context once the write commits."""
+    def send():
+        channel_layer = get_channel_layer()
+        for conversation_id in conversation_ids:
+            async_to_sync(channel_layer.group_send)(f"chat_{conversation_id}", {"type": "conversation.changed"})
+    transaction.on_commit(send)
+
+
+@receiver(post_save, sender=Conversation)
+def conversation_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not CONVERSATION_CONTEXT_FIELDS & set(update_fields)):
+        return
+    notify_conversations_changed([instance.pk])
+
+
+@receiver(post_delete, sender=Conversation)
+def conversation_deleted(sender, instance, **kwargs):
+    notify_conversations_changed([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def participant_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not USER_CONTEXT_FIELDS & set(update_fields)):
+        return
+    conversation_ids = list(Conversation.objects.filter(
+        Q(initiator=instance) | Q(receiver=instance)
+    ).values_list('id', flat=True))
+    if conversation_ids:
+        notify_conversations_changed(conversation_ids)
@@ -1,3 +1,846 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+from django.core.management import call_command
+from channels.db import DatabaseSyncToAsync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from unittest import mock
+from rest_framework_simplejwt.tokens import AccessToken
+from MindMates import throttle, write_behind
+from MindMates.db_executor import InstrumentedThreadPoolExecutor, database_sync_to_async, get_executor
+from MindMates.testing import SharedChannelLayer, count_db_work, full_scans, measure_frame, query_plan, receive_type, report, ws_connect
+from . import consumers, views
+from Communities.models import Community, CommunityMessage
+from .models import ArchivedMessage, Conversation, Message, UploadSession
+from .uploads import CHUNK_HEADER
 
-# Create your tests here.
+
+def make_user(username):
+    # No password: hashing one per user would dominate the run time
+    return User.objects.create(username=username, email=f'{username}@example.com')
+
+
+def api_client(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def temp_media(test_case):
+    """Point MEDIA_ROOT and the resumable upload directory at fresh temp dirs for one test case."""
+    root = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, root, ignore_errors=True)
+    override = override_settings(
+        MEDIA_ROOT=os.path.join(root, 'media'), RESUMABLE_UPLOAD_DIR=os.path.join(root, 'uploads'),
+    )
+    override.enable()
+    test_case.addCleanup(override.disable)
+    return root
+
+
+class InboxTests(TestCase):
+    def setUp(self):
+        self.me = make_user('me')
+        self.client = api_client(self.me)
+
+    def add_contacts(self, total):
+        """Grow the user table to ``total`` other users, each with a DM and a message."""
+        for i in range(User.objects.count() - 1, total):
+            other = make_user(f'user{i:04d}')
+            conversation, _ = Conversation.objects.get_or_create_between(self.me, other)
+            Message.objects.create(conversation=conversation, sender=other, content=f'hello {i}')
+
+    def test_query_count_does_not_grow_with_users(self):
+        counts = []
+        for total in (5, 50, 200):
+            self.add_contacts(total)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('all-users-for-chat'))
+            self.assertEqual(len(response.data), total)
+            counts.append(len(queries))
+        self.assertEqual(len(set(counts)), 1, f"query counts grew with the user table: {counts}")
+
+    def test_entries_carry_last_message(self):
+        self.add_contacts(3)
+        stranger = make_user('stranger')
+        entries = {e['name']: e for e in self.client.get(reverse('all-users-for-chat')).data}
+        self.assertEqual(entries['user0000']['lastMessage'], 'hello 0')
+        self.assertIsNotNone(entries['user0000']['conversation_id'])
+        self.assertEqual(entries[stranger.username]['lastMessage'], 'Start chatting')
+        self.assertIsNone(entries[stranger.username]['conversation_id'])
+        self.assertNotIn(self.me.username, entries)
+
+    def test_search_and_pagination(self):
+        self.add_contacts(30)
+        response = self.client.get(reverse('all-users-for-chat'), {'search': 'user001'})
+        self.assertEqual([e['name'] for e in response.data], [f'user001{i}' for i in range(10)])
+
+        page = self.client.get(reverse('all-users-for-chat'), {'page_size': 10, 'page': 2}).data
+        self.assertEqual(page['count'], 30)
+        self.assertEqual(len(page['results']), 10)
+        self.assertEqual(page['results'][0]['name'], 'user0010')
+
+
+class HotPathIndexTests(TestCase):
+    """The chat queries that run on every request are served by an index, not a table scan."""
+
+    def setUp(self):
+        self.alice, self.bob = make_user('alice'), make_user('bob')
+        self.conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+        for i in range(20):
+            Message.objects.create(conversation=self.conversation, sender=self.alice, content=f'm{i}')
+
+    def assert_index_scan(self, queryset, index_name=None):
+        plan = query_plan(queryset)
+        self.assertEqual(full_scans(plan), [], plan)
+        if index_name:
+            self.assertIn(index_name, plan)
+
+    def test_message_window(self):
+        self.assert_index_scan(
+            Message.objects.filter(conversation=self.conversation, is_deleted=False).order_by('-created_at', '-id')[:51],
+            'chats_msg_convo_created_idx',
+        )
+
+    def test_message_keyset_page(self):
+        last = Message.objects.order_by('-id').first()
+        self.assert_index_scan(
+            Message.objects.filter(conversation=self.conversation, is_deleted=False)
+            .filter(Q(created_at__lt=last.created_at) | Q(created_at=last.created_at, id__lt=last.id))
+            .order_by('-created_at', '-id')[:21],
+            'chats_msg_convo_created_idx',
+        )
+
+    def test_conversation_by_pair(self):
+        self.assert_index_scan(Conversation.objects.between(self.bob, self.alice))
+
+    def test_conversation_list(self):
+        self.assert_index_scan(
+            Conversation.objects.filter(Q(initiator=self.alice) | Q(receiver=self.alice)).order_by('-updated_at')
+        )
+
+
+class SearchTests(TestCase):
+    """Message search: kept current by the index, scoped to the caller's rooms, safe to render."""
+
+    def setUp(self):
+        self.alice, self.bob, self.carol = make_user('alice'), make_user('bob'), make_user('carol')
+        self.conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+        self.private, _ = Conversation.objects.get_or_create_between(self.bob, self.carol)
+        self.community = Community.objects.create(name='c', description='d', creaters=self.bob)
+        self.community.members.add(self.alice, self.bob)
+        self.closed = Community.objects.create(name='closed', description='d', creaters=self.carol)
+        self.closed.members.add(self.carol)
+        self.client = api_client(self.alice)
+
+    def search(self, q, **params):
+        return self.client.get(reverse('search-messages'), {'q': q, **params}).data['results']
+
+    def test_finds_new_messages_in_both_kinds_of_room(self):
+        chat = Message.objects.create(conversation=self.conversation, sender=self.bob, content='the lighthouse keeper')
+        room = CommunityMessage.objects.create(community=self.community, sender=self.bob, content='lighthouse tour')
+        results = self.search('lighthouse')
+        self.assertEqual({(r['type'], r['message_id']) for r in results}, {('chat', chat.id), ('community', room.id)})
+        self.assertIn('<mark>lighthouse</mark>', results[0]['snippet'])
+        self.assertEqual([r['message_id'] for r in self.search('lighthouse', **{'in': 'communities'})], [room.id])
+
+    def test_follows_edits_and_deletes(self):
+        message = Message.objects.create(conversation=self.conversation, sender=self.bob, content='old words')
+        message.content = 'new words'
+        message.save()
+        self.assertEqual(self.search('old'), [])
+        self.assertEqual([r['message_id'] for r in self.search('new')], [message.id])
+
+        Message.objects.filter(pk=message.pk).update(is_deleted=True)
+        room = CommunityMessage.objects.create(community=self.community, sender=self.bob, content='new plan')
+        room.is_deleted = True
+        room.save()
+        self.assertEqual(self.search('new'), [])
+
+    def test_scoped_to_callers_rooms(self):
+        Message.objects.create(conversation=self.private, sender=self.carol, content='secret meeting')
+        CommunityMessage.objects.create(community=self.closed, sender=self.carol, content='secret plans')
+        self.assertEqual(self.search('secret'), [])
+        self.assertEqual(len(api_client(self.carol).get(reverse('search-messages'), {'q': 'secret'}).data['results']), 2)
+
+    def test_snippet_is_escaped(self):
+        Message.objects.create(
+            conversation=self.conversation, sender=self.bob, content='<img src=x onerror=alert(1)> payload here',
+        )
+        snippet = self.search('payload')[0]['snippet']
+        self.assertNotIn('<img', snippet)
+        self.assertIn('&lt;img src=x onerror=alert(1)&gt;', snippet)
+        self.assertIn('<mark>payload</mark>', snippet)
+
+
+class HistoryStreamTests(TransactionTestCase):
+    """``?stream=1`` on the conversation detail: the whole history, archive included, in chunks."""
+
+    def setUp(self):
+        self.alice, self.bob = make_user('alice'), make_user('bob')
+        self.conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+        start = timezone.now() - timedelta(days=400)
+        for i in range(7):
+            ArchivedMessage.objects.create(
+                id=10_000 + i, conversation=self.conversation, sender=self.alice,
+                content=f'old {i}', created_at=start + timedelta(minutes=i),
+            )
+        for i in range(8):
+            Message.objects.create(conversation=self.conversation, sender=self.bob, content=f'new {i}')
+        self.expected = [f'old {i}' for i in range(7)] + [f'new {i}' for i in range(8)]
+        self.url = reverse('get_conversation', args=[self.conversation.id])
+        chunk_size, views.STREAM_CHUNK_SIZE = views.STREAM_CHUNK_SIZE, 4
+        self.addCleanup(setattr, views, 'STREAM_CHUNK_SIZE', chunk_size)
+
+    def test_wsgi_stream(self):
+        response = api_client(self.alice).get(self.url, {'stream': '1'})
+        self.assertFalse(response.is_async)
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 4)
+        self.assertEqual([m['content'] for m in json.loads(b''.join(chunks))], self.expected)
+
+    async def test_asgi_stream_is_async(self):
+        # A synchronous iterator would be buffered whole by the ASGI handler
+        response = await AsyncClient().get(
+            self.url, {'stream': '1'}, headers={'Authorization': f'Bearer {AccessToken.for_user(self.alice)}'}
+        )
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual([m['content'] for m in json.loads(b''.join(chunks))], self.expected)
+
+    def test_empty_history(self):
+        Message.objects.all().delete()
+        ArchivedMessage.objects.all().delete()
+        response = api_client(self.alice).get(self.url, {'stream': '1'})
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [])
+
+
+class ConversationWindowTests(TestCase):
+    """The conversation's message window carries on into the archive."""
+
+    def setUp(self):
+        self.alice, self.bob = make_user('alice'), make_user('bob')
+        self.conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+        start = timezone.now() - timedelta(days=400)
+        for i in range(3):
+            ArchivedMessage.objects.create(
+                id=10_000 + i, conversation=self.conversation, sender=self.alice,
+                content=f'old {i}', created_at=start + timedelta(minutes=i),
+            )
+        for i in range(2):
+            Message.objects.create(conversation=self.conversation, sender=self.bob, content=f'new {i}')
+        self.client = api_client(self.alice)
+
+    def window(self, limit):
+        return self.client.get(reverse('get_conversation', args=[self.conversation.id]), {'limit': limit}).data
+
+    def test_short_hot_window_is_topped_up_from_archive(self):
+        data = self.window(4)
+        self.assertEqual([m['content'] for m in data['message_set']], ['new 1', 'new 0', 'old 2', 'old 1'])
+        self.assertTrue(data['has_more'])
+        rest = self.client.get(
+            reverse('message-list', args=[self.conversation.id]), {'before': data['next_cursor']}
+        ).data['results']
+        self.assertEqual([m['content'] for m in rest], ['old 0'])
+
+    def test_archive_alone_counts_as_more(self):
+        data = self.window(2)
+        self.assertEqual([m['content'] for m in data['message_set']], ['new 1', 'new 0'])
+        self.assertTrue(data['has_more'])
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_whole_history_fits(self):
+        data = self.window(10)
+        self.assertEqual(len(data['message_set']), 5)
+        self.assertFalse(data['has_more'])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_everything_archived(self):
+        Message.objects.all().delete()
+        data = self.window(2)
+        self.assertEqual([m['content'] for m in data['message_set']], ['old 2', 'old 1'])
+        self.assertTrue(data['has_more'])
+
+
+class ResumableUploadTests(TestCase):
+    def setUp(self):
+        temp_media(self)
+        self.alice, self.bob = make_user('alice'), make_user('bob')
+        self.conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+        self.client = api_client(self.alice)
+
+    def upload(self, data=b'%PDF-1.4 resumable'):
+        response = self.client.post(reverse('create-upload'), {
+            'file_name': 'notes.pdf', 'size': len(data), 'conversation_id': self.conversation.id,
+        }, format='json')
+        upload_id = response.data['upload_id']
+        url = reverse('upload-session', args=[upload_id])
+        half = len(data) // 2
+        for offset, chunk in ((0, data[:half]), (half, data[half:])):
+            response = self.client.generic(
+                'PATCH', url, chunk, content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset),
+            )
+            self.assertEqual(response.status_code, 204)
+        return upload_id
+
+    def test_finalize_twice_posts_one_message(self):
+        upload_id = self.upload()
+        url = reverse('finalize-upload', args=[upload_id])
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.client.post(url)
+        self.assertEqual(first.status_code, 201)
+        again = self.client.post(url)
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data['message_id'], first.data['message_id'])
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 1)
+        self.assertFalse(os.path.exists(UploadSession.objects.get(pk=upload_id).temp_path))
+        # No more bytes once finalized
+        response = self.client.generic(
+            'PATCH', reverse('upload-session', args=[upload_id]), b'x',
+            content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET='18',
+        )
+        self.assertEqual(response.status_code, 409)
+
+    def test_sweep_expires_idle_uploads(self):
+        idle, active = self.upload(), self.upload()
+        UploadSession.objects.filter(pk=idle).update(updated_at=timezone.now() - timedelta(days=2))
+        orphan = os.path.join(os.path.dirname(UploadSession.objects.get(pk=active).temp_path), 'orphan')
+        with open(orphan, 'wb') as fh:
+            fh.write(b'left behind')
+        old = (timezone.now() - timedelta(days=2)).timestamp()
+        os.utime(orphan, (old, old))
+
+        call_command('sweep_media', stdout=open(os.devnull, 'w'))
+
+        self.assertFalse(UploadSession.objects.filter(pk=idle).exists())
+        self.assertTrue(UploadSession.objects.filter(pk=active).exists())
+        self.assertTrue(os.path.exists(UploadSession.objects.get(pk=active).temp_path))
+        self.assertFalse(os.path.exists(orphan))
+
+
+class ConsumerHopTests(TransactionTestCase):
+    """Each chat frame type costs exactly one hop onto the consumer DB executor."""
+
+    def setUp(self):
+        self.alice, self.bob = make_user('alice'), make_user('bob')
+        self.conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+        # Alice's own message: only the sender may edit or delete it
+        self.message = Message.objects.create(conversation=self.conversation, sender=self.alice, content='hi')
+
+    async def test_hops_and_latency_per_frame(self):
+        path = f'/ws/chat/{self.conversation.id}/'
+        communicator, hops, seconds = await self.connect(path)
+        results = {'auth': (hops, seconds)}
+        message_id = self.message.id
+        frames = [
+            ('chat_message', {'type': 'chat_message', 'message': 'hello'}, 'chat_message'),
+            ('mark_read', {'type': 'mark_read', 'message_id': message_id}, 'message_read'),
+            ('edit_message', {'type': 'edit_message', 'message_id': message_id, 'new_content': 'x'}, 'message_edited'),
+            ('like_message', {'type': 'like_message', 'message_id': message_id}, 'message_liked'),
+            ('delete_message', {'type': 'delete_message', 'message_id': message_id}, 'message_deleted'),
+            ('heartbeat', {'type': 'heartbeat'}, 'heartbeat_ack'),
+        ]
+        for label, frame, reply in frames:
+            results[label] = await measure_frame(communicator, frame, reply)
+        await communicator.disconnect()
+
+        report('Chat consumer: executor hops and latency per frame', {
+            label: {'hops': hops, 'ms': round(seconds * 1000, 2)} for label, (hops, seconds) in results.items()
+        })
+        expected = {label: 1 for label in results}
+        expected['heartbeat'] = 0  # presence lives in the cache
+        self.assertEqual({label: hops for label, (hops, _) in results.items()}, expected)
+
+    async def connect(self, path):
+        completed, started = get_executor().stats()['completed'], time.perf_counter()
+        communicator = await ws_connect(path, self.alice)
+        await receive_type(communicator, 'presence')
+        return communicator, get_executor().stats()['completed'] - completed, time.perf_counter() - started
+
+
+class ConsumerPoolTests(SimpleTestCase):
+    """Blocking consumer calls overlap up to the pool size instead of queueing on one thread."""
+
+    CALLS = 8
+    LATENCY = 0.05
+
+    async def run_calls(self, workers):
+        pool = InstrumentedThreadPoolExecutor(workers)
+        self.addCleanup(pool.shutdown)
+        threads = set()
+
+        def call():
+            # Stands in for a query that spends its time waiting on the database
+            threads.add(threading.current_thread().name)
+            time.sleep(self.LATENCY)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(DatabaseSyncToAsync(call, thread_sensitive=False, executor=pool)() for _ in range(self.CALLS)))
+        return time.perf_counter() - started, threads, pool.stats()
+
+    async def test_throughput_scales_with_pool_size(self):
+        rows, elapsed = {}, {}
+        for workers in (1, 4):
+            elapsed[workers], threads, stats = await self.run_calls(workers)
+            self.assertEqual(len(threads), workers)
+            self.assertEqual(stats['completed'], self.CALLS)
+            self.assertTrue(all(name.startswith('consumer-db') for name in threads))
+            rows[f'{workers} worker(s)'] = {
+                'calls_per_s': round(self.CALLS / elapsed[workers]), 'max_wait_ms': stats['max_wait_ms'],
+            }
+        report('Consumer DB pool: blocking calls per second', rows)
+        self.assertLess(elapsed[4], elapsed[1] / 2)
+
+
+class WriteBehindTests(TransactionTestCase):
+    """Batched inserts: nothing is acked before its batch commits."""
+
+    def setUp(self):
+        self.alice, self.bob = make_user('alice'), make_user('bob')
+        self.conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+
+    def message(self, content):
+        return Message(conversation=self.conversation, sender=self.alice, content=content, created_at=timezone.now())
+
+    async def count(self):
+        return await database_sync_to_async(Message.objects.count)()
+
+    async def test_flushes_after_interval(self):
+        buffer = write_behind.WriteBehindBuffer(Message)
+        message = self.message('one')
+        committed = buffer.add(message)
+        # No id, so nothing to broadcast or mark read, until the insert commits
+        self.assertFalse(committed.done())
+        self.assertIsNone(message.pk)
+        await asyncio.wait_for(committed, 1)
+        self.assertIsNotNone(message.pk)
+        self.assertEqual(await self.count(), 1)
+
+    async def test_full_batch_flushes_at_once(self):
+        buffer = write_behind.WriteBehindBuffer(Message)
+        with mock.patch.object(write_behind, 'MAX_BATCH', 3), mock.patch.object(write_behind, 'FLUSH_INTERVAL', 60):
+            futures = [buffer.add(self.message(f'm{i}')) for i in range(3)]
+            await asyncio.wait_for(asyncio.gather(*futures), 1)
+        self.assertEqual(await self.count(), 3)
+
+    async def test_failed_flush_is_not_acked(self):
+        def fail(objs):
+            raise RuntimeError('bookkeeping failed')
+
+        buffer = write_behind.WriteBehindBuffer(Message, after_flush=fail)
+        committed = buffer.add(self.message('lost'))
+        with self.assertRaises(RuntimeError):
+            await asyncio.wait_for(committed, 1)
+        # The insert rolled back with the bookkeeping
+        self.assertEqual(await self.count(), 0)
+
+    async def test_consumer_broadcasts_stored_message_then_acks(self):
+        with mock.patch.object(write_behind, 'ENABLED', True):
+            communicator = await ws_connect(f'/ws/chat/{self.conversation.id}/', self.alice)
+            await receive_type(communicator, 'presence')
+            await communicator.send_json_to({'type': 'chat_message', 'message': 'batched', 'client_id': 'c1'})
+            # The sender's own copy of the broadcast comes through the group, after the direct ack
+            ack = await receive_type(communicator, 'message_ack')
+            broadcast = await receive_type(communicator, 'chat_message')
+            await communicator.disconnect()
+
+        stored = await database_sync_to_async(Message.objects.get)(pk=ack['message_id'])
+        self.assertEqual((ack['client_id'], broadcast['message_id']), ('c1', stored.pk))
+        # bulk_create must not restamp the time the message was broadcast with
+        self.assertEqual(broadcast['timestamp'], stored.created_at.isoformat())
+        conversation = await database_sync_to_async(Conversation.objects.get)(pk=self.conversation.pk)
+        self.assertEqual(conversation.last_message_id, stored.pk)
+
+
+class WriteBehindBenchmarkTests(TransactionTestCase):
+    """Queries and commits for the same socket traffic, row by row and through the buffer."""
+
+    SOCKETS = 5
+    MESSAGES = 10  # per socket
+
+    def setUp(self):
+        self.alice, self.bob = make_user('alice'), make_user('bob')
+        self.conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+
+    def one_writer(self):
+        """On SQLite, which fails concurrent write transactions, run the pool's calls one at a time."""
+        executor = get_executor()
+        if connection.vendor != 'sqlite':
+            return nullcontext()
+        lock, submit = threading.Lock(), executor.submit
+
+        def serialized(fn, /, *args, **kwargs):
+            def run():
+                with lock:
+                    return fn(*args, **kwargs)
+            return submit(run)
+
+        return mock.patch.object(executor, 'submit', serialized)
+
+    async def send_all(self):
+        url = f'/ws/chat/{self.conversation.id}/'
+        listener = await ws_connect(url, self.bob)
+        await receive_type(listener, 'presence')
+        senders = [await ws_connect(url, self.alice) for _ in range(self.SOCKETS)]
+        for sender in senders:
+            await receive_type(sender, 'presence')
+
+        async def send(sender, n):
+            for i in range(self.MESSAGES):
+                await sender.send_json_to({'type': 'chat_message', 'message': f's{n} m{i}', 'client_id': f'{n}-{i}'})
+
+        total = self.SOCKETS * self.MESSAGES
+        started = time.perf_counter()
+        with count_db_work() as counts:
+            await asyncio.gather(*(send(sender, n) for n, sender in enumerate(senders)))
+            for _ in range(total):
+                await receive_type(listener, 'chat_message')
+        seconds = time.perf_counter() - started
+        for communicator in [listener, *senders]:
+            await communicator.disconnect()
+        return {**counts, 'ms': round(seconds * 1000, 2)}
+
+    async def test_buffer_cuts_commits(self):
+        results = {}
+        unthrottled = {'chat_message': {'user': (1000, 1000)}}
+        for label, enabled in (('row by row', False), ('write-behind', True)):
+            with mock.patch.object(write_behind, 'ENABLED', enabled), mock.patch.dict(throttle.RATE_LIMITS, unthrottled), \
+                    self.one_writer():
+                results[label] = await self.send_all()
+        total = self.SOCKETS * self.MESSAGES
+        report(f'Chat socket: {total} messages over {self.SOCKETS} sockets', results)
+
+        self.assertEqual(await database_sync_to_async(Message.objects.count)(), 2 * total)
+        self.assertGreaterEqual(results['row by row']['commits'], total)
+        self.assertLess(results['write-behind']['commits'], total / 2)
+        self.assertLess(results['write-behind']['queries'], results['row by row']['queries'])
+
+
+class DeleteSummaryTests(TransactionTestCase):
+    """Deleted messages drop out of the inbox summary and the unread counters."""
+
+    def setUp(self):
+        self.alice, self.bob = make_user('alice'), make_user('bob')
+        self.conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+        self.first = Message.objects.create(conversation=self.conversation, sender=self.alice, content='first')
+        self.last = Message.objects.create(conversation=self.conversation, sender=self.alice, content='last')
+
+    async def delete_over_socket(self, message_id):
+        communicator = await ws_connect(f'/ws/chat/{self.conversation.id}/', self.alice)
+        await receive_type(communicator, 'presence')
+        await communicator.send_json_to({'type': 'delete_message', 'message_id': message_id})
+        await receive_type(communicator, 'message_deleted')
+        await communicator.disconnect()
+        return await database_sync_to_async(Conversation.objects.get)(pk=self.conversation.pk)
+
+    async def test_deleting_last_message_refreshes_summary(self):
+        conversation = await self.delete_over_socket(self.last.id)
+        self.assertEqual(conversation.last_message_id, self.first.id)
+        self.assertEqual(conversation.last_message_preview, 'first')
+        self.assertEqual(conversation.receiver_unread_count, 1)
+
+    async def test_deleting_unread_message_lowers_unread_count(self):
+        conversation = await self.delete_over_socket(self.first.id)
+        self.assertEqual((conversation.last_message_id, conversation.receiver_unread_count), (self.last.id, 1))
+
+    def test_rest_delete_refreshes_summary(self):
+        api_client(self.alice).delete(f'/chats/messages/{self.first.id}/delete/')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.receiver_unread_count, 1)
+
+    def test_mark_read_skips_deleted_messages(self):
+        third = Message.objects.create(conversation=self.conversation, sender=self.alice, content='third')
+        Message.objects.filter(pk=third.pk).update(is_deleted=True)
+        Conversation.mark_read(self.conversation.id, self.bob.id, self.first.id)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.receiver_unread_count, 1)
+
+
+class ReadCursorReplayTests(TransactionTestCase):
+    """Read cursors over the socket, and the catch-up a reconnecting client gets."""
+
+    def setUp(self):
+        self.alice, self.bob = make_user('alice'), make_user('bob')
+        self.conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, sender=self.alice, content=f'm{i}')
+            for i in range(4)
+        ]
+
+    async def connect(self, user, **auth):
+        communicator = await ws_connect(f'/ws/chat/{self.conversation.id}/', user, **auth)
+        await receive_type(communicator, 'presence')
+        return communicator
+
+    async def reload(self):
+        return await database_sync_to_async(Conversation.objects.get)(pk=self.conversation.pk)
+
+    async def test_cursor_moves_forward_only(self):
+        alice, bob = await self.connect(self.alice), await self.connect(self.bob)
+        await bob.send_json_to({'type': 'mark_read', 'message_id': self.messages[2].id})
+        # The sender sees the receiver's cursor move, and the receiver's unread count drops
+        frame = await receive_type(alice, 'message_read')
+        self.assertEqual((frame['reader_id'], frame['last_read_id']), (self.bob.id, self.messages[2].id))
+        conversation = await self.reload()
+        self.assertEqual((conversation.receiver_last_read_id, conversation.receiver_unread_count),
+                         (self.messages[2].id, 1))
+
+        # An older id is a no-op: no broadcast, no cursor or counter change
+        await bob.send_json_to({'type': 'mark_read', 'message_id': self.messages[0].id})
+        await bob.send_json_to({'type': 'heartbeat'})
+        await receive_type(bob, 'heartbeat_ack')
+        self.assertTrue(await alice.receive_nothing(0.1))
+        conversation = await self.reload()
+        self.assertEqual((conversation.receiver_last_read_id, conversation.receiver_unread_count),
+                         (self.messages[2].id, 1))
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_replay_carries_changes_since_anchor(self):
+        first, _, anchor, _ = self.messages
+        alice = await self.connect(self.alice)
+        # Both changes touch messages older than the anchor, after the client went away
+        await alice.send_json_to({'type': 'edit_message', 'message_id': first.id, 'new_content': 'edited'})
+        await receive_type(alice, 'message_edited')
+        await alice.send_json_to({'type': 'delete_message', 'message_id': self.messages[1].id})
+        await receive_type(alice, 'message_deleted')
+        await alice.disconnect()
+
+        bob = await self.connect(self.bob, last_message_id=anchor.id)
+        replay = await receive_type(bob, 'replay')
+        await bob.disconnect()
+        entries = {entry['message_id']: entry for entry in replay['messages']}
+        self.assertEqual(entries[first.id]['content'], 'edited')
+        self.assertTrue(entries[first.id]['is_edited'])
+        self.assertEqual(entries[self.messages[1].id], {'message_id': self.messages[1].id, 'is_deleted': True})
+        self.assertIn(self.messages[3].id, entries)
+        self.assertFalse(replay['has_more'])
+
+    async def test_replay_is_capped(self):
+        with mock.patch.object(consumers, 'REPLAY_LIMIT', 2):
+            bob = await self.connect(self.bob, last_message_id=self.messages[0].id)
+            replay = await receive_type(bob, 'replay')
+            await bob.disconnect()
+        self.assertEqual([entry['message_id'] for entry in replay['messages']],
+                         [self.messages[0].id, self.messages[1].id])
+        self.assertTrue(replay['has_more'])
+
+    async def test_unknown_anchor_resets(self):
+        bob = await self.connect(self.bob, last_message_id=self.messages[-1].id + 100)
+        self.assertEqual(await receive_type(bob, 'replay'), {'type': 'replay', 'reset': True})
+        await bob.disconnect()
+
+
+try:
+    import channels_redis  # noqa: F401
+except ImportError:
+    channels_redis = None
+
+
+class WorkerBChatConsumer(consumers.ChatConsumer):
+    # Its own channel layer instance, as in a second worker process: it shares nothing with the first but Redis
+    channel_layer_alias = 'worker_b'
+
+
+class CrossWorkerTests(TransactionTestCase):
+    """A message sent on one worker reaches a socket connected to another.
+
+    Runs against Redis when channels_redis and REDIS_URL are available, and
+    against a SharedChannelLayer standing in for it otherwise.
+    """
+
+    def setUp(self):
+        self.alice, self.bob = make_user('alice'), make_user('bob')
+        self.conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+        if channels_redis and settings.REDIS_URL:
+            layer = settings.CHANNEL_LAYERS['default']
+        else:
+            layer = {'BACKEND': 'MindMates.testing.SharedChannelLayer', 'CONFIG': {'server': 'redis'}}
+            self.addCleanup(SharedChannelLayer.servers.clear)
+        override = override_settings(CHANNEL_LAYERS={'default': layer, 'worker_b': layer})
+        override.enable()
+        self.addCleanup(override.disable)
+
+    async def test_message_crosses_workers(self):
+        worker_b = URLRouter([path('ws/chat/<int:conversation_id>/', WorkerBChatConsumer.as_asgi())])
+        url = f'/ws/chat/{self.conversation.id}/'
+        sender = await ws_connect(url, self.alice)
+        await receive_type(sender, 'presence')
+        receiver = WebsocketCommunicator(worker_b, url)
+        self.assertTrue((await receiver.connect())[0])
+        await receiver.send_json_to({'type': 'auth', 'token': str(AccessToken.for_user(self.bob))})
+        await receive_type(receiver, 'presence')
+
+        await sender.send_json_to({'type': 'chat_message', 'message': 'across'})
+        frame = await receive_type(receiver, 'chat_message')
+        self.assertEqual((frame['content'], frame['sender']['id']), ('across', self.alice.id))
+        await sender.disconnect()
+        await receiver.disconnect()
+
+
+class ChunkedUploadTests(TransactionTestCase):
+    """upload_init, binary chunks, upload_commit over the chat socket."""
+
+    DATA = b'%PDF-1.4 ' + b'x' * 1000
+
+    def setUp(self):
+        temp_media(self)
+        self.alice, self.bob, self.carol = make_user('alice'), make_user('bob'), make_user('carol')
+        self.conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+        self.other, _ = Conversation.objects.get_or_create_between(self.carol, self.bob)
+
+    async def connect(self, user, conversation):
+        communicator = await ws_connect(f'/ws/chat/{conversation.id}/', user)
+        await receive_type(communicator, 'presence')
+        return communicator
+
+    async def upload(self, communicator, upload_id, init_extra=None):
+        await communicator.send_json_to({
+            'type': 'upload_init', 'upload_id': upload_id, 'file_name': 'notes.pdf', 'size': len(self.DATA),
+            **(init_extra or {}),
+        })
+        await receive_type(communicator, 'upload_ready')
+        for seq, start in enumerate(range(0, len(self.DATA), 400)):
+            await communicator.send_to(bytes_data=CHUNK_HEADER.pack(seq) + self.DATA[start:start + 400])
+        await communicator.send_json_to({'type': 'upload_commit', 'upload_id': upload_id})
+        return await receive_type(communicator, 'chat_message')
+
+    async def test_upload_and_digest_reshare(self):
+        alice = await self.connect(self.alice, self.conversation)
+        frame = await self.upload(alice, 'u1')
+        await alice.disconnect()
+        message = await database_sync_to_async(Message.objects.get)(pk=frame['message_id'])
+        with open(message.file.path, 'rb') as fh:
+            self.assertEqual(fh.read(), self.DATA)
+
+        # Carol knows the digest but cannot read Alice's file: she has to send the bytes
+        carol = await self.connect(self.carol, self.other)
+        digest = hashlib.sha256(self.DATA).hexdigest()
+        frame = await self.upload(carol, 'u2', {'sha256': digest})
+        await carol.disconnect()
+        reshared = await database_sync_to_async(Message.objects.get)(pk=frame['message_id'])
+        self.assertEqual(reshared.file.name, message.file.name)
+
+        # Bob received it from Alice, so the digest alone is enough for him
+        bob = await self.connect(self.bob, self.other)
+        await bob.send_json_to({'type': 'upload_init', 'upload_id': 'u3', 'file_name': 'notes.pdf',
+                                'size': len(self.DATA), 'sha256': digest})
+        frame = await bob.receive_json_from(5)
+        while frame['type'] == 'presence':
+            frame = await bob.receive_json_from(5)
+        await bob.disconnect()
+        self.assertEqual((frame['type'], frame['upload_id']), ('chat_message', 'u3'))
+
+
+class FlowControlTests(TransactionTestCase):
+    def setUp(self):
+        temp_media(self)
+        self.alice, self.bob = make_user('alice'), make_user('bob')
+        self.conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+
+    async def connect(self):
+        communicator = await ws_connect(f'/ws/chat/{self.conversation.id}/', self.alice)
+        await receive_type(communicator, 'presence')
+        return communicator
+
+    async def drain(self, communicator):
+        """Every frame waiting for the client, as a client would count them."""
+        frames = []
+        while not await communicator.receive_nothing(0.05):
+            frames.append(await communicator.receive_output())
+        return frames
+
+    async def test_upload_chunks_are_rate_limited(self):
+        data = bytes(range(256)) * 8
+        chunks = [data[i:i + 512] for i in range(0, len(data), 512)]
+        limits = {'upload_chunk': {'connection': (20, 2)}}
+        with mock.patch.dict(throttle.RATE_LIMITS, limits):
+            communicator = await self.connect()
+            await communicator.send_json_to({
+                'type': 'upload_init', 'upload_id': 'u1', 'file_name': 'data.txt', 'size': len(data),
+            })
+            await receive_type(communicator, 'upload_ready')
+            for seq in range(3):
+                await communicator.send_to(bytes_data=CHUNK_HEADER.pack(seq) + chunks[seq])
+            throttled = await receive_type(communicator, 'throttled')
+            self.assertEqual((throttled['frame'], throttled['expected_seq']), ('upload_chunk', 2))
+
+            await asyncio.sleep(throttled['retry_after'] + 0.05)
+            # Chunk 3 was already in flight: dropped without failing the upload
+            await communicator.send_to(bytes_data=CHUNK_HEADER.pack(3) + chunks[3])
+            await asyncio.sleep(0.1)
+            for seq in (2, 3):
+                await communicator.send_to(bytes_data=CHUNK_HEADER.pack(seq) + chunks[seq])
+                await asyncio.sleep(0.06)
+            await communicator.send_json_to({'type': 'upload_commit', 'upload_id': 'u1'})
+            frame = await receive_type(communicator, 'chat_message')
+            await communicator.disconnect()
+        message = await database_sync_to_async(Message.objects.get)(pk=frame['message_id'])
+        with open(message.file.path, 'rb') as fh:
+            self.assertEqual(fh.read(), data)
+
+    async def test_lagging_reader_is_dropped_at_heartbeat(self):
+        with mock.patch.object(throttle, 'MAX_UNACKED_FRAMES', 2):
+            communicator = await self.connect()
+            received = 1 + len(await self.drain(communicator))
+            # Up to date: kept
+            await communicator.send_json_to({'type': 'heartbeat', 'received': received})
+            await receive_type(communicator, 'heartbeat_ack')
+            received += 1
+            for i in range(3):
+                await communicator.send_json_to({'type': 'chat_message', 'message': f'm{i}'})
+            await asyncio.sleep(0.2)
+            # Claims to have read none of the three messages
+            await communicator.send_json_to({'type': 'heartbeat', 'received': received})
+            frames = await self.drain(communicator)
+        self.assertEqual(frames[-1], {'type': 'websocket.close', 'code': throttle.SLOW_READER_CLOSE_CODE})
+
+    async def test_reader_silent_while_behind_is_dropped(self):
+        with mock.patch.object(throttle, 'MAX_UNACKED_FRAMES', 2), mock.patch.object(throttle, 'ACK_TIMEOUT', 0):
+            communicator = await self.connect()
+            received = 1 + len(await self.drain(communicator))
+            await communicator.send_json_to({'type': 'heartbeat', 'received': received})
+            await receive_type(communicator, 'heartbeat_ack')
+            for i in range(4):
+                await communicator.send_json_to({'type': 'chat_message', 'message': f'm{i}'})
+            frames = await self.drain(communicator)
+        # With the heartbeat_ack, the second message puts the client three frames behind
+        self.assertEqual([f.get('type') for f in frames], ['websocket.send'] * 2 + ['websocket.close'])
+        self.assertEqual(frames[-1]['code'], throttle.SLOW_READER_CLOSE_CODE)
+
+    async def test_reader_that_never_acks_is_dropped(self):
+        with mock.patch.object(throttle, 'MAX_UNACKED_FRAMES', 2), mock.patch.object(throttle, 'ACK_TIMEOUT', 0):
+            communicator = await self.connect()
+            for i in range(4):
+                await communicator.send_json_to({'type': 'chat_message', 'message': f'm{i}'})
+            frames = await self.drain(communicator)
+        # The presence frame and two messages are all it may have outstanding
+        self.assertEqual([f.get('type') for f in frames], ['websocket.send'] * 2 + ['websocket.close'])
+        self.assertEqual(frames[-1]['code'], throttle.SLOW_READER_CLOSE_CODE)
+
+    async def test_reader_that_never_acks_has_ack_timeout(self):
+        with mock.patch.object(throttle, 'MAX_UNACKED_FRAMES', 2):
+            communicator = await self.connect()
+            for i in range(4):
+                await communicator.send_json_to({'type': 'chat_message', 'message': f'm{i}'})
+            frames = await self.drain(communicator)
+            await communicator.disconnect()
+        self.assertNotIn('websocket.close', [f.get('type') for f in frames])
+        self.assertEqual(sum('"chat_message"' in f.get('text', '') for f in frames), 4)
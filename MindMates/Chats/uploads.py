@@ -0,0 +1,140 @@
+import hashlib
+import os
+import struct
+import tempfile
+from django.conf import settings
+from django.core.files import File
+
+ALLOWED_EXTENSIONS = ['.pdf', '.jpg', '.jpeg', '.png', '.doc', '.docx', '.xls', '.xlsx', '.txt']
+MAX_UPLOAD_SIZE = getattr(settings, 'CHAT_MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
+MAX_CHUNK_SIZE = getattr(settings, 'CHAT_MAX_CHUNK_SIZE', 256 * 1024)
+
+# Binary WebSocket frames: 4-byte big-endian sequence number, then the chunk bytes
+CHUNK_HEADER = struct.Struct('>I')
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def file_extension(file_name):
+    return os.path.splitext(file_name or '')[1].lower()
+
+
+def validate_upload(file_name, size, max_size=MAX_UPLOAD_SIZE):
+    """Reject a file by its declared name and size before any of it is read."""
+    if file_extension(file_name) not in ALLOWED_EXTENSIONS:
+        raise UploadError(f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}", status=415)
+    if size is None or size <= 0:
+        raise UploadError("File size is required", status=400)
+    if size > max_size:
+        raise UploadError(f"File too large (max {max_size // (1024 * 1024)}MB)", status=413)
+
+
+def request_too_large(request, max_size=MAX_UPLOAD_SIZE):
+    """True when a request body is over the limit by its Content-Length alone.
+
+    Lets views refuse an upload before Django spools the multipart body.
+    Multipart framing adds a little on top of the file itself.
+    """
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0) > max_size + 64 * 1024
+    except ValueError:
+        return False
+
+
+class ChunkedUpload:
+    """A file assembled from sequenced chunks, spooled straight to a temp file on disk.
+
+    The declared size is validated up front and every chunk is checked
+    against it before being written, so a client can never make the server
+    hold more than one chunk in memory. The SHA-256 of the content is
+    computed incrementally as chunks arrive.
+    """
+
+    def __init__(self, upload_id, file_name, size, max_size=MAX_UPLOAD_SIZE):
+        validate_upload(file_name, size, max_size)
+        self.upload_id = upload_id
+        self.file_name = file_name
+        self.size = size
+        self.received = 0
+        self.next_seq = 0
+        # Set when a chunk is throttled: chunks after it that were already in flight are dropped
+        self.resending = False
+        self.sha256 = hashlib.sha256()
+        self.temp = tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR)
+
+    @property
+    def extension(self):
+        return file_extension(self.file_name)
+
+    @property
+    def complete(self):
+        return self.received == self.size
+
+    def append_frame(self, frame):
+        if len(frame) < CHUNK_HEADER.size:
+            raise UploadError("Malformed chunk frame")
+        (seq,) = CHUNK_HEADER.unpack_from(frame)
+        self.append(seq, memoryview(frame)[CHUNK_HEADER.size:])
+
+    def append(self, seq, chunk):
+        if seq != self.next_seq:
+            if self.resending and seq > self.next_seq:
+                return
+            raise UploadError(f"Expected chunk {self.next_seq}, got {seq}")
+        self.resending = False
+        if len(chunk) > MAX_CHUNK_SIZE:
+            raise UploadError(f"Chunk too large (max {MAX_CHUNK_SIZE} bytes)", status=413)
+        if self.received + len(chunk) > self.size:
+            raise UploadError("Upload exceeds its declared size", status=413)
+        self.temp.write(chunk)
+        self.sha256.update(chunk)
+        self.received += len(chunk)
+        self.next_seq += 1
+
+    def as_file(self):
+        self.temp.seek(0)
+        return File(self.temp, name=self.file_name)
+
+    def discard(self):
+        self.temp.close()
+
+
+# --- Resumable HTTP uploads ---
+RESUMABLE_UPLOAD_MAX_SIZE = getattr(settings, 'RESUMABLE_UPLOAD_MAX_SIZE', 100 * 1024 * 1024)
+STREAM_READ_SIZE = 64 * 1024
+
+
+def append_at_offset(path, offset, stream, max_bytes):
+    """Write ``stream`` onto ``path`` starting at ``offset``, reading STREAM_READ_SIZE at a time.
+
+    Anything past ``offset`` left over from an interrupted request is
+    discarded first. Returns the number of bytes written; a stream longer
+    than ``max_bytes`` is rolled back and rejected.
+    """
+    written = 0
+    with open(path, 'r+b') as out:
+        out.seek(offset)
+        out.truncate()
+        while True:
+            chunk = stream.read(STREAM_READ_SIZE)
+            if not chunk:
+                break
+            if written + len(chunk) > max_bytes:
+                out.truncate(offset)
+                raise UploadError("Chunk exceeds the remaining upload size", status=413)
+            out.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(STREAM_READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
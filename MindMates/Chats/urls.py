@@ -17,6 +17,9 @@ urlpatterns = [
     path('<int:conversation_id>/messages/<int:message_id>/like/', views.toggle_like, name='toggle-like'),
     path('conversations/', views.ConversationListView.as_view(), name='conversation-list'),
     path('conversations/<int:pk>/messages/', views.MessageListView.as_view(), name='message-list'),
+    path('uploads/', views.create_upload, name='create-upload'),
+    path('uploads/<uuid:upload_id>/', views.upload_session, name='upload-session'),
+    path('uploads/<uuid:upload_id>/finalize/', views.finalize_upload, name='finalize-upload'),
 
 ]
   
@@ -1,11 +1,20 @@
+import io
+import json
+import os
+import re
+from django.conf import settings
+from django.core.files import File
 from django.utils import timezone
 from django.shortcuts import render
-from .models import Conversation,Message
+from django.http import StreamingHttpResponse
+from .models import ArchivedMessage,Conversation,Message,UploadSession
+from Communities.models import Community, CommunityMessage
 from rest_framework import generics,permissions,status
 from rest_framework.decorators import api_view,permission_classes,parser_classes
 from rest_framework.response import Response
 from Users.models import User
 from .serializers import ConversationListSerializer, ConversationSerializer,MessageSerializer,FileUploadSerializer
+from .serializers import recent_messages_prefetch, DEFAULT_MESSAGE_WINDOW, MAX_MESSAGE_WINDOW
 from django.db.models import Q
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import redirect, reverse
@@ -16,33 +25,27 @@ from rest_framework.decorators import authentication_classes
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from django.db import transaction,models
 from rest_framework import generics
-from .pagination import MessagePagination
+from .pagination import MessageCursorPagination, InboxPagination
+from .inbox import build_inbox, inbox_entries
+from MindMates import broadcast, reactions
+from MindMates.db_executor import database_sync_to_async
+from MediaFiles import access, blobs
+from .uploads import (
+    MAX_UPLOAD_SIZE, RESUMABLE_UPLOAD_MAX_SIZE, UploadError,
+    append_at_offset, file_extension, file_sha256, request_too_large, validate_upload,
+)
+
+STREAM_CHUNK_SIZE = 500
 # Create your views here.
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def all_users_for_chat(request):
-    user = request.user
-    users = User.objects.exclude(id=user.id)  # Exclude self
-    result = []
-
-    for u in users:
-        # Check if conversation exists
-        convo = Conversation.objects.filter(
-            initiator=user, receiver=u
-        ).first() or Conversation.objects.filter(
-            initiator=u, receiver=user
-        ).first()
-
-        last_msg = convo.messages.order_by('-created_at').first() if convo else None
-
-        result.append({
-            "conversation_id": convo.id if convo else None,
-            "user_id": u.id,
-            "name": u.username,
-            "lastMessage": last_msg.content if last_msg else "Start chatting",
-            "time": last_msg.created_at.isoformat() if last_msg else "",
-        })
-    return Response(result)
+    inbox = build_inbox(request.user, search=request.query_params.get('search'))
+    paginator = InboxPagination()
+    page = paginator.paginate_queryset(inbox, request)
+    if page is not None:
+        return paginator.get_paginated_response(inbox_entries(page))
+    return Response(inbox_entries(list(inbox)))
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def create_conversation(request):
@@ -60,39 +63,108 @@ def create_conversation(request):
 
     initiator = request.user
 
-    # Check if conversation already exists
-    conversation = Conversation.objects.filter(
-        initiator=initiator, receiver=receiver
-    ).first() or Conversation.objects.filter(
-        initiator=receiver, receiver=initiator
-    ).first()
-
-    if conversation:
-        print ("Conversation already exists.")
+    conversation, created = Conversation.objects.get_or_create_between(initiator, receiver)
+    if not created:
         return Response({"message": "Conversation already exists."})
 
-    # Create new conversation
-    conversation = Conversation.objects.create(initiator=initiator, receiver=receiver)
     return Response({
         "message": "Conversation started successfully.",
         "conversation_id": conversation.id
     })
 
     
+def message_window_limit(request):
+    try:
+        limit = int(request.query_params.get('limit', DEFAULT_MESSAGE_WINDOW))
+    except ValueError:
+        limit = DEFAULT_MESSAGE_WINDOW
+    return max(1, min(limit, MAX_MESSAGE_WINDOW))
+
+
+def history_chunk(conversation, request, position):
+    """The next STREAM_CHUNK_SIZE messages after ``position``, serialized, and where to continue.
+
+    Each chunk is its own keyset query over the hot and archived tables,
+    so nothing is held open between chunks; the returned position is
+    None once the history is exhausted.
+    """
+    hot = conversation.messages.filter(is_deleted=False).select_related('sender__userprofile')
+    archived = conversation.archived_messages.select_related('sender__userprofile')
+    rows = MessageCursorPagination._merge(
+        MessageCursorPagination._page(hot, position, forward=True, size=STREAM_CHUNK_SIZE),
+        MessageCursorPagination._page(archived, position, forward=True, size=STREAM_CHUNK_SIZE),
+        forward=True,
+    )
+    chunk = rows[:STREAM_CHUNK_SIZE]
+    if not chunk:
+        return '', None
+    data = json.dumps(MessageSerializer(chunk, many=True, context={'request': request}).data)[1:-1]
+    last = chunk[-1]
+    return data, ((last.created_at, last.pk) if len(rows) > STREAM_CHUNK_SIZE else None)
+
+
+def iter_message_history(conversation, request):
+    """Yield the full history as a JSON array, one chunk of rows at a time."""
+    yield '['
+    data, position = history_chunk(conversation, request, None)
+    yield data
+    while position is not None:
+        data, position = history_chunk(conversation, request, position)
+        yield ',' + data
+    yield ']'
+
+
+async def aiter_message_history(conversation, request):
+    """iter_message_history for ASGI, with every chunk fetched on the DB executor.
+
+    A synchronous iterator would be drained into memory by Django's ASGI
+    handler before the first byte went out.
+    """
+    fetch = database_sync_to_async(history_chunk)
+    yield '['
+    data, position = await fetch(conversation, request, None)
+    yield data
+    while position is not None:
+        data, position = await fetch(conversation, request, position)
+        yield ',' + data
+    yield ']'
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_conversation(request, convo_id):
-    conversation = Conversation.objects.filter(id=convo_id)
-    if not conversation.exists():
+    conversation = Conversation.objects.filter(
+        Q(initiator=request.user) | Q(receiver=request.user), id=convo_id
+    ).select_related('initiator__userprofile', 'receiver__userprofile')
+    if request.query_params.get('stream') in ('1', 'true'):
+        conversation = conversation.first()
+        if not conversation:
+            return Response({'message': 'Conversation does not exist'})
+        if getattr(request, 'scope', None) is not None:
+            stream = aiter_message_history(conversation, request)
+        else:
+            stream = iter_message_history(conversation, request)
+        return StreamingHttpResponse(stream, content_type='application/json')
+
+    limit = message_window_limit(request)
+    conversation = conversation.prefetch_related(recent_messages_prefetch(limit)).first()
+    if not conversation:
         return Response({'message': 'Conversation does not exist'})
     
-    serializer = ConversationSerializer(conversation[0], context={'request': request})  
+    serializer = ConversationSerializer(conversation, context={'request': request, 'message_limit': limit})  
     return Response(serializer.data)
 
 @api_view(['GET'])
 def conversations(request):
-    conversationlist = Conversation.objects.filter(Q(initiator=request.user) | Q(receiver=request.user))
-    serializer = ConversationSerializer(instance=conversationlist, many=True, context={'request': request})
+    limit = message_window_limit(request)
+    conversationlist = Conversation.objects.filter(
+        Q(initiator=request.user) | Q(receiver=request.user)
+    ).select_related(
+        'initiator__userprofile', 'receiver__userprofile'
+    ).prefetch_related(recent_messages_prefetch(limit))
+    serializer = ConversationSerializer(
+        instance=conversationlist, many=True, context={'request': request, 'message_limit': limit}
+    )
     return Response(serializer.data)
 
 @api_view(['PATCH'])
@@ -112,18 +184,16 @@ def mark_message_read(request, message_id):
                 status=status.HTTP_403_FORBIDDEN
             )
             
-        if not message.is_read:
-            message.is_read = True
-            message.save()
-            
+        # Reading a message reads everything before it: one cursor UPDATE, one event
+        if Conversation.mark_read(message.conversation_id, request.user.id, message.id):
             # WebSocket notification
             channel_layer = get_channel_layer()
             async_to_sync(channel_layer.group_send)(
                 f"chat_{message.conversation.id}",
                 {
                     "type": "message.read",
-                    "message_id": message.id,
-                    "is_read": True,
+                    "reader_id": request.user.id,
+                    "last_read_id": message.id,
                     # "timestamp": timezone.now().isoformat()
                 }
             )
@@ -146,8 +216,11 @@ def edit_message(request, message_id):
         serializer = MessageSerializer(message, data=request.data, partial=True,  context={'request': request})
         if serializer.is_valid():
             if 'file' in request.data and message.file:
-                message.file.delete(save=False)
-            serializer.save(is_edited=True)
+                blobs.discard(message.file)
+            if serializer.validated_data.get('file'):
+                serializer.save(is_edited=True, file=blobs.store(serializer.validated_data['file']).name)
+            else:
+                serializer.save(is_edited=True)
             channel_layer = get_channel_layer()
             async_to_sync(channel_layer.group_send)(
                 f"chat_{message.conversation.id}",
@@ -156,7 +229,7 @@ def edit_message(request, message_id):
                     "message_id": message.id,
                     "new_content": serializer.validated_data.get("content", message.content),
                     "edited_at": timezone.now().isoformat(),
-                    "file_url": serializer.validated_data.get("file").url if serializer.validated_data.get("file") else None
+                    "file_url": message.file.url if serializer.validated_data.get("file") else None
                 }
             )
             return Response(serializer.data)
@@ -174,9 +247,15 @@ def delete_message(request, message_id):
         )
         convo_id = message.conversation.id
         message_id = message.id
+        in_summary = message.conversation.summary_includes(message_id, message.sender_id)
         if message.file:
-            message.file.delete(save=False)
-        message.delete()
+            blobs.discard(message.file)
+        # Soft delete, like the WebSocket path, so reconnecting clients can replay it
+        message.is_deleted = True
+        message.deleted_at = timezone.now()
+        message.save(update_fields=['file', 'is_deleted', 'deleted_at', 'updated_at'])
+        if in_summary:
+            message.conversation.refresh_summary()
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(
             f"chat_{convo_id}",
@@ -207,6 +286,13 @@ def upload_private_file(request, conversation_id):
                 status=status.HTTP_403_FORBIDDEN
             )
 
+        # Refuse oversized bodies before Django spools them
+        if request_too_large(request):
+            return Response(
+                {"error": f"File too large (max {MAX_UPLOAD_SIZE // (1024 * 1024)}MB)"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
         serializer = FileUploadSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
@@ -214,49 +300,47 @@ def upload_private_file(request, conversation_id):
         uploaded_file = None
         if 'file' in serializer.validated_data:
             uploaded_file = serializer.validated_data['file']
-            
-            # File validation
-            if uploaded_file.size > 10 * 1024 * 1024:
-                return Response(
-                    {"error": "File too large (max 10MB)"}, 
-                    status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
-                )
-                
-            allowed_extensions = ['.pdf', '.jpg', '.jpeg', '.png', '.doc', '.docx', '.xls', '.xlsx','.txt']
-            file_ext = '.' + uploaded_file.name.split('.')[-1].lower()
-            if file_ext not in allowed_extensions:
-                return Response(
-                    {"error": f"Invalid file type. Allowed: {', '.join(allowed_extensions)}"},
-                    status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
-                )
-
-        # Create message
-        message = Message.objects.create(
-            conversation=conversation,
-            sender=request.user,
-            content=serializer.validated_data.get('content', ''),
-            file=uploaded_file
-        )
+            try:
+                validate_upload(uploaded_file.name, uploaded_file.size)
+            except UploadError as e:
+                return Response({"error": e.message}, status=e.status)
+
+        with transaction.atomic():
+            # Identical bytes are stored once; the sha256 of a file the sender can read skips the upload
+            file_name = None
+            if uploaded_file is not None:
+                file_name = blobs.store(uploaded_file).name
+            elif serializer.validated_data.get('sha256'):
+                blob = access.acquire_readable(request.user, serializer.validated_data['sha256'])
+                if blob is None:
+                    return Response({"error": "Unknown file hash, upload the file instead"}, status=status.HTTP_404_NOT_FOUND)
+                file_name = blob.name
+
+            # Create message
+            message = Message.objects.create(
+                conversation=conversation,
+                sender=request.user,
+                content=serializer.validated_data.get('content', ''),
+                file=file_name
+            )
         
         # WebSocket broadcast
         try:
             channel_layer = get_channel_layer()
             async_to_sync(channel_layer.group_send)(
                 f"chat_{conversation_id}",
-                {
-                    "type": "chat.message",
-                    "message": {
-                        "id": message.id,
-                        "content": message.content,
-                        "file_url": message.file.url if message.file else None,
-                        "sender": {
-                            "id": request.user.id,
-                            "username": request.user.username
-                        },
-                        "timestamp": message.created_at.isoformat(),
-                        "is_read": False
-                    }
-                }
+                broadcast.chat_event({
+                    "type": "chat_message",
+                    "message_id": message.id,
+                    "content": message.content,
+                    "file_url": message.file.url if message.file else None,
+                    "sender": {
+                        "id": request.user.id,
+                        "username": request.user.username
+                    },
+                    "timestamp": message.created_at.isoformat(),
+                    "is_read": False
+                })
             )
         except Exception as e:
             print(f"WebSocket error: {e}")
@@ -275,29 +359,16 @@ def upload_private_file(request, conversation_id):
 @authentication_classes([JWTAuthentication])
 def toggle_like(request, conversation_id, message_id):
     try:
-        # Get message with conversation verification
-        message = Message.objects.select_related('conversation').get(
-            id=message_id,
-            conversation_id=conversation_id
-        )
         user = request.user
-        
-        # Verify participant
-        if user not in [message.conversation.initiator, message.conversation.receiver]:
+        if not Conversation.objects.filter(Q(initiator=user) | Q(receiver=user), id=conversation_id).exists():
             return Response(
                 {"error": "Not a conversation participant"},
                 status=status.HTTP_403_FORBIDDEN
             )
         
         # Toggle like
-        with transaction.atomic():
-            if user in message.likes.all():
-                message.likes.remove(user)
-                action = "unliked"
-            else:
-                message.likes.add(user)
-                action = "liked"
-            message.update_like_count()
+        liked, like_count = reactions.toggle_like(Message, message_id, user.id, conversation_id=conversation_id)
+        action = "liked" if liked else "unliked"
         
         # WebSocket broadcast
         try:
@@ -309,7 +380,7 @@ def toggle_like(request, conversation_id, message_id):
                     "message_id": message_id,
                     "user_id": user.id,
                     "action": action,
-                    "like_count": message.like_count
+                    "like_count": like_count
                 }
             )
         except Exception as e:
@@ -318,8 +389,8 @@ def toggle_like(request, conversation_id, message_id):
         return Response({
             "status": "success",
             "action": action,
-            "like_count": message.like_count,
-            "is_liked": action == "liked"
+            "like_count": like_count,
+            "is_liked": liked
         })
 
     except Message.DoesNotExist:
@@ -328,6 +399,183 @@ def toggle_like(request, conversation_id, message_id):
             status=status.HTTP_404_NOT_FOUND
         )
         
+def resolve_upload_target(user, data):
+    """The conversation or community a resumable upload will be posted to, or an error Response."""
+    if data.get('conversation_id'):
+        conversation = Conversation.objects.filter(
+            Q(initiator=user) | Q(receiver=user), id=data['conversation_id']
+        ).first()
+        if not conversation:
+            return None, Response({"error": "Conversation not found or access denied"}, status=status.HTTP_403_FORBIDDEN)
+        return {'conversation': conversation}, None
+    if data.get('community_id'):
+        community = Community.objects.filter(id=data['community_id'], members=user).first()
+        if not community:
+            return None, Response({"error": "You must be a member to post"}, status=status.HTTP_403_FORBIDDEN)
+        return {'community': community}, None
+    return None, Response({"error": "conversation_id or community_id is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def upload_offset_response(session, status_code=status.HTTP_204_NO_CONTENT):
+    response = Response(status=status_code)
+    response['Upload-Offset'] = str(session.offset)
+    response['Upload-Length'] = str(session.size)
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_upload(request):
+    """Open a resumable upload: validates name, size and access before any bytes are sent."""
+    data = request.data
+    try:
+        size = int(data.get('size') or 0)
+        validate_upload(data.get('file_name'), size, RESUMABLE_UPLOAD_MAX_SIZE)
+    except ValueError:
+        return Response({"error": "size must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+    except UploadError as e:
+        return Response({"error": e.message}, status=e.status)
+
+    target, error = resolve_upload_target(request.user, data)
+    if error:
+        return error
+
+    session = UploadSession.objects.create(
+        user=request.user,
+        file_name=data['file_name'],
+        size=size,
+        content=data.get('content', ''),
+        **target
+    )
+    os.makedirs(settings.RESUMABLE_UPLOAD_DIR, exist_ok=True)
+    open(session.temp_path, 'wb').close()
+
+    response = Response({"upload_id": str(session.id), "offset": 0, "size": size}, status=status.HTTP_201_CREATED)
+    response['Location'] = reverse('upload-session', args=[session.id])
+    response['Upload-Offset'] = '0'
+    return response
+
+
+@api_view(['GET', 'HEAD', 'PATCH', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def upload_session(request, upload_id):
+    """HEAD/GET report the offset to resume from, PATCH appends a chunk, DELETE aborts."""
+    session = UploadSession.objects.filter(id=upload_id, user=request.user).first()
+    if not session:
+        return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.method in ('GET', 'HEAD'):
+        return upload_offset_response(session, status.HTTP_200_OK)
+
+    if request.method == 'DELETE':
+        if os.path.exists(session.temp_path):
+            os.remove(session.temp_path)
+        session.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    if session.completed:
+        return Response({"error": "Upload already finalized"}, status=status.HTTP_409_CONFLICT)
+
+    try:
+        client_offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return Response({"error": "Upload-Offset header is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+    with transaction.atomic():
+        # Lock the session so two PATCHes can never write the same range
+        session = UploadSession.objects.select_for_update().filter(pk=session.pk).first()
+        if not session or session.completed:
+            # Expired and swept, or finalized, since the first read
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+        if client_offset != session.offset:
+            return upload_offset_response(session, status.HTTP_409_CONFLICT)
+        remaining = session.size - session.offset
+        if int(request.META.get('CONTENT_LENGTH') or 0) > remaining:
+            return Response({"error": "Chunk exceeds the remaining upload size"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        try:
+            written = append_at_offset(session.temp_path, session.offset, request.stream or io.BytesIO(), remaining)
+        except UploadError as e:
+            return Response({"error": e.message}, status=e.status)
+        session.offset += written
+        session.save(update_fields=['offset', 'updated_at'])
+    return upload_offset_response(session)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def finalize_upload(request, upload_id):
+    """Turn a fully received upload into a chat or community message.
+
+    The session row is locked for the whole finalize, so concurrent calls
+    produce one message; a retry after success returns that message again.
+    """
+    channel_layer = get_channel_layer()
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().filter(id=upload_id, user=request.user).first()
+        if not session:
+            return Response({"error": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+        if session.completed:
+            return Response({"status": "success", "message_id": session.message_id}, status=status.HTTP_200_OK)
+        if session.offset != session.size:
+            return upload_offset_response(session, status.HTTP_409_CONFLICT)
+
+        sha256 = file_sha256(session.temp_path)
+        ext = file_extension(session.file_name)
+        safe_name = re.sub(r'[^\w\-_. ]', '', session.file_name)
+        with open(session.temp_path, 'rb') as fh:
+            file_name = blobs.store(File(fh), sha256, ext).name
+        if session.conversation_id:
+            message = Message.objects.create(
+                conversation_id=session.conversation_id,
+                sender=request.user,
+                content=session.content,
+                file=file_name,
+            )
+            group, event = f"chat_{session.conversation_id}", {
+                "type": "chat_message",
+                "message_id": message.id,
+                "content": message.content,
+                "file_url": message.file.url,
+                "sender": {"id": request.user.id, "username": request.user.username},
+                "timestamp": message.created_at.isoformat(),
+                "is_read": False
+            }
+        else:
+            message = CommunityMessage.objects.create(
+                community_id=session.community_id,
+                sender=request.user,
+                content=session.content,
+                file=file_name,
+                file_name=safe_name,
+                file_size=session.size,
+            )
+            group, event = f"community_{session.community_id}", {
+                "type": "file_message",
+                "message_id": message.id,
+                "file_url": message.file.url,
+                "file_name": message.file_name,
+                "file_size": message.file_size,
+                "sender": {"id": request.user.id, "username": request.user.username},
+                "timestamp": message.created_at.isoformat()
+            }
+        session.message_id = message.id
+        session.save(update_fields=['message_id', 'updated_at'])
+        transaction.on_commit(lambda: os.remove(session.temp_path))
+
+    try:
+        async_to_sync(channel_layer.group_send)(group, broadcast.chat_event(event))
+    except Exception as e:
+        print(f"WebSocket error: {e}")
+
+    return Response({
+        "status": "success",
+        "message_id": message.id,
+        "content": message.content,
+        "file_url": message.file.url,
+        "sha256": sha256,
+    }, status=status.HTTP_201_CREATED)
+
+
 class ConversationListView(generics.ListAPIView):
     """List all conversations for the logged-in user"""
     serializer_class = ConversationListSerializer
@@ -337,17 +585,25 @@ class ConversationListView(generics.ListAPIView):
         user = self.request.user
         return Conversation.objects.filter(
             models.Q(initiator=user) | models.Q(receiver=user)
+        ).select_related(
+            'initiator__userprofile', 'receiver__userprofile', 'last_message__sender__userprofile'
         ).order_by('-updated_at')
 
 class MessageListView(generics.ListAPIView):
     """Fetch message history for a conversation"""
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = MessagePagination 
+    pagination_class = MessageCursorPagination
     def get_queryset(self):
         convo_id = self.kwargs['pk']
         user = self.request.user
-        convo = Conversation.objects.get(id=convo_id)
-        if user not in [convo.initiator, convo.receiver]:
+        self.is_participant = Conversation.objects.filter(Q(initiator=user) | Q(receiver=user), id=convo_id).exists()
+        if not self.is_participant:
             return Message.objects.none()
-        return convo.messages.order_by('created_at')
\ No newline at end of file
+        # Ordering is applied by the keyset paginator
+        return Message.objects.filter(conversation_id=convo_id, is_deleted=False).select_related('sender__userprofile', 'conversation')
+
+    def get_archive_queryset(self):
+        if not self.is_participant:
+            return None
+        return ArchivedMessage.objects.filter(conversation_id=self.kwargs['pk']).select_related('sender__userprofile', 'conversation')
\ No newline at end of file
@@ -2,12 +2,18 @@ import json
 import re
 from django.utils import timezone
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from MindMates import broadcast, presence, reactions, write_behind
+from MindMates.db_executor import database_sync_to_async
+from MindMates.throttle import FlowControlMixin
 from django.contrib.auth.models import AnonymousUser
 from .models import Community, CommunityMessage
+from MediaFiles import access, blobs
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
-class CommunityChatConsumer(AsyncWebsocketConsumer):
+# Text messages are inserted in batches when write-behind is enabled
+message_buffer = write_behind.WriteBehindBuffer(CommunityMessage)
+
+class CommunityChatConsumer(FlowControlMixin, AsyncWebsocketConsumer):
     WS_CLOSE_CODES = {
         400: 4000,  # Bad Request
         401: 4001,  # Unauthorized
@@ -43,6 +49,10 @@ class CommunityChatConsumer(AsyncWebsocketConsumer):
                         return
                 await self.close(code=4001)
                 return
+
+            # Over-limit frames get a throttled reply instead of being handled
+            if await self.rate_limited(data):
+                return
             
             if data.get('type') == 'chat_message':
                 await self.process_community_message(data)
@@ -56,16 +66,23 @@ class CommunityChatConsumer(AsyncWebsocketConsumer):
             elif data.get('type') == 'delete_message':
                 await self.handle_delete_message(data)
             elif data.get('type') == 'like_message':
-                result = await self.handle_like(
-                    community_id=data['community_id'],
-                    message_id=data['message_id']
-                )
+                result = await self.handle_like(data['message_id'])
+                if result is None:
+                    # A stale message id is no reason to drop the connection
+                    await self.send_error("Message not found", status=404, close=False)
+                    return
                 await self.broadcast_message({
                     'type': 'like_update',
                     'message_id': data['message_id'],
                     'like_count': result['like_count'],
                     'liked': result['liked'],
                 })
+
+            elif data.get('type') == 'heartbeat':
+                if await self.acknowledge(data):
+                    return
+                await presence.heartbeat_async(self.user.id, self.presence_rooms)
+                await self.send(text_data=json.dumps({'type': 'heartbeat_ack'}))
                             
             else:
                 await self.send_error("Invalid message type", status=400)
@@ -75,9 +92,9 @@ class CommunityChatConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             print(f"Error: {str(e)}")
             await self.send_error("Internal server error", status=500)
-    async def send_error(self, message, status=400):
-        """Safe error sending that handles closed connections"""
-        if not self.connected or hasattr(self, 'close_code'):
+    async def send_error(self, message, status=400, close=True):
+        """Safe error sending that handles closed connections; ``close=False`` keeps the socket open"""
+        if not self.connected or self.close_code is not None:
             return
             
         error_response = {
@@ -92,6 +109,8 @@ class CommunityChatConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             print(f"Could not send error message: {str(e)}")
             return
+        if not close:
+            return
             
         ws_code = self.WS_CLOSE_CODES.get(status, 4000)
         try:
@@ -100,20 +119,18 @@ class CommunityChatConsumer(AsyncWebsocketConsumer):
             self.connected = False
         except Exception as e:
             print(f"Could not close connection cleanly: {str(e)}")
-    async def send_recent_messages(self):
+    async def send_recent_messages(self, messages):
         """Send last 20 messages when user connects"""
-        messages = await self.get_recent_messages()
         await self.send(text_data=json.dumps({
             'type': 'message_history',
             'messages': messages
         }))
 
-    @database_sync_to_async
     def get_recent_messages(self):
         messages = CommunityMessage.objects.filter(
             community_id=self.community_id,
             is_deleted=False
-        ).order_by('-created_at')[:20]
+        ).select_related('sender').order_by('-created_at')[:20]
         
         result = []
         for msg in messages:
@@ -133,29 +150,65 @@ class CommunityChatConsumer(AsyncWebsocketConsumer):
             await self.send_error("Message cannot be empty", status=400)
             return
             
+        if write_behind.ENABLED:
+            await self.queue_community_message(message_content, data.get('client_id'))
+            return
+
         # Save message to database
         saved_message = await self.save_community_message(message_content)
         if not saved_message:
             await self.send_error("Failed to save message", status=500)
             return  
             
-        # Prepare response
-        response = {
+        await self.broadcast_message(self.message_payload(saved_message))
+
+    def message_payload(self, message):
+        return {
             'type': 'chat_message',
-            'message_id': saved_message.id,
-            'content': message_content,
-            'sender': await self.get_user_data(self.user),
-            'timestamp': saved_message.created_at.isoformat(),
+            'message_id': message.id,
+            'content': message.content,
+            'sender': self.get_user_data(self.user),
+            'timestamp': message.created_at.isoformat(),
             'is_edited': False
         }
-        await self.broadcast_message(response)
+
+    async def queue_community_message(self, content, client_id=None):
+        """Write-behind path: broadcast and ack once the batch holding the message is committed."""
+        message = CommunityMessage(
+            community_id=self.community_id, sender=self.user,
+            content=content, created_at=timezone.now(),
+        )
+        try:
+            await message_buffer.add(message)
+        except Exception as e:
+            print(f"Error saving message: {str(e)}")
+            await self.send_error("Failed to save message", status=500)
+            return
+        await self.broadcast_message(self.message_payload(message))
+        await self.send(text_data=json.dumps({
+            'type': 'message_ack', 'client_id': client_id, 'message_id': message.pk,
+        }))
     async def process_file_share(self, data):
-        """Handles both direct uploads (Base64) and URL shares"""
+        """Handles direct uploads (Base64), re-shares of stored files (sha256) and URL shares"""
         file_name = data.get('file_name')
         message = data.get('message', '')
         
+        # Case 0: The sender can already read a stored copy; no upload needed
+        if 'sha256' in data and 'file_data' not in data:
+            blob = await database_sync_to_async(access.acquire_readable)(self.user, data['sha256'])
+            if blob is None:
+                # Not an error: the client falls back to sending file_data
+                await self.send(text_data=json.dumps({'type': 'file_unknown', 'sha256': data['sha256']}))
+                return
+            saved_message = await self.save_file_message(
+                file=blob.name,
+                file_name=file_name,
+                file_size=blob.size,
+                content=message
+            )
+
         # Case 1: Direct file upload (Base64)
-        if 'file_data' in data:
+        elif 'file_data' in data:
             try:
                 import base64
                 from django.core.files.base import ContentFile
@@ -173,9 +226,10 @@ class CommunityChatConsumer(AsyncWebsocketConsumer):
                 # Create Django file object
                 file_content = ContentFile(file_bytes, name=file_name)
                 
-                # Save to DB
+                # Stored once per digest; re-shares of the same bytes reuse it
+                blob = await blobs.store_async(file_content)
                 saved_message = await self.save_file_message(
-                    file=file_content,  # Store in FileField
+                    file=blob.name,  # Store in FileField
                     file_name=file_name,
                     file_size=file_size,
                     content=message
@@ -212,25 +266,18 @@ class CommunityChatConsumer(AsyncWebsocketConsumer):
             'file_url': saved_message.file.url if saved_message.file else saved_message.file_url,
             'file_name': saved_message.file_name,
             'file_size': saved_message.file_size,
-            'sender': await self.get_user_data(self.user),
+            'sender': self.get_user_data(self.user),
             'timestamp': saved_message.created_at.isoformat()
         })
         # Broadcast message to community group
     async def broadcast_message(self, response):
-        await self.channel_layer.group_send(
-        self.room_group_name,
-        {
-            'type': 'chat.message',
-            'data': response
-        }
-        )
+        await self.channel_layer.group_send(self.room_group_name, broadcast.chat_event(response))
     @database_sync_to_async
     def save_file_message(self, file=None, file_url=None, file_name=None, file_size=None, content=''):
         """Handles both file types in one method"""
         try:
-            community = Community.objects.get(id=self.community_id)
             return CommunityMessage.objects.create(
-                community=community,
+                community_id=self.community_id,
                 sender=self.user,
                 content=content,
                 file=file,       # For direct uploads
@@ -245,18 +292,15 @@ class CommunityChatConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def save_community_message(self, content):
         try:
-            community = Community.objects.get(id=self.community_id)
-            message = CommunityMessage.objects.create(
-                community=community,
+            return CommunityMessage.objects.create(
+                community_id=self.community_id,
                 sender=self.user,
                 content=content
             )
-            return message
         except Exception as e:
             print(f"Error saving message: {str(e)}")
             return None
 
-    @database_sync_to_async
     def get_user_data(self, user):
         return {
             'id': user.id,
@@ -264,7 +308,7 @@ class CommunityChatConsumer(AsyncWebsocketConsumer):
         }
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps(event['data']))
+        await self.send(text_data=event['text'])
 
     @database_sync_to_async
     def authenticate_token(self, token):
@@ -280,42 +324,43 @@ class CommunityChatConsumer(AsyncWebsocketConsumer):
 
     async def complete_connection(self):
         self.room_group_name = f'community_{self.community_id}'
-        await self.send_recent_messages()
-        if await self.verify_community_membership():
+        joined = await self.join_community()
+        if joined is not None:
+            recent_messages, member_ids = joined
+            await self.send_recent_messages(recent_messages)
             await self.channel_layer.group_add(
                 self.room_group_name,
                 self.channel_name
             )
             self.awaiting_auth = False
             self.authenticated = True
-            await self.add_user_to_community_online_list()
             print(f"User {self.user.username} connected")
             print(f"User {self.user.username} connected to community {self.community_id}")
-            await self.broadcast_message({
-                'type': 'user_joined',
-                'user': await self.get_user_data(self.user)
-            })
+            self.presence_rooms = [presence.ANYWHERE, self.room_group_name]
+            came_online = await presence.join_async(self.user.id, self.presence_rooms)
+            await self.send(text_data=json.dumps({
+                'type': 'online_members',
+                'user_ids': await presence.online_async(self.room_group_name, member_ids),
+                'heartbeat_interval': presence.HEARTBEAT_INTERVAL,
+            }))
+            # Further tabs of a user who is already here are not news to the room
+            if self.room_group_name in came_online:
+                await self.broadcast_message({
+                    'type': 'user_joined',
+                    'user': self.get_user_data(self.user)
+                })
           
         else:
             await self.close(code=4003)
     @database_sync_to_async
-    def add_user_to_community_online_list(self):
-        community = Community.objects.get(id=self.community_id)
-        community.online_members.add(self.user)
-    @database_sync_to_async
-    def verify_community_membership(self):
-        try:
-            community = Community.objects.get(id=self.community_id)
-            return community.members.filter(id=self.user.id).exists()
-        except Community.DoesNotExist:
-            return False
-    @database_sync_to_async
-    def remove_user_from_online_list(self):
-        try:
-            community = Community.objects.get(id=self.community_id)
-            community.online_members.remove(self.user)
-        except Community.DoesNotExist:
-            pass
+    def join_community(self):
+        """``(recent messages, member ids)`` in one executor hop; None if not a member."""
+        member_ids = list(Community.members.through.objects.filter(
+            community_id=self.community_id
+        ).values_list('user_id', flat=True))
+        if self.user.id not in member_ids:
+            return None
+        return self.get_recent_messages(), member_ids
     async def disconnect(self, close_code):
         if hasattr(self, 'room_group_name'):
             await self.channel_layer.group_discard(
@@ -325,10 +370,13 @@ class CommunityChatConsumer(AsyncWebsocketConsumer):
             self.connected = False
             self.authenticated = False
             self.awaiting_auth = True
-            await self.broadcast_message({
-                'type': 'user_left',
-                'user': await self.get_user_data(self.user)
-            })
+        if getattr(self, 'presence_rooms', None):
+            went_offline = await presence.leave_async(self.user.id, self.presence_rooms)
+            if self.room_group_name in went_offline:
+                await self.broadcast_message({
+                    'type': 'user_left',
+                    'user': self.get_user_data(self.user)
+                })
         print(f"User disconnected from community chat with code {close_code}")
         
     async def handle_edit_message(self, data):
@@ -360,46 +408,29 @@ class CommunityChatConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def edit_message_db(self, message_id, new_content):
-        try:
-            message = CommunityMessage.objects.get(
-                id=message_id,
-                sender=self.user,
-                is_deleted=False
-            )
-            message.content = new_content
-            message.is_edited = True
-            message.save()
-            return True
-        except CommunityMessage.DoesNotExist:
-            return False
+        updated = CommunityMessage.objects.filter(
+            id=message_id,
+            sender=self.user,
+            is_deleted=False
+        ).update(content=new_content, is_edited=True)
+        return updated > 0
 
-    @database_sync_to_async 
+    @database_sync_to_async
     def delete_message_db(self, message_id):
+        updated = CommunityMessage.objects.filter(
+            id=message_id,
+            sender=self.user
+        ).update(is_deleted=True, deleted_at=timezone.now())
+        return updated > 0
+    @database_sync_to_async
+    def handle_like(self, message_id):
         try:
-            message = CommunityMessage.objects.get(
-                id=message_id,
-                sender=self.user
+            liked, like_count = reactions.toggle_like(
+                CommunityMessage, message_id, self.user.id, community_id=self.community_id
             )
-            message.is_deleted = True
-            message.deleted_at = timezone.now() 
-            message.save()
-            return True
         except CommunityMessage.DoesNotExist:
-            return False
-    @database_sync_to_async
-    def handle_like(self, community_id, message_id):
-        user = self.user
-        message = CommunityMessage.objects.get(id=message_id, community_id=community_id)
-
-        if user in message.likes.all():
-            message.likes.remove(user)
-            liked = False
-        else:
-            message.likes.add(user)
-            liked = True
-
-        message.update_like_count()
-        return {"liked": liked, "like_count": message.like_count}
+            return None
+        return {"liked": liked, "like_count": like_count}
     async def message_edited(self, event):
         await self.send(text_data=json.dumps({
             'type': 'message_edited',
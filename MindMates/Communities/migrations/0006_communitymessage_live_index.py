@@ -0,0 +1,21 @@
+from django.db import migrations, models
+from MindMates.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("Communities", "0005_communitymessage_like_count_communitymessage_likes"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="communitymessage",
+            index=models.Index(
+                condition=models.Q(is_deleted=False),
+                fields=["community", "created_at", "id"],
+                name="comm_msg_live_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations
+from MindMates.operations import full_text_index_sql
+
+forwards, backwards = full_text_index_sql("Communities_communitymessage", "comm_msg_search_idx")
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("Communities", "0006_communitymessage_live_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards, atomic=False),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Communities', '0007_communitymessage_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='communitymessage',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedCommunityMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('content', models.TextField()),
+                ('file', models.FileField(blank=True, null=True, upload_to='community_files/')),
+                ('file_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('file_url', models.URLField(blank=True, null=True)),
+                ('file_size', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('is_edited', models.BooleanField(default=False)),
+                ('like_count', models.PositiveIntegerField(default=0)),
+                ('community', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='Communities.community')),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['community', 'created_at', 'id'], name='comm_archmsg_idx')],
+            },
+        ),
+    ]
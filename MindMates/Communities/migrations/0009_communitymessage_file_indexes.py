@@ -0,0 +1,21 @@
+from django.db import migrations, models
+from MindMates.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("Communities", "0008_archive"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="communitymessage",
+            index=models.Index(condition=models.Q(("file__gt", "")), fields=["file"], name="comm_msg_file_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="archivedcommunitymessage",
+            index=models.Index(condition=models.Q(("file__gt", "")), fields=["file"], name="comm_archmsg_file_idx"),
+        ),
+    ]
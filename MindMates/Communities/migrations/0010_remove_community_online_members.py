@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Communities', '0009_communitymessage_file_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='community',
+            name='online_members',
+        ),
+    ]
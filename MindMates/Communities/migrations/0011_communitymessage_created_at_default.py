@@ -0,0 +1,19 @@
+# Generated by Django 4.2.16 on 2026-10-18 09:30
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Communities', '0010_remove_community_online_members'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='communitymessage',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
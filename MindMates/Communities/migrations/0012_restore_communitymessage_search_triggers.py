@@ -0,0 +1,17 @@
+from django.db import migrations
+from MindMates.operations import full_text_index_sql
+
+# 0011 rebuilt Communities_communitymessage on SQLite, which dropped the FTS triggers from 0007
+forwards, _ = full_text_index_sql("Communities_communitymessage", "comm_msg_search_idx")
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("Communities", "0011_communitymessage_created_at_default"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop, atomic=False),
+    ]
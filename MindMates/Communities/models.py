@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 # Create your models here.
 class Community(models.Model):
@@ -7,7 +8,6 @@ class Community(models.Model):
     description= models.TextField()
     creaters = models.ForeignKey(User, on_delete=models.CASCADE, related_name='create_communities')
     members = models.ManyToManyField(User,related_name='communities')
-    online_members = models.ManyToManyField(User, related_name='online_communities', blank=True)
     created_at= models.DateTimeField(auto_now_add=True)
     image = models.ImageField(upload_to='community_image', null=True, blank=True)
     
@@ -22,9 +22,11 @@ class CommunityMessage(models.Model):
     file_name = models.CharField(max_length=255, blank=True, null=True)
     file_url = models.URLField(blank=True, null=True)
     file_size = models.PositiveIntegerField(blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: write-behind batches keep the time the message was broadcast with
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     is_edited = models.BooleanField(default=False)
     is_deleted = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(null=True, blank=True)
     likes = models.ManyToManyField(
         User, 
         related_name='liked_messages',
@@ -34,9 +36,47 @@ class CommunityMessage(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Live history of a community; soft-deleted rows stay out of the index
+            models.Index(
+                fields=['community', 'created_at', 'id'],
+                condition=models.Q(is_deleted=False),
+                name='comm_msg_live_idx',
+            ),
+            # Media access checks: which messages carry a given file
+            models.Index(fields=['file'], condition=models.Q(file__gt=''), name='comm_msg_file_idx'),
+        ]
     def update_like_count(self):
         """Updates the cached like count"""
         self.like_count = self.likes.count()
         self.save(update_fields=['like_count'])
     def __str__(self):
-        return f"{self.sender.username}: {self.content[:20]}..."
\ No newline at end of file
+        return f"{self.sender.username}: {self.content[:20]}..."
+
+
+class ArchivedCommunityMessage(models.Model):
+    """A cold CommunityMessage moved out of the hot table by ``manage.py archive_messages``."""
+    id = models.BigIntegerField(primary_key=True)
+    community = models.ForeignKey(Community, on_delete=models.CASCADE, related_name='archived_messages')
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    content = models.TextField()
+    file = models.FileField(upload_to='community_files/', null=True, blank=True)
+    file_name = models.CharField(max_length=255, blank=True, null=True)
+    file_url = models.URLField(blank=True, null=True)
+    file_size = models.PositiveIntegerField(blank=True, null=True)
+    created_at = models.DateTimeField()
+    is_edited = models.BooleanField(default=False)
+    like_count = models.PositiveIntegerField(default=0)
+
+    # Serializes like a CommunityMessage
+    is_deleted = False
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['community', 'created_at', 'id'], name='comm_archmsg_idx'),
+            models.Index(fields=['file'], condition=models.Q(file__gt=''), name='comm_archmsg_file_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived {self.sender_id}: {self.content[:20]}..."
@@ -1,6 +1,8 @@
 from .models import Community, CommunityMessage
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from MindMates.reactions import LikedListSerializer, is_liked
+from MediaFiles.fields import ImageVariantsField
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -9,9 +11,10 @@ class UserSerializer(serializers.ModelSerializer):
         
         
 class CommunitySerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField(source='image')
     class Meta:
         model = Community
-        fields =['id','name','description','image']
+        fields =['id','name','description','image','image_variants']
         extra_kwargs = {
             'creaters':{'read_only':True}
         }
@@ -27,9 +30,10 @@ class CommunityDetailSerializer(serializers.ModelSerializer):
     member = UserSerializer(many=True, read_only=True)
     member_count = serializers.SerializerMethodField()
     is_member = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField(source='image')
     class Meta:
         model= Community
-        fields = ['id','name','description','creaters','member','member_count','created_at','image','is_member']
+        fields = ['id','name','description','creaters','member','member_count','created_at','image','image_variants','is_member']
     def get_member_count(self,obj):
         return obj.members.count()
     
@@ -54,13 +58,14 @@ class CommunityMessageSerializer(serializers.ModelSerializer):
     community_id = serializers.IntegerField(write_only=True, required=False)
     like_count = serializers.IntegerField(read_only=True)
     is_liked = serializers.SerializerMethodField()
+    file_variants = ImageVariantsField(source='file')
     class Meta:
         model = CommunityMessage
-        fields = ['id','community','community_id','sender','sender_id','content','file', 'created_at', 'is_edited', 'is_deleted','like_count', 'is_liked']
+        fields = ['id','community','community_id','sender','sender_id','content','file', 'file_variants', 'created_at', 'is_edited', 'is_deleted','like_count', 'is_liked']
         read_only_fields = ['created_at', 'is_edited', 'is_deleted']
+        list_serializer_class = LikedListSerializer
     def get_is_liked(self, obj):
-        request = self.context.get('request')
-        return request and request.user.is_authenticated and request.user in obj.likes.all()
+        return is_liked(self, obj)
     def create(self, validated_data):
         validated_data.pop('sender_id', None)
         validated_data.pop('community_id', None)
@@ -72,16 +77,18 @@ class FileUploadSerializer(serializers.ModelSerializer):
         style={'input_type': 'file', 'template': 'rest_framework/file.html'}
     )
     content = serializers.CharField(required=False, allow_blank=True)
+    # Digest of a file the sender can already read: re-share it without uploading
+    sha256 = serializers.CharField(required=False, write_only=True)
     
     class Meta:
         model = CommunityMessage
-        fields = ['content', 'file']
+        fields = ['content', 'file', 'sha256']
         extra_kwargs = {
             'file': {'write_only': True}
         }
 
     def validate(self, data):
         # Require either content or file
-        if not data.get('content') and not data.get('file'):
+        if not data.get('content') and not data.get('file') and not data.get('sha256'):
             raise serializers.ValidationError("Either content or file must be provided")
         return data
\ No newline at end of file
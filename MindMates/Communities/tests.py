@@ -1,3 +1,277 @@
-from django.test import TestCase
+import asyncio
+import json
+import time
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from MindMates import broadcast, presence, reactions
+from MindMates.db_executor import get_executor
+from MindMates.testing import full_scans, measure_frame, query_plan, receive_type, report, ws_connect
+from .models import Community, CommunityMessage
+from .serializers import CommunityMessageSerializer
+
+
+class HotPathIndexTests(TestCase):
+    def test_live_history_uses_partial_index(self):
+        owner = User.objects.create(username='owner')
+        community = Community.objects.create(name='c', description='d', creaters=owner)
+        for i in range(20):
+            CommunityMessage.objects.create(community=community, sender=owner, content=f'm{i}', is_deleted=i % 5 == 0)
+        plan = query_plan(
+            CommunityMessage.objects.filter(community=community, is_deleted=False).order_by('-created_at', '-id')[:21]
+        )
+        self.assertEqual(full_scans(plan), [], plan)
+        self.assertIn('comm_msg_live_idx', plan)
+
+
+class ConsumerHopTests(TransactionTestCase):
+    """Each community frame type costs one hop onto the consumer DB executor."""
+
+    def setUp(self):
+        self.owner = User.objects.create(username='owner')
+        self.community = Community.objects.create(name='c', description='d', creaters=self.owner)
+        self.community.members.add(self.owner)
+        self.message = CommunityMessage.objects.create(community=self.community, sender=self.owner, content='hi')
+
+    async def test_hops_and_latency_per_frame(self):
+        completed, started = get_executor().stats()['completed'], time.perf_counter()
+        communicator = await ws_connect(f'/ws/community/{self.community.id}/', self.owner)
+        await receive_type(communicator, 'online_members')
+        results = {'auth': (get_executor().stats()['completed'] - completed, time.perf_counter() - started)}
+        message_id = self.message.id
+        frames = [
+            ('chat_message', {'type': 'chat_message', 'message': 'hello'}, 'chat_message'),
+            ('edit_message', {'type': 'edit_message', 'message_id': message_id, 'new_content': 'x'}, 'message_edited'),
+            ('like_message', {'type': 'like_message', 'message_id': message_id}, 'like_update'),
+            ('delete_message', {'type': 'delete_message', 'message_id': message_id}, 'message_deleted'),
+            ('heartbeat', {'type': 'heartbeat'}, 'heartbeat_ack'),
+        ]
+        for label, frame, reply in frames:
+            results[label] = await measure_frame(communicator, frame, reply)
+        await communicator.disconnect()
+
+        report('Community consumer: executor hops and latency per frame', {
+            label: {'hops': hops, 'ms': round(seconds * 1000, 2)} for label, (hops, seconds) in results.items()
+        })
+        expected = {label: 1 for label in results}
+        expected['auth'] = 2  # token check, then membership and history together
+        expected['heartbeat'] = 0  # presence lives in the cache
+        self.assertEqual({label: hops for label, (hops, _) in results.items()}, expected)
+
+
+class FanOutTests(TransactionTestCase):
+    """A room message is encoded once by the sender, whatever the number of receivers."""
+
+    def setUp(self):
+        self.owner = User.objects.create(username='owner')
+        self.community = Community.objects.create(name='c', description='d', creaters=self.owner)
+        self.members = [self.owner] + [User.objects.create(username=f'member{i:02d}') for i in range(19)]
+        self.community.members.add(*self.members)
+
+    async def fan_out(self, size):
+        url = f'/ws/community/{self.community.id}/'
+        sockets = []
+        for member in self.members[:size]:
+            communicator = await ws_connect(url, member)
+            await receive_type(communicator, 'online_members')
+            sockets.append(communicator)
+        with mock.patch.object(broadcast, 'encode', wraps=broadcast.encode) as encode:
+            cpu, started = time.process_time(), time.perf_counter()
+            await sockets[0].send_json_to({'type': 'chat_message', 'message': 'to everyone'})
+            frames = await asyncio.gather(*(receive_type(s, 'chat_message') for s in sockets))
+            cpu, elapsed = time.process_time() - cpu, time.perf_counter() - started
+        for communicator in sockets:
+            await communicator.disconnect()
+        return encode.call_count, frames, cpu, elapsed
+
+    async def test_encoded_once_per_message(self):
+        rows = {}
+        for size in (1, 5, 20):
+            encodes, frames, cpu, elapsed = await self.fan_out(size)
+            self.assertEqual(encodes, 1)
+            self.assertEqual({frame['content'] for frame in frames}, {'to everyone'})
+            # What re-encoding the frame in every receiving consumer would have cost
+            per_receiver = time.process_time()
+            for frame in frames:
+                json.dumps(frame, cls=DjangoJSONEncoder)
+            rows[f'{size} receiver(s)'] = {
+                'encodes': encodes, 'cpu_ms': round(cpu * 1000, 2), 'wall_ms': round(elapsed * 1000, 2),
+                'per_receiver_encode_ms': round((time.process_time() - per_receiver) * 1000, 3),
+            }
+        report('Community fan-out per message by room size', rows)
+
+
+class ReactionTests(TestCase):
+    """toggle_like keeps like_count in step with the likes table."""
+
+    def setUp(self):
+        self.owner = User.objects.create(username='owner')
+        self.members = [User.objects.create(username=f'member{i}') for i in range(3)]
+        self.community = Community.objects.create(name='c', description='d', creaters=self.owner)
+        self.messages = [
+            CommunityMessage.objects.create(community=self.community, sender=self.owner, content=f'm{i}')
+            for i in range(3)
+        ]
+
+    def assert_in_step(self, message):
+        message.refresh_from_db()
+        self.assertEqual(message.like_count, message.likes.count())
+
+    def test_like_unlike_round_trip(self):
+        message = self.messages[0]
+        user_id = self.members[0].id
+        self.assertEqual(reactions.toggle_like(CommunityMessage, message.id, user_id), (True, 1))
+        self.assertEqual(reactions.toggle_like(CommunityMessage, message.id, user_id), (False, 0))
+        self.assert_in_step(message)
+
+    def test_counter_follows_many_toggles(self):
+        message = self.messages[0]
+        for round_ in range(3):
+            for member in self.members[:round_ + 1]:
+                reactions.toggle_like(CommunityMessage, message.id, member.id)
+        # member0 toggled three times, member1 twice, member2 once
+        self.assertEqual(set(message.likes.values_list('id', flat=True)), {self.members[0].id, self.members[2].id})
+        self.assert_in_step(message)
+
+    def test_scope_and_missing_message(self):
+        other = Community.objects.create(name='o', description='d', creaters=self.owner)
+        with self.assertRaises(CommunityMessage.DoesNotExist):
+            reactions.toggle_like(CommunityMessage, self.messages[0].id, self.owner.id, community_id=other.id)
+        with self.assertRaises(CommunityMessage.DoesNotExist):
+            reactions.toggle_like(CommunityMessage, 0, self.owner.id)
+
+    def test_is_liked_in_one_query(self):
+        member = self.members[0]
+        reactions.toggle_like(CommunityMessage, self.messages[1].id, member.id)
+        reactions.toggle_like(CommunityMessage, self.messages[2].id, self.members[1].id)
+        request = RequestFactory().get('/')
+        request.user = member
+        queryset = CommunityMessage.objects.filter(community=self.community).select_related('sender').order_by('id')
+        # The messages, then one lookup of the user's likes for all of them
+        with self.assertNumQueries(2):
+            data = CommunityMessageSerializer(queryset, many=True, context={'request': request}).data
+        self.assertEqual([item['is_liked'] for item in data], [False, True, False])
+        single = CommunityMessageSerializer(self.messages[1], context={'request': request}).data
+        self.assertTrue(single['is_liked'])
+
+
+class LikeFrameTests(TransactionTestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='owner')
+        self.community = Community.objects.create(name='c', description='d', creaters=self.owner)
+        self.community.members.add(self.owner)
+        self.message = CommunityMessage.objects.create(community=self.community, sender=self.owner, content='hi')
+
+    async def connect(self):
+        communicator = await ws_connect(f'/ws/community/{self.community.id}/', self.owner)
+        await receive_type(communicator, 'online_members')
+        return communicator
+
+    async def test_like_and_unlike(self):
+        communicator = await self.connect()
+        updates = []
+        for _ in range(2):
+            await communicator.send_json_to({'type': 'like_message', 'message_id': self.message.id})
+            updates.append(await receive_type(communicator, 'like_update'))
+        await communicator.disconnect()
+        self.assertEqual([(u['liked'], u['like_count']) for u in updates], [(True, 1), (False, 0)])
+
+    async def test_missing_message_gets_error_frame(self):
+        communicator = await self.connect()
+        await communicator.send_json_to({'type': 'like_message', 'message_id': self.message.id + 100})
+        error = await receive_type(communicator, 'error')
+        self.assertEqual((error['message'], error['status']), ('Message not found', 404))
+        # Still connected
+        await communicator.send_json_to({'type': 'heartbeat'})
+        await receive_type(communicator, 'heartbeat_ack')
+        await communicator.disconnect()
+
+
+class PresenceTests(SimpleTestCase):
+    """Per-room connection counters in the cache."""
+
+    ROOM = 'community_1'
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_connections_are_counted(self):
+        rooms = [presence.ANYWHERE, self.ROOM]
+        self.assertEqual(presence.join(1, rooms), rooms)
+        # A second tab is not news
+        self.assertEqual(presence.join(1, rooms), [])
+        self.assertEqual(presence.leave(1, rooms), [])
+        self.assertEqual(presence.online(self.ROOM, [1]), [1])
+        self.assertEqual(presence.leave(1, rooms), rooms)
+        self.assertEqual(presence.online(self.ROOM, [1]), [])
+
+    def test_online_is_one_lookup(self):
+        presence.join(1, [self.ROOM])
+        presence.join(3, [self.ROOM])
+        presence.join(2, ['community_2'])
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            self.assertEqual(presence.online(self.ROOM, [1, 2, 3, 4]), [1, 3])
+        get_many.assert_called_once()
+
+    def test_expires_without_heartbeat(self):
+        with mock.patch.object(presence, 'TTL', 0.1):
+            presence.join(1, [self.ROOM])
+            time.sleep(0.15)
+            self.assertEqual(presence.online(self.ROOM, [1]), [])
+            # The socket that finally disconnects finds nothing left to decrement
+            self.assertEqual(presence.leave(1, [self.ROOM]), [self.ROOM])
+
+    def test_heartbeat_renews_and_recovers(self):
+        with mock.patch.object(presence, 'TTL', 0.2):
+            presence.join(1, [self.ROOM])
+            time.sleep(0.12)
+            presence.heartbeat(1, [self.ROOM])
+            time.sleep(0.12)
+            self.assertEqual(presence.online(self.ROOM, [1]), [1])
+            # Heartbeats came too late and the counter lapsed: the next one counts the socket again
+            time.sleep(0.25)
+            presence.heartbeat(1, [self.ROOM])
+            self.assertEqual(presence.online(self.ROOM, [1]), [1])
+            self.assertEqual(presence.leave(1, [self.ROOM]), [self.ROOM])
+
+
+class PresenceSocketTests(TransactionTestCase):
+    """Room members hear about a user's first tab opening and last tab closing."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.owner = User.objects.create(username='owner')
+        self.member = User.objects.create(username='member')
+        self.community = Community.objects.create(name='c', description='d', creaters=self.owner)
+        self.community.members.add(self.owner, self.member)
+        self.url = f'/ws/community/{self.community.id}/'
+
+    async def connect(self, user):
+        communicator = await ws_connect(self.url, user)
+        await receive_type(communicator, 'online_members')
+        return communicator
+
+    async def test_two_tabs(self):
+        watcher = await self.connect(self.member)
+        await receive_type(watcher, 'user_joined')  # its own arrival
+        first = await self.connect(self.owner)
+        joined = await receive_type(watcher, 'user_joined')
+        self.assertEqual(joined['user']['id'], self.owner.id)
+        second = await ws_connect(self.url, self.owner)
+        online = await receive_type(second, 'online_members')
+        self.assertEqual(set(online['user_ids']), {self.owner.id, self.member.id})
+
+        # One tab closing leaves the owner online
+        await first.disconnect()
+        self.assertTrue(await watcher.receive_nothing(0.1))
+        self.assertEqual(await presence.online_async(f'community_{self.community.id}', [self.owner.id]), [self.owner.id])
+
+        await second.disconnect()
+        left = await receive_type(watcher, 'user_left')
+        self.assertEqual(left['user']['id'], self.owner.id)
+        await watcher.disconnect()
 
-# Create your tests here.
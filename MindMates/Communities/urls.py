@@ -6,6 +6,7 @@ urlpatterns = [
     path('<int:pk>/join/', views.JoinCommunity.as_view(), name='join-community'),
     path('<int:pk>/leave/', views.LeaveCommunity.as_view(),name='leave-community'),
     path('<int:pk>/remove/',views.RemoveMember.as_view(), name='remove-member'),
+    path('<int:pk>/online/', views.OnlineMembers.as_view(), name='online-members'),
     path('<int:pk>/messages/', views.CommunityMessageListCreate.as_view(), name='community-messages'),
     path('<int:community_id>/upload/', views.upload_file, name='file-upload'),
     path('<int:community_id>/debug/', views.debug_community, name='file-upload'),
@@ -4,6 +4,7 @@ from rest_framework import generics,permissions,status
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
 from rest_framework.response import  Response
+from rest_framework.exceptions import ValidationError
 from django.core.exceptions import PermissionDenied
 from .models import *
 from django.core.exceptions import ImproperlyConfigured
@@ -17,6 +18,10 @@ from asgiref.sync import async_to_sync
 from rest_framework.decorators import authentication_classes
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from django.db import transaction
+from Chats.pagination import MessageCursorPagination
+from MindMates import broadcast, presence, reactions
+from Chats.uploads import MAX_UPLOAD_SIZE, UploadError, request_too_large, validate_upload
+from MediaFiles import access, blobs
 # Create your views here.
 class CommunityListCreate(generics.ListCreateAPIView):
     queryset = Community.objects.all()
@@ -78,14 +83,29 @@ class RemoveMember(APIView):
         community.members.remove(user)
         return Response({'status': 'member removed'}, status=status.HTTP_200_OK)
               
+class OnlineMembers(APIView):
+    """Members currently connected to the community's chat, from the presence cache."""
+    permission_classes = [permissions.IsAuthenticated]
+    def get(self, request, pk):
+        community = get_object_or_404(Community, pk=pk)
+        member_ids = list(community.members.values_list('id', flat=True))
+        if request.user.id not in member_ids:
+            return Response({'error': 'Not a member of this community'}, status=status.HTTP_403_FORBIDDEN)
+        online_ids = presence.online(f'community_{community.id}', member_ids)
+        online = community.members.filter(id__in=online_ids).values('id', 'username').order_by('username')
+        return Response({'online': list(online), 'count': len(online_ids)}, status=status.HTTP_200_OK)
+
 class CommunityMessageListCreate(generics.ListCreateAPIView):
     serializer_class = CommunityMessageSerializer
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
+    pagination_class = MessageCursorPagination
     
     def get_queryset(self):
         community_id = self.kwargs['pk']
-        return CommunityMessage.objects.filter(community__id=community_id, is_deleted=False)
+        return CommunityMessage.objects.filter(community_id=community_id, is_deleted=False).select_related('sender')
+    def get_archive_queryset(self):
+        return ArchivedCommunityMessage.objects.filter(community_id=self.kwargs['pk']).select_related('sender')
     def perform_create(self, serializer):
         community_id = self.kwargs['pk']
         community = get_object_or_404(Community, pk=community_id)
@@ -95,13 +115,19 @@ class CommunityMessageListCreate(generics.ListCreateAPIView):
             raise PermissionDenied("You are not a member of this community")
         file = self.request.FILES.get('file')
         if file:
-            serializer.save(
-                sender= self.request.user,
-                community  = community,
-                file = file,
-                file_name = file.name,
-                file_size = file.size
-                )
+            try:
+                validate_upload(file.name, file.size)
+            except UploadError as e:
+                raise ValidationError({'file': e.message})
+            # Stored once per digest, like every other attachment
+            with transaction.atomic():
+                serializer.save(
+                    sender= self.request.user,
+                    community  = community,
+                    file = blobs.store(file).name,
+                    file_name = re.sub(r'[^\w\-_. ]', '', file.name),
+                    file_size = file.size
+                    )
         else:
             serializer.save(
                 sender=self.request.user,
@@ -125,6 +151,13 @@ def upload_file(request, community_id):
                 status=status.HTTP_403_FORBIDDEN
             )
 
+        # Refuse oversized bodies before Django spools them
+        if request_too_large(request):
+            return Response(
+                {"error": f"File too large (max {MAX_UPLOAD_SIZE // (1024 * 1024)}MB)"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
         serializer = FileUploadSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
@@ -135,50 +168,50 @@ def upload_file(request, community_id):
             'content': serializer.validated_data.get('content', '')
         }
         
-        if 'file' in serializer.validated_data:
-            uploaded_file = serializer.validated_data['file']
-            
-            # File validation
-            if uploaded_file.size > 10 * 1024 * 1024:
-                return Response(
-                    {"error": "File too large (max 10MB)"}, 
-                    status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
-                )
+        with transaction.atomic():
+            # Identical bytes are stored once; the sha256 of a file the sender can read skips the upload
+            if serializer.validated_data.get('file'):
+                uploaded_file = serializer.validated_data['file']
+                try:
+                    validate_upload(uploaded_file.name, uploaded_file.size)
+                except UploadError as e:
+                    return Response({"error": e.message}, status=e.status)
                 
-            allowed_extensions = ['.pdf', '.jpg', '.jpeg', '.png', '.doc', '.docx', '.xls', '.xlsx','.txt']
-            file_ext = '.' + uploaded_file.name.split('.')[-1].lower()
-            if file_ext not in allowed_extensions:
-                return Response(
-                    {"error": f"Invalid file type. Allowed: {', '.join(allowed_extensions)}"},
-                    status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
-                )
-            
-            message_data.update({
-                'file': uploaded_file,
-                'file_name': re.sub(r'[^\w\-_. ]', '', uploaded_file.name),
-                'file_size': uploaded_file.size
-            })
+                message_data.update({
+                    'file': blobs.store(uploaded_file).name,
+                    'file_name': re.sub(r'[^\w\-_. ]', '', uploaded_file.name),
+                    'file_size': uploaded_file.size
+                })
+            elif serializer.validated_data.get('sha256'):
+                blob = access.acquire_readable(request.user, serializer.validated_data['sha256'])
+                if blob is None:
+                    return Response({"error": "Unknown file hash, upload the file instead"}, status=status.HTTP_404_NOT_FOUND)
+                message_data.update({
+                    'file': blob.name,
+                    'file_name': re.sub(r'[^\w\-_. ]', '', request.data.get('file_name', '')) or None,
+                    'file_size': blob.size
+                })
 
-        message = CommunityMessage.objects.create(**message_data)
+            message = CommunityMessage.objects.create(**message_data)
         
         # WebSocket broadcast (simplified)
         try:
             channel_layer = get_channel_layer()
             async_to_sync(channel_layer.group_send)(
                 f"community_{community_id}",
-                {
-                    "type": "chat.message",
-                    "message": {
-                        "id": message.id,
-                        "content": message.content,
-                        "file_url": message.file.url if message.file else None,
-                        "sender": {
-                            "id": request.user.id,
-                            "username": request.user.username
-                        },
-                        "timestamp": message.created_at.isoformat()
-                    }
-                }
+                broadcast.chat_event({
+                    "type": "file_message",
+                    "message_id": message.id,
+                    "content": message.content,
+                    "file_url": message.file.url if message.file else None,
+                    "file_name": message.file_name,
+                    "file_size": message.file_size,
+                    "sender": {
+                        "id": request.user.id,
+                        "username": request.user.username
+                    },
+                    "timestamp": message.created_at.isoformat()
+                })
             )
         except Exception as e:
             print(f"WebSocket error (non-critical): {e}")
@@ -205,34 +238,21 @@ def debug_community(request, community_id):
 @authentication_classes([JWTAuthentication])
 def toggle_like(request, community_id, message_id):
     try:
-        # Verify message belongs to community
-        message = CommunityMessage.objects.select_related('community').get(
-            id=message_id,
-            community_id=community_id
-        )
-        
         # Verify user is community member
-        if not message.community.members.filter(id=request.user.id).exists():
+        if not Community.members.through.objects.filter(community_id=community_id, user_id=request.user.id).exists():
             return Response(
                 {"error": "Not a community member"},
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Like toggle logic...
-        user = request.user
-        with transaction.atomic():
-            if user in message.likes.all():
-                message.likes.remove(user)
-                liked = False
-            else:
-                message.likes.add(user)
-                liked = True
-            message.update_like_count()
+        liked, like_count = reactions.toggle_like(
+            CommunityMessage, message_id, request.user.id, community_id=community_id
+        )
         
         return Response({
             "status": "success",
             "liked": liked,
-            "like_count": message.like_count
+            "like_count": like_count
         })
         
     except CommunityMessage.DoesNotExist:
@@ -0,0 +1,92 @@
+"""Who may read a stored file, and re-sharing files by digest.
+
+Used by the media view for downloads and by every upload path that lets
+a client skip the transfer by sending a SHA-256 it already knows.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.db.models import Q
+from Chats.models import ArchivedMessage, Message
+from Communities.models import ArchivedCommunityMessage, CommunityMessage
+from . import blobs
+from .models import Blob
+from .variants import IMAGE_EXTENSIONS, source_stem
+
+# Message attachments, readable only through their messages; everything else under MEDIA_ROOT is public
+PRIVATE_PREFIXES = ('ChatsFiles/', blobs.BLOB_DIR + '/')
+SIGNED_URL_MAX_AGE = getattr(settings, 'MEDIA_SIGNED_URL_MAX_AGE', 3600)
+
+
+def referencing(name):
+    """Filter for messages whose ``file`` is ``name`` or, for a variant, the image it was made from."""
+    stem = source_stem(name)
+    if stem is None:
+        return Q(file=name)
+    return Q(file__in=[stem + ext for ext in IMAGE_EXTENSIONS] + [stem + ext.upper() for ext in IMAGE_EXTENSIONS])
+
+
+def can_read(user, name):
+    """Whether ``user`` may download the stored file ``name``.
+
+    A private file is readable through any message carrying it that
+    ``user`` can see: one in a conversation they take part in, or in a
+    community they belong to. Each referencing row is judged on its own,
+    so posting a chat attachment in one community does not expose it to
+    everyone.
+    """
+    original = source_stem(name) or name
+    if not original.startswith(PRIVATE_PREFIXES):
+        return True
+    if not user.is_authenticated:
+        return False
+    match = referencing(name)
+    participant = Q(conversation__initiator=user) | Q(conversation__receiver=user)
+    if Message.objects.filter(match, participant).exists() or ArchivedMessage.objects.filter(match, participant).exists():
+        return True
+    if not blobs.is_blob(original):
+        # ChatsFiles/ names only ever belong to chat messages
+        return False
+    member = Q(community__members=user)
+    return (
+        CommunityMessage.objects.filter(match, member).exists()
+        or ArchivedCommunityMessage.objects.filter(match, member).exists()
+    )
+
+
+def acquire_readable(user, digest):
+    """``blobs.acquire()`` limited to blobs ``user`` can already read; None otherwise.
+
+    Knowing a digest proves nothing about having the bytes. An unreadable
+    blob is reported exactly like an unknown one, so the client sends the
+    file and the server hashes it itself.
+    """
+    if not blobs.is_digest(digest):
+        return None
+    name = Blob.objects.filter(digest=digest).values_list('name', flat=True).first()
+    if name is None or not can_read(user, name):
+        return None
+    return blobs.acquire(digest)
+
+
+def _signer(name):
+    # Salted with the file name: a signature for one file is worthless for any other
+    return signing.TimestampSigner(salt=f'MediaFiles.media:{name}')
+
+
+def sign(user, name):
+    """A ``sig`` query value that lets a request without credentials read ``name`` as ``user``."""
+    return _signer(name).sign(str(user.pk))
+
+
+def signed_user(name, sig):
+    """The user ``sig`` was issued to for ``name``; None if it is forged, for another file or expired.
+
+    The signature only stands in for credentials: the media view still runs
+    ``can_read()``, so access lost since signing is not regained.
+    """
+    try:
+        user_id = _signer(name).unsign(sig, max_age=SIGNED_URL_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return User.objects.filter(pk=user_id, is_active=True).first()
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class MediaFilesConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "MediaFiles"
+
+    def ready(self):
+        import MediaFiles.signals
@@ -0,0 +1,153 @@
+"""Content-addressed attachment storage.
+
+Attachments are stored once per SHA-256 digest under ``blobs/`` and
+message file fields point at that shared name. Every message that takes a
+reference bumps ``Blob.ref_count``; hard deletes release it. A client that
+already knows a file's digest can skip the transfer, but only through
+``access.acquire_readable()``, which checks it may read the blob.
+Files are never deleted here: ``manage.py sweep_media`` removes whatever
+nothing references.
+"""
+import hashlib
+import os
+import re
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from MindMates.db_executor import database_sync_to_async
+from .models import Blob
+
+BLOB_DIR = 'blobs'
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+READ_SIZE = 64 * 1024
+
+# Model label -> file fields that may point at a blob
+BLOB_FIELDS = {
+    'Chats.Message': ['file'],
+    'Chats.ArchivedMessage': ['file'],
+    'Communities.CommunityMessage': ['file'],
+    'Communities.ArchivedCommunityMessage': ['file'],
+}
+
+
+def is_digest(value):
+    return isinstance(value, str) and bool(DIGEST_RE.match(value))
+
+
+def blob_name(digest, extension=''):
+    # Two levels of fan-out keep any one directory small
+    return f"{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_DIR + '/')
+
+
+def digest_file(file):
+    """SHA-256 of a Django File, read in chunks; the file is rewound afterwards."""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks(READ_SIZE):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def acquire(digest):
+    """Take a reference on the blob with ``digest``; returns the Blob, or None if unknown."""
+    if not is_digest(digest):
+        return None
+    with transaction.atomic():
+        if not Blob.objects.filter(digest=digest).update(ref_count=F('ref_count') + 1):
+            return None
+        return Blob.objects.get(digest=digest)
+
+
+def store(file, digest=None, extension=None):
+    """Store ``file`` once per digest and take a reference on it; returns the Blob.
+
+    ``digest`` may be passed when it was computed while the file streamed
+    in; otherwise the file is read once to hash it. Bytes already on disk
+    under the digest are not written again.
+    """
+    digest = digest or digest_file(file)
+    blob = acquire(digest)
+    if blob is not None:
+        return blob
+    return register(digest, write(file, digest, extension), file.size)
+
+
+async def store_async(file, digest=None, extension=None):
+    """store() for consumers: only acquire() and the row write take a consumer DB pool thread.
+
+    Hashing and copying the bytes into storage run on the default executor,
+    so a large upload does not hold a pooled connection while it copies.
+    """
+    if digest is None:
+        digest = await sync_to_async(digest_file, thread_sensitive=False)(file)
+    blob = await database_sync_to_async(acquire)(digest)
+    if blob is not None:
+        return blob
+    name = await sync_to_async(write, thread_sensitive=False)(file, digest, extension)
+    return await database_sync_to_async(register)(digest, name, file.size)
+
+
+def write(file, digest, extension=None):
+    """Copy ``file`` to its blob name unless the bytes are already there; returns the name. No queries."""
+    if extension is None:
+        extension = os.path.splitext(file.name or '')[1].lower()
+    name = blob_name(digest, extension)
+    if not default_storage.exists(name):
+        file.seek(0)
+        saved = default_storage.save(name, file)
+        if saved != name:
+            # Another writer got there between exists() and save(); keep theirs
+            default_storage.delete(saved)
+    return name
+
+
+def register(digest, name, size):
+    """Create the Blob row for bytes ``write()`` stored, holding one reference."""
+    try:
+        with transaction.atomic():
+            return Blob.objects.create(digest=digest, name=name, size=size, ref_count=1)
+    except IntegrityError:
+        # Concurrent first upload of the same bytes: share the row it created
+        return acquire(digest)
+
+
+def release(names):
+    """Drop one reference per blob name in ``names``; other names are ignored.
+
+    Blobs that reach zero references are left for ``sweep_media``.
+    """
+    counts = {}
+    for name in names:
+        if is_blob(name):
+            counts[name] = counts.get(name, 0) + 1
+    for name, count in counts.items():
+        Blob.objects.filter(name=name, ref_count__gte=count).update(ref_count=F('ref_count') - count)
+
+
+def discard(field_file):
+    """Detach a message's attachment without touching storage.
+
+    A shared blob is released; either way the field is cleared and the
+    bytes are left for ``sweep_media``, so request and consumer threads
+    never delete files.
+    """
+    if not field_file:
+        return
+    release([field_file.name])
+    field_file.name = None
+    setattr(field_file.instance, field_file.field.attname, None)
+
+
+def live_references(name):
+    """How many rows point at blob ``name`` right now, soft-deleted ones included."""
+    return sum(
+        apps.get_model(label)._default_manager.filter(**{field: name}).count()
+        for label, fields in BLOB_FIELDS.items() for field in fields
+    )
@@ -0,0 +1,14 @@
+from rest_framework import serializers
+from .variants import variant_urls
+
+
+class ImageVariantsField(serializers.Field):
+    """Read-only ``{variant: url}`` for an image file field; null for empty and non-image files."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return variant_urls(value, self.context.get('request'))
+
@@ -0,0 +1,29 @@
+"""Image resizing run inside the pipeline's worker processes.
+
+Deliberately free of Django imports: workers only get file paths in and
+write files out, so they never need settings or a database connection.
+"""
+import os
+from PIL import Image, ImageOps
+
+
+def render_variants(source_path, targets, image_format='WEBP', quality=80):
+    """Write a downscaled copy of ``source_path`` for every ``(target_path, max_side)`` in ``targets``.
+
+    Each file is written under a temporary name and renamed into place,
+    so a variant is either complete or absent. Returns the number written.
+    """
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        for target_path, max_side in targets:
+            variant = image.copy()
+            variant.thumbnail((max_side, max_side), Image.LANCZOS)
+            if image_format == 'JPEG' and variant.mode == 'RGBA':
+                variant = variant.convert('RGB')
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            temp_path = f"{target_path}.{os.getpid()}.tmp"
+            variant.save(temp_path, image_format, quality=quality)
+            os.replace(temp_path, target_path)
+    return len(targets)
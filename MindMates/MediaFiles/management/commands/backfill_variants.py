@@ -0,0 +1,52 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from MediaFiles import variants
+from MediaFiles.imaging import render_variants
+
+
+class Command(BaseCommand):
+    help = "Generate missing image variants for every file already stored in an image field."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=variants.WORKERS)
+        parser.add_argument('--force', action='store_true', help="Regenerate variants that already exist.")
+
+    def iter_names(self):
+        for label, fields in variants.IMAGE_FIELDS.items():
+            model = apps.get_model(label)
+            for field in fields:
+                names = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                yield from names.values_list(field, flat=True).iterator()
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        futures = []
+        skipped = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for name in self.iter_names():
+                if not variants.is_image(name):
+                    continue
+                try:
+                    source, targets = variants.pending_targets(name, options['force'])
+                except OSError as e:
+                    self.stderr.write(f"{name}: {e}")
+                    continue
+                if targets:
+                    futures.append((name, pool.submit(render_variants, source, targets, variants.FORMAT)))
+                else:
+                    skipped += 1
+            wait([future for _, future in futures])
+
+        done = 0
+        for name, future in futures:
+            if future.exception() is None:
+                done += 1
+            else:
+                self.stderr.write(f"{name}: {future.exception()}")
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Processed {done} images ({len(futures) - done} failed, {skipped} already up to date) "
+            f"in {elapsed:.1f}s, {done / elapsed if elapsed else 0:.1f} images/s"
+        )
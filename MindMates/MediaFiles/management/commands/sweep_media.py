@@ -0,0 +1,190 @@
+import os
+import time
+from collections import Counter
+from datetime import timedelta
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.utils import timezone
+from Chats.models import UploadSession
+from MediaFiles import blobs, variants
+from MediaFiles.models import Blob
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete files under MEDIA_ROOT that no FileField references any more, once they are older "
+        "than MEDIA_SWEEP_GRACE_HOURS, reconcile blob reference counts, and expire resumable uploads "
+        "idle for RESUMABLE_UPLOAD_EXPIRY_HOURS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=settings.MEDIA_SWEEP_GRACE_HOURS)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--interval', type=int, default=0, help="Sweep again every N seconds (0: once).")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        while True:
+            self.sweep(options)
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def referenced_names(self, batch_size):
+        """Every stored name a FileField points at, counted, plus the variants of referenced images.
+
+        Soft-deleted rows do not count: nothing serves their files again.
+        """
+        counts = Counter()
+        for model in apps.get_models():
+            fields = [f for f in model._meta.concrete_fields if isinstance(f, models.FileField)]
+            if not fields:
+                continue
+            rows = model._default_manager.all()
+            if any(f.name == 'is_deleted' for f in model._meta.concrete_fields):
+                rows = rows.filter(is_deleted=False)
+            for field in fields:
+                names = rows.exclude(**{field.name: ''}).exclude(**{f'{field.name}__isnull': True})
+                counts.update(names.values_list(field.name, flat=True).iterator(chunk_size=batch_size))
+        for name in [name for name in counts if variants.is_image(name)]:
+            for variant in variants.VARIANTS:
+                counts[variants.variant_name(name, variant)] += 1
+        return counts
+
+    def reconcile_blobs(self, counts, dry_run):
+        """Raise ref_counts that fall short of the references found; returns how many were off.
+
+        Counts are never lowered here: ``counts`` is a snapshot, and an
+        acquire() that landed after it would be overwritten. Counts that
+        are too high are corrected by delete_batch(), under the row lock.
+        """
+        drifted = 0
+        for pk, name, ref_count in Blob.objects.values_list('pk', 'name', 'ref_count').iterator():
+            if ref_count != counts[name]:
+                drifted += 1
+                if not dry_run and ref_count < counts[name]:
+                    Blob.objects.filter(pk=pk, ref_count__lt=counts[name]).update(ref_count=counts[name])
+        return drifted
+
+    def sweep(self, options):
+        started = time.monotonic()
+        root = default_storage.path('')
+        cutoff = time.time() - options['grace_hours'] * 3600
+        counts = self.referenced_names(options['batch_size'])
+        drifted = self.reconcile_blobs(counts, options['dry_run'])
+
+        scanned = deleted = reclaimed = 0
+        batch = []
+        for directory, _, files in os.walk(root):
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                scanned += 1
+                if name in counts:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                # Recent files may belong to an upload whose row is not committed yet
+                if stat.st_mtime > cutoff:
+                    continue
+                batch.append((name, path, stat.st_size))
+                if len(batch) >= options['batch_size']:
+                    d, r = self.delete_batch(root, batch, options['dry_run'])
+                    deleted, reclaimed, batch = deleted + d, reclaimed + r, []
+        d, r = self.delete_batch(root, batch, options['dry_run'])
+        deleted, reclaimed = deleted + d, reclaimed + r
+
+        uploads, upload_bytes = self.sweep_uploads(options['dry_run'])
+        reclaimed += upload_bytes
+
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(
+            f"{verb} {deleted} of {scanned} files and {uploads} expired uploads, reclaiming {reclaimed} bytes "
+            f"({reclaimed / (1024 * 1024):.1f} MB); "
+            f"{drifted} blob ref counts were out of step; {time.monotonic() - started:.1f}s"
+        )
+
+    def sweep_uploads(self, dry_run):
+        """Drop resumable upload sessions idle past their expiry, and temp files no session owns.
+
+        Returns ``(sessions removed, bytes reclaimed)``. The temp files live
+        in RESUMABLE_UPLOAD_DIR, outside MEDIA_ROOT, so the file walk above
+        never sees them.
+        """
+        cutoff = timezone.now() - timedelta(hours=settings.RESUMABLE_UPLOAD_EXPIRY_HOURS)
+        removed = reclaimed = 0
+        for pk in UploadSession.objects.filter(updated_at__lt=cutoff).values_list('pk', flat=True).iterator():
+            with transaction.atomic():
+                # A PATCH holding the lock bumps updated_at, and then the session is kept
+                session = UploadSession.objects.select_for_update().filter(pk=pk, updated_at__lt=cutoff).first()
+                if session is None:
+                    continue
+                reclaimed += self.remove_temp(session.temp_path, dry_run)
+                if not dry_run:
+                    session.delete()
+                removed += 1
+
+        directory = settings.RESUMABLE_UPLOAD_DIR
+        if not os.path.isdir(directory):
+            return removed, reclaimed
+        live = {str(pk) for pk in UploadSession.objects.values_list('pk', flat=True)}
+        for file_name in os.listdir(directory):
+            path = os.path.join(directory, file_name)
+            try:
+                stale = os.stat(path).st_mtime < cutoff.timestamp()
+            except OSError:
+                continue
+            # Left behind when a session row went away some other way, e.g. a user delete cascade
+            if file_name not in live and stale:
+                reclaimed += self.remove_temp(path, dry_run)
+        return removed, reclaimed
+
+    def remove_temp(self, path, dry_run):
+        try:
+            size = os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+        except OSError:
+            return 0
+        return size
+
+    def delete_batch(self, root, batch, dry_run):
+        deleted = reclaimed = 0
+        for name, path, size in batch:
+            if dry_run:
+                deleted, reclaimed = deleted + 1, reclaimed + size
+                continue
+            try:
+                with transaction.atomic():
+                    if blobs.is_blob(name):
+                        # The row lock makes a concurrent acquire() wait, then find the blob gone
+                        row = Blob.objects.select_for_update().filter(name=name).first()
+                        # Recounted under the lock: references may have appeared since the walk began
+                        if blobs.live_references(name):
+                            continue
+                        if row is not None and row.ref_count > 0:
+                            # Taken but not attached yet, or leaked: zero it, and delete on a later
+                            # sweep only if nothing has attached it by then
+                            row.ref_count = 0
+                            row.save(update_fields=['ref_count'])
+                            continue
+                        Blob.objects.filter(name=name).delete()
+                    os.remove(path)
+            except OSError as e:
+                self.stderr.write(f"{name}: {e}")
+                continue
+            deleted, reclaimed = deleted + 1, reclaimed + size
+            # Drop directories this emptied (blobs/ab/cd/, per-user folders), never MEDIA_ROOT itself
+            parent = os.path.dirname(path)
+            while parent != root and parent.startswith(root):
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    break
+                parent = os.path.dirname(parent)
+        return deleted, reclaimed
@@ -0,0 +1,17 @@
+from django.db import models
+
+
+class Blob(models.Model):
+    """One stored copy of an attachment's bytes, shared by every message that carries them.
+
+    ``name`` is the storage name (``blobs/<digest>``) that message file
+    fields point at; ``ref_count`` is the number of messages doing so.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.digest} ({self.ref_count} refs)"
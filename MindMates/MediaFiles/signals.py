@@ -0,0 +1,17 @@
+from functools import partial
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_save
+from .variants import IMAGE_FIELDS, schedule
+
+
+def queue_variants(sender, instance, **kwargs):
+    # After commit, so a rolled-back save never leaves variants for a file nobody references
+    for field in IMAGE_FIELDS[sender._meta.label]:
+        name = getattr(instance, field).name
+        if name:
+            transaction.on_commit(partial(schedule, name))
+
+
+for label in IMAGE_FIELDS:
+    post_save.connect(queue_variants, sender=apps.get_model(label), dispatch_uid=f'media_variants_{label}')
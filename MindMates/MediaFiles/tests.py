@@ -0,0 +1,369 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import wait
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from PIL import Image
+from Chats.models import Conversation, Message
+from Communities.models import Community, CommunityMessage
+from unittest import mock
+from MindMates.testing import report
+from . import access, blobs, variants, views
+from .management.commands.sweep_media import Command as SweepCommand
+from .models import Blob
+from .imaging import render_variants
+
+
+def png(width, height):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def temp_media_root(test_case):
+    root = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, root, ignore_errors=True)
+    override = override_settings(MEDIA_ROOT=root)
+    override.enable()
+    test_case.addCleanup(override.disable)
+
+
+def api_client(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+class VariantPipelineTests(TestCase):
+    def setUp(self):
+        temp_media_root(self)
+        alice = User.objects.create(username='alice')
+        bob = User.objects.create(username='bob')
+        self.conversation, _ = Conversation.objects.get_or_create_between(alice, bob)
+        self.sender = alice
+
+    def attach(self, data, name='photo.png'):
+        with self.captureOnCommitCallbacks() as callbacks:
+            message = Message.objects.create(
+                conversation=self.conversation, sender=self.sender, content='', file=ContentFile(data, name=name),
+            )
+        return message, callbacks
+
+    def test_render_variants_keeps_aspect_ratio(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        source = os.path.join(root, 'wide.png')
+        with open(source, 'wb') as fh:
+            fh.write(png(2000, 1000))
+        targets = [(os.path.join(root, 'thumb.webp'), 256), (os.path.join(root, 'medium.webp'), 1024)]
+        self.assertEqual(render_variants(source, targets), 2)
+        sizes = []
+        for path, _ in targets:
+            with Image.open(path) as image:
+                sizes.append((image.format, image.size))
+        self.assertEqual(sizes, [('WEBP', (256, 128)), ('WEBP', (1024, 512))])
+
+    def test_urls_fall_back_until_variants_exist(self):
+        message, callbacks = self.attach(png(800, 600))
+        # Queued for after the commit, not run inside the request
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(variants.variant_urls(message.file), {name: message.file.url for name in variants.VARIANTS})
+
+        callbacks[0]().result(timeout=60)
+        urls = variants.variant_urls(message.file)
+        for name in variants.VARIANTS:
+            self.assertEqual(urls[name], message.file.storage.url(variants.variant_name(message.file.name, name)))
+        with Image.open(message.file.storage.path(variants.variant_name(message.file.name, 'thumb'))) as image:
+            self.assertEqual(image.size, (256, 192))
+        # Up to date now: nothing left to schedule
+        self.assertIsNone(variants.schedule(message.file.name))
+
+    def test_non_images_have_no_variants(self):
+        message, callbacks = self.attach(b'%PDF-1.4', name='notes.pdf')
+        self.assertIsNone(variants.variant_urls(message.file))
+        self.assertIsNone(callbacks[0]())
+
+    def test_throughput(self):
+        names = [self.attach(png(1600, 1200), name=f'p{i}.png')[0].file.name for i in range(2 * variants.WORKERS)]
+        # Warm the pool so process start-up is not counted
+        variants.schedule(names[0]).result(timeout=60)
+        started = time.perf_counter()
+        futures = [variants.schedule(name, force=True) for name in names]
+        wait(futures, timeout=120)
+        elapsed = time.perf_counter() - started
+        self.assertTrue(all(future.exception() is None for future in futures))
+        report('Image variant pipeline', {
+            f'{variants.WORKERS} worker(s)': {
+                'images': len(names), 'images_per_s': round(len(names) / elapsed, 1),
+                'variants_per_image': len(variants.VARIANTS),
+            },
+        })
+
+
+class DigestReshareTests(TestCase):
+    """A digest alone only re-shares a blob the sender can already read."""
+
+    DATA = b'%PDF-1.4 private notes'
+
+    def setUp(self):
+        temp_media_root(self)
+        self.alice, self.bob, self.carol = (User.objects.create(username=name) for name in ('alice', 'bob', 'carol'))
+        self.alice_bob, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+        self.carol_bob, _ = Conversation.objects.get_or_create_between(self.carol, self.bob)
+        response = api_client(self.alice).post(
+            reverse('upload-private-file', args=[self.alice_bob.id]),
+            {'file': SimpleUploadedFile('notes.pdf', self.DATA)},
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.digest = hashlib.sha256(self.DATA).hexdigest()
+
+    def reshare(self, user, conversation):
+        return api_client(user).post(
+            reverse('upload-private-file', args=[conversation.id]), {'sha256': self.digest},
+        )
+
+    def ref_count(self):
+        return Blob.objects.get(digest=self.digest).ref_count
+
+    def test_stranger_cannot_attach_by_digest(self):
+        response = self.reshare(self.carol, self.carol_bob)
+        # Indistinguishable from a digest the server has never seen
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.ref_count(), 1)
+        self.assertFalse(Message.objects.filter(conversation=self.carol_bob).exists())
+
+    def test_reader_reshares_without_upload(self):
+        response = self.reshare(self.bob, self.carol_bob)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.ref_count(), 2)
+
+    def test_stranger_uploading_the_bytes_shares_the_blob(self):
+        response = api_client(self.carol).post(
+            reverse('upload-private-file', args=[self.carol_bob.id]),
+            {'file': SimpleUploadedFile('mine.pdf', self.DATA)},
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.ref_count(), 2)
+        self.assertEqual(Blob.objects.count(), 1)
+
+
+class StoreAsyncTests(TransactionTestCase):
+    """Consumers store uploads with only the row work on the consumer DB pool."""
+
+    def setUp(self):
+        temp_media_root(self)
+
+    async def test_copy_runs_off_the_db_pool(self):
+        threads = {}
+
+        def record(name, function):
+            def wrapper(*args, **kwargs):
+                threads[name] = threading.current_thread().name
+                return function(*args, **kwargs)
+            return wrapper
+
+        data = b'%PDF-1.4 async'
+        with mock.patch.object(blobs, 'write', record('write', blobs.write)), \
+                mock.patch.object(blobs, 'register', record('register', blobs.register)):
+            blob = await blobs.store_async(ContentFile(data, name='a.pdf'))
+            again = await blobs.store_async(ContentFile(data, name='b.pdf'))
+
+        self.assertTrue(threads['register'].startswith('consumer-db'))
+        self.assertFalse(threads['write'].startswith('consumer-db'))
+        self.assertEqual((again.pk, blob.digest), (blob.pk, hashlib.sha256(data).hexdigest()))
+        self.assertTrue(default_storage.exists(blob.name))
+
+
+class CommunityMessageUploadTests(TestCase):
+    def setUp(self):
+        temp_media_root(self)
+        self.owner = User.objects.create(username='owner')
+        self.community = Community.objects.create(name='c', description='d', creaters=self.owner)
+        self.community.members.add(self.owner)
+        self.url = reverse('community-messages', args=[self.community.id])
+
+    def post(self, name, data):
+        return api_client(self.owner).post(self.url, {
+            'community': self.community.id, 'content': 'see attached', 'file': SimpleUploadedFile(name, data),
+        })
+
+    def test_attachment_is_stored_as_blob(self):
+        for _ in range(2):
+            self.assertEqual(self.post('report.pdf', b'%PDF-1.4 report').status_code, 201)
+        names = set(CommunityMessage.objects.values_list('file', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertTrue(blobs.is_blob(names.pop()))
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_disallowed_type_is_rejected(self):
+        self.assertEqual(self.post('run.exe', b'MZ').status_code, 400)
+        self.assertFalse(CommunityMessage.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+
+
+class MediaAccessTests(TestCase):
+    """Private files are readable through each referencing row the user can see, and no other."""
+
+    def setUp(self):
+        temp_media_root(self)
+        self.alice, self.bob, self.carol, self.dave = (
+            User.objects.create(username=name) for name in ('alice', 'bob', 'carol', 'dave')
+        )
+        self.conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+        self.community = Community.objects.create(name='c', description='d', creaters=self.alice)
+        self.community.members.add(self.alice, self.carol)
+        self.name = blobs.store(ContentFile(b'%PDF-1.4 shared', name='shared.pdf')).name
+
+    def status(self, user):
+        client = api_client(user) if user else APIClient()
+        return client.get(reverse('media', args=[self.name])).status_code
+
+    def test_chat_attachment(self):
+        Message.objects.create(conversation=self.conversation, sender=self.alice, content='', file=self.name)
+        self.assertEqual([self.status(u) for u in (self.alice, self.bob, self.carol, None)], [200, 200, 404, 404])
+
+    def test_community_attachment_is_for_members(self):
+        CommunityMessage.objects.create(community=self.community, sender=self.alice, content='', file=self.name)
+        self.assertEqual([self.status(u) for u in (self.alice, self.carol, self.bob, None)], [200, 200, 404, 404])
+
+    def test_each_row_grants_its_own_audience(self):
+        # The same blob in a chat and in a community: participants and members, nobody else
+        Message.objects.create(conversation=self.conversation, sender=self.alice, content='', file=self.name)
+        CommunityMessage.objects.create(community=self.community, sender=self.alice, content='', file=self.name)
+        self.assertEqual([self.status(u) for u in (self.bob, self.carol, self.dave)], [200, 200, 404])
+
+
+class MediaDeliveryTests(TestCase):
+    """Ranges, revalidation, proxy delivery and signed URLs on the media view."""
+
+    DATA = bytes(range(256)) * 4
+
+    def setUp(self):
+        temp_media_root(self)
+        self.alice, self.bob, self.carol = (User.objects.create(username=name) for name in ('alice', 'bob', 'carol'))
+        conversation, _ = Conversation.objects.get_or_create_between(self.alice, self.bob)
+        self.name = blobs.store(ContentFile(self.DATA, name='data.bin')).name
+        self.message = Message.objects.create(conversation=conversation, sender=self.alice, content='', file=self.name)
+        self.client = api_client(self.alice)
+        self.url = reverse('media', args=[self.name])
+
+    def get(self, client=None, url=None, **headers):
+        response = (client or self.client).get(url or self.url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_range_requests(self):
+        response, body = self.get(Range='bytes=10-19')
+        self.assertEqual((response.status_code, body), (206, self.DATA[10:20]))
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.DATA)}')
+        self.assertEqual(response['Content-Length'], '10')
+
+        response, body = self.get(Range='bytes=-4')
+        self.assertEqual((response.status_code, body), (206, self.DATA[-4:]))
+
+        response, _ = self.get(Range=f'bytes={len(self.DATA)}-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, f'bytes */{len(self.DATA)}'))
+
+    def test_etag_revalidation(self):
+        response, body = self.get()
+        self.assertEqual((response.status_code, body), (200, self.DATA))
+        etag = response['ETag']
+        self.assertEqual(self.get(**{'If-None-Match': etag})[0].status_code, 304)
+        # A stale If-Range gets the whole file instead of a piece of the new one
+        response, body = self.get(Range='bytes=0-9', **{'If-Range': '"stale"'})
+        self.assertEqual((response.status_code, body), (200, self.DATA))
+
+    def test_x_accel_sends_headers_only(self):
+        with mock.patch.object(views, 'DELIVERY', 'x-accel'):
+            response, body = self.get()
+        self.assertEqual(response['X-Accel-Redirect'], views.ACCEL_PREFIX + self.name)
+        self.assertEqual(body, b'')
+        self.assertIn('ETag', response)
+        # The access check still runs before the proxy is told anything
+        with mock.patch.object(views, 'DELIVERY', 'x-accel'):
+            response, _ = self.get(client=api_client(self.carol))
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    def test_signed_urls(self):
+        response = self.client.post(reverse('media-urls'), {'paths': [self.name, 'blobs/00/00/unknown']}, format='json')
+        self.assertEqual(list(response.data['urls']), [self.name])
+        signed = response.data['urls'][self.name]
+        anonymous = APIClient()
+        response, body = self.get(client=anonymous, url=signed)
+        self.assertEqual((response.status_code, body), (200, self.DATA))
+
+        # Bound to the file, expiring, and no way around a lost right to read
+        other = blobs.store(ContentFile(b'other', name='other.bin')).name
+        Message.objects.create(conversation=self.message.conversation, sender=self.alice, content='', file=other)
+        sig = signed.split('?sig=')[1]
+        self.assertEqual(self.get(client=anonymous, url=reverse('media', args=[other]) + '?sig=' + sig)[0].status_code, 404)
+        with mock.patch.object(access, 'SIGNED_URL_MAX_AGE', -1):
+            self.assertEqual(self.get(client=anonymous, url=signed)[0].status_code, 404)
+        Message.objects.filter(pk=self.message.pk).delete()
+        self.assertEqual(self.get(client=anonymous, url=signed)[0].status_code, 404)
+
+
+class SweepBlobTests(TestCase):
+    """sweep_media never deletes a blob that something references, whatever its ref_count says."""
+
+    def setUp(self):
+        temp_media_root(self)
+        alice, bob = User.objects.create(username='alice'), User.objects.create(username='bob')
+        self.conversation, _ = Conversation.objects.get_or_create_between(alice, bob)
+        self.sender = alice
+        self.blob = blobs.store(ContentFile(b'%PDF-1.4 blob', name='blob.pdf'))
+        self.path = default_storage.path(self.blob.name)
+        old = time.time() - 7 * 24 * 3600
+        os.utime(self.path, (old, old))
+
+    def attach(self):
+        return Message.objects.create(conversation=self.conversation, sender=self.sender, content='', file=self.blob.name)
+
+    def sweep(self):
+        call_command('sweep_media', grace_hours=1, stdout=open(os.devnull, 'w'))
+
+    def ref_count(self):
+        return Blob.objects.get(pk=self.blob.pk).ref_count
+
+    def test_reconcile_raises_but_never_lowers(self):
+        self.attach()
+        self.attach()
+        Blob.objects.filter(pk=self.blob.pk).update(ref_count=0)
+        self.sweep()
+        self.assertEqual(self.ref_count(), 2)
+        # Too high is left alone: the snapshot may predate an acquire()
+        Blob.objects.filter(pk=self.blob.pk).update(ref_count=5)
+        self.sweep()
+        self.assertEqual(self.ref_count(), 5)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_reference_added_after_the_walk_keeps_the_file(self):
+        Blob.objects.filter(pk=self.blob.pk).update(ref_count=0)
+        # Attached after the walk decided the name was unreferenced
+        self.attach()
+        deleted, _ = SweepCommand().delete_batch(os.path.dirname(self.path), [(self.blob.name, self.path, 1)], False)
+        self.assertEqual(deleted, 0)
+        self.assertTrue(os.path.exists(self.path))
+        self.assertTrue(Blob.objects.filter(pk=self.blob.pk).exists())
+
+    def test_unattached_reference_is_zeroed_then_collected(self):
+        # store() took a reference that no message ever used
+        self.assertEqual(self.ref_count(), 1)
+        self.sweep()
+        self.assertEqual(self.ref_count(), 0)
+        self.assertTrue(os.path.exists(self.path))
+        self.sweep()
+        self.assertFalse(Blob.objects.filter(pk=self.blob.pk).exists())
+        self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,110 @@
+"""Background generation of downscaled image variants.
+
+Every image saved through one of the IMAGE_FIELDS gets a WebP (or JPEG,
+per MEDIA_VARIANT_FORMAT) copy for each entry in MEDIA_VARIANTS, stored
+under ``variants/``. Resizing runs in a process pool, so neither request
+threads nor the consumers' event loop spend CPU on it. Until a variant
+exists its URL falls back to the original file. Variants of images nobody
+references any more are removed by ``manage.py sweep_media``.
+"""
+import multiprocessing
+import os
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.files.storage import default_storage
+from MediaFiles.imaging import render_variants
+
+VARIANTS = getattr(settings, 'MEDIA_VARIANTS', {'thumb': 256, 'medium': 1024})
+WORKERS = getattr(settings, 'MEDIA_PIPELINE_WORKERS', 2)
+FORMAT = getattr(settings, 'MEDIA_VARIANT_FORMAT', 'WEBP').upper()
+EXTENSION = '.jpg' if FORMAT == 'JPEG' else '.webp'
+VARIANT_DIR = 'variants'
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+
+# Model label -> file fields whose images get variants
+IMAGE_FIELDS = {
+    'QueryMate.Question': ['image'],
+    'QueryMate.Answer': ['image'],
+    'Users.UserProfile': ['profile_picture'],
+    'Communities.Community': ['image'],
+    'Chats.Message': ['file'],
+    'Communities.CommunityMessage': ['file'],
+}
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # spawn, not fork: forking a process that holds DB connections and event loops is unsafe
+        _executor = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def is_image(name):
+    return bool(name) and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def variant_name(name, variant):
+    """Storage name of ``variant`` for the original ``name``: ``variants/<name>.<variant>.webp``."""
+    return posixpath.join(VARIANT_DIR, f"{os.path.splitext(name)[0]}.{variant}{EXTENSION}")
+
+
+def source_stem(name):
+    """For a variant's storage name, the original's name without its extension; None for other names."""
+    prefix = VARIANT_DIR + '/'
+    if not name.startswith(prefix) or not name.endswith(EXTENSION):
+        return None
+    stem, _, variant = name[len(prefix):-len(EXTENSION)].rpartition('.')
+    return stem if variant in VARIANTS else None
+
+
+def pending_targets(name, force=False):
+    """``(path, max_side)`` for each variant of ``name`` that is missing or older than the original."""
+    source = default_storage.path(name)
+    source_mtime = os.path.getmtime(source)
+    targets = []
+    for variant, max_side in VARIANTS.items():
+        path = default_storage.path(variant_name(name, variant))
+        if force or not os.path.exists(path) or os.path.getmtime(path) < source_mtime:
+            targets.append((path, max_side))
+    return source, targets
+
+
+def schedule(name, force=False):
+    """Queue variant generation for the stored file ``name``; returns the future, or None if nothing to do."""
+    if not is_image(name):
+        return None
+    try:
+        source, targets = pending_targets(name, force)
+    except (OSError, NotImplementedError) as e:
+        print(f"Cannot generate variants for {name}: {e}")
+        return None
+    if not targets:
+        return None
+    future = get_executor().submit(render_variants, source, targets, FORMAT)
+    future.add_done_callback(lambda f: _report(name, f))
+    return future
+
+
+def _report(name, future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Variant generation failed for {name}: {future.exception()}")
+
+
+def variant_urls(file, request=None):
+    """``{variant: url}`` for an image file, or None for empty and non-image files.
+
+    Variants that have not been generated yet point at the original.
+    """
+    if not file or not is_image(file.name):
+        return None
+    storage = file.storage
+    urls = {}
+    for variant in VARIANTS:
+        name = variant_name(file.name, variant)
+        url = storage.url(name) if storage.exists(name) else file.url
+        urls[variant] = request.build_absolute_uri(url) if request is not None else url
+    return urls
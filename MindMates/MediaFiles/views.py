@@ -0,0 +1,179 @@
+import mimetypes
+import os
+import re
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
+from . import access, blobs
+from .access import PRIVATE_PREFIXES, can_read
+from .variants import source_stem
+
+DELIVERY = getattr(settings, 'MEDIA_DELIVERY', 'django')
+ACCEL_PREFIX = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_BLOCK_SIZE = 256 * 1024
+MAX_SIGNED_PATHS = 100
+
+
+def parse_range(header, size):
+    """``(start, end)`` inclusive for a single-range ``Range`` header; None to send the whole file.
+
+    Raises ValueError when the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match or match.groups() == ('', ''):
+        # Absent, malformed or multi-range: a full 200 response is always allowed
+        return None
+    first, last = match.groups()
+    if first == '':
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError
+    return start, end
+
+
+class BoundedReader:
+    """Reads ``length`` bytes of ``file`` from its current position, then reports EOF."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+async def read_async(file, length):
+    """Yield ``length`` bytes of ``file`` with each read in a worker thread, then close it."""
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        while length > 0:
+            data = await read(min(STREAM_BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+@api_view(['GET', 'HEAD'])
+@permission_classes([AllowAny])
+def serve_media(request, path):
+    """Serve a file from MEDIA_ROOT after an access check.
+
+    Supports single-range requests and ETag revalidation. With
+    MEDIA_DELIVERY set to ``x-accel`` or ``x-sendfile`` only headers are
+    returned and the front proxy sends the bytes. Requests without
+    credentials (``<img src>``) may carry a ``sig`` from ``sign_media_urls``
+    instead; the access check runs as the user it was issued to.
+    """
+    user = request.user
+    if not user.is_authenticated and request.GET.get('sig'):
+        user = access.signed_user(path, request.GET['sig']) or user
+    try:
+        full_path = default_storage.path(path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        return HttpResponse(status=404)
+    if not os.path.isfile(full_path) or not can_read(user, path):
+        # Denials look like missing files, so private names cannot be probed
+        return HttpResponse(status=404)
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    private = (source_stem(path) or path).startswith(PRIVATE_PREFIXES)
+    if blobs.is_blob(path):
+        # Content-addressed: the name is the digest, so the bytes never change
+        etag = quote_etag(os.path.splitext(os.path.basename(path))[0])
+        cache_control = 'private, max-age=31536000, immutable'
+    else:
+        etag = quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+        cache_control = 'private, no-cache' if private else 'public, no-cache'
+
+    if DELIVERY == 'x-accel':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = ACCEL_PREFIX.rstrip('/') + '/' + path
+    elif DELIVERY == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        response = stream_file(request, full_path, stat.st_size, content_type, etag)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = cache_control
+    return response
+
+
+def stream_file(request, full_path, size, content_type, etag):
+    if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        return HttpResponse(status=304)
+
+    byte_range = None
+    # If-Range: only resume when the client's copy is still the current one
+    if request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1 if size else 0
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+    else:
+        file = open(full_path, 'rb')
+        file.seek(start)
+        if getattr(request, 'scope', None) is not None:
+            # ASGI would read a synchronous file body into memory whole; stream it block by block
+            response = StreamingHttpResponse(read_async(file, length), content_type=content_type)
+        else:
+            # Ranges running to the end keep the real file object, so WSGI servers can sendfile() it
+            body = file if end == size - 1 else BoundedReader(file, length)
+            response = FileResponse(body, content_type=content_type)
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    if byte_range is not None:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def sign_media_urls(request):
+    """Signed URLs for ``paths`` (names under MEDIA_URL) the caller can read.
+
+    For clients that authenticate with a bearer token: the URLs load in
+    ``<img src>`` and downloads without it, for MEDIA_SIGNED_URL_MAX_AGE
+    seconds. Unreadable paths are left out.
+    """
+    paths = request.data.get('paths')
+    if not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+        return Response({"error": "paths must be a list of file names"}, status=status.HTTP_400_BAD_REQUEST)
+    if len(paths) > MAX_SIGNED_PATHS:
+        return Response({"error": f"At most {MAX_SIGNED_PATHS} paths per request"}, status=status.HTTP_400_BAD_REQUEST)
+    urls = {}
+    for path in dict.fromkeys(paths):
+        if can_read(request.user, path):
+            urls[path] = request.build_absolute_uri(reverse('media', args=[path])) + '?sig=' + access.sign(request.user, path)
+    return Response({'urls': urls, 'expires_in': access.SIGNED_URL_MAX_AGE})
@@ -0,0 +1,27 @@
+"""Group broadcasts whose payload is serialized once, by the sender.
+
+A ``chat.message`` event carries the client frame as ready-made JSON
+text. Each receiving consumer forwards it as-is instead of re-encoding
+the same dict for every socket in the group. orjson is used when it is
+installed.
+"""
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_django_default = DjangoJSONEncoder().default
+
+
+def encode(payload):
+    if orjson is not None:
+        return orjson.dumps(payload, default=_django_default).decode()
+    return json.dumps(payload, cls=DjangoJSONEncoder)
+
+
+def chat_event(payload):
+    """A ``chat.message`` group event for ``payload``; receivers send ``event["text"]`` unchanged."""
+    return {"type": "chat.message", "text": encode(payload)}
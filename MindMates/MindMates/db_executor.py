@@ -0,0 +1,85 @@
+"""Dedicated thread pool for the WebSocket consumers' database work.
+
+channels' ``database_sync_to_async`` is thread-sensitive by default, which
+funnels every consumer's DB call in the process through one shared thread.
+The ``database_sync_to_async`` defined here is a drop-in replacement that
+runs calls on a pool of CONSUMER_DB_POOL_SIZE threads instead. Each
+thread keeps its own Django connection, closed or recycled around every
+call exactly as channels does.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+
+class InstrumentedThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that tracks queue depth and how long calls wait for a thread."""
+
+    def __init__(self, max_workers):
+        super().__init__(max_workers=max_workers, thread_name_prefix='consumer-db')
+        self._stats_lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, fn, /, *args, **kwargs):
+        queued_at = time.monotonic()
+        with self._stats_lock:
+            self.queued += 1
+
+        def run():
+            waited = time.monotonic() - queued_at
+            with self._stats_lock:
+                self.queued -= 1
+                self.running += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        return super().submit(run)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'pool_size': self._max_workers,
+                'queue_depth': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'avg_wait_ms': round(self.total_wait / self.completed * 1000, 3) if self.completed else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+            }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = InstrumentedThreadPoolExecutor(getattr(settings, 'CONSUMER_DB_POOL_SIZE', 8))
+        return _executor
+
+
+def database_sync_to_async(func):
+    """Like channels.db.database_sync_to_async, but runs on the consumer DB pool."""
+    return DatabaseSyncToAsync(func, thread_sensitive=False, executor=get_executor())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def executor_metrics(request):
+    return Response(get_executor().stats())
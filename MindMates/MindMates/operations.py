@@ -0,0 +1,115 @@
+"""Migration operations shared by the apps' hand-written migrations."""
+from django.db.migrations.operations import AddIndex
+
+
+class AddIndexConcurrently(AddIndex):
+    """AddIndex that uses CREATE INDEX CONCURRENTLY on PostgreSQL.
+
+    Large live tables stay writable while the index builds. Other backends
+    (SQLite for local runs) fall back to a plain CREATE INDEX. Migrations
+    using this operation must set ``atomic = False``.
+    """
+
+    atomic = False
+
+    def describe(self):
+        return "Concurrently create index %s on model %s" % (self.index.name, self.model_name)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if schema_editor.connection.vendor == "postgresql":
+            schema_editor.add_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if schema_editor.connection.vendor == "postgresql":
+            schema_editor.remove_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, self.index)
+
+
+def create_index_sql(table, name, columns, where=None):
+    """RunPython callables that (re)create a raw index on a table no app owns, e.g. auth_user."""
+
+    def forwards(apps, schema_editor):
+        qn = schema_editor.quote_name
+        concurrently = " CONCURRENTLY" if schema_editor.connection.vendor == "postgresql" else ""
+        sql = "CREATE INDEX%s IF NOT EXISTS %s ON %s (%s)" % (
+            concurrently, qn(name), qn(table), ", ".join(qn(c) for c in columns)
+        )
+        if where:
+            sql += " WHERE " + where
+        schema_editor.execute(sql)
+
+    def backwards(apps, schema_editor):
+        concurrently = " CONCURRENTLY" if schema_editor.connection.vendor == "postgresql" else ""
+        schema_editor.execute("DROP INDEX%s IF EXISTS %s" % (concurrently, schema_editor.quote_name(name)))
+
+    return forwards, backwards
+
+
+def full_text_index_sql(table, name, column="content", config="english"):
+    """RunPython callables that index ``column`` of a soft-deletable message table for search.
+
+    On PostgreSQL this is a GIN index on the same ``to_tsvector`` expression
+    that MindMates.search queries with, limited to rows that are not
+    deleted. PostgreSQL keeps it current on every write by itself. On
+    SQLite it is an FTS5 table named ``<table>_fts``, kept in step by
+    insert, update and delete triggers. Other backends get nothing.
+
+    SQLite drops a table's triggers whenever a migration rebuilds it (e.g.
+    AlterField); a later migration re-runs ``forwards``, which refills the
+    FTS table from scratch and recreates them.
+    """
+
+    def forwards(apps, schema_editor):
+        qn = schema_editor.quote_name
+        vendor = schema_editor.connection.vendor
+        if vendor == "postgresql":
+            schema_editor.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s USING GIN "
+                "(to_tsvector('%s'::regconfig, COALESCE(%s, ''))) WHERE NOT %s"
+                % (qn(name), qn(table), config, qn(column), qn("is_deleted"))
+            )
+        elif vendor == "sqlite":
+            fts = qn(table + "_fts")
+            schema_editor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s)" % (fts, qn(column)))
+            schema_editor.execute("DELETE FROM %s" % fts)
+            schema_editor.execute(
+                "INSERT INTO %s (rowid, %s) SELECT id, %s FROM %s WHERE NOT is_deleted"
+                % (fts, qn(column), qn(column), qn(table))
+            )
+            schema_editor.execute(
+                "CREATE TRIGGER IF NOT EXISTS %s AFTER INSERT ON %s WHEN NOT new.is_deleted BEGIN "
+                "INSERT INTO %s (rowid, %s) VALUES (new.id, new.%s); END"
+                % (qn(table + "_fts_ai"), qn(table), fts, qn(column), qn(column))
+            )
+            schema_editor.execute(
+                "CREATE TRIGGER IF NOT EXISTS %s AFTER UPDATE OF %s, is_deleted ON %s BEGIN "
+                "DELETE FROM %s WHERE rowid = old.id; "
+                "INSERT INTO %s (rowid, %s) SELECT new.id, new.%s WHERE NOT new.is_deleted; END"
+                % (qn(table + "_fts_au"), qn(column), qn(table), fts, fts, qn(column), qn(column))
+            )
+            schema_editor.execute(
+                "CREATE TRIGGER IF NOT EXISTS %s AFTER DELETE ON %s BEGIN "
+                "DELETE FROM %s WHERE rowid = old.id; END"
+                % (qn(table + "_fts_ad"), qn(table), fts)
+            )
+
+    def backwards(apps, schema_editor):
+        qn = schema_editor.quote_name
+        vendor = schema_editor.connection.vendor
+        if vendor == "postgresql":
+            schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS %s" % qn(name))
+        elif vendor == "sqlite":
+            for suffix in ("_fts_ai", "_fts_au", "_fts_ad"):
+                schema_editor.execute("DROP TRIGGER IF EXISTS %s" % qn(table + suffix))
+            schema_editor.execute("DROP TABLE IF EXISTS %s" % qn(table + "_fts"))
+
+    return forwards, backwards
@@ -0,0 +1,82 @@
+"""Who is connected, kept in the shared cache instead of the database.
+
+Presence is tracked per room: a channel group name such as ``chat_<id>``
+or ``community_<id>``, or ANYWHERE for any connection at all. Each
+(room, user) pair is a counter of open connections. Several tabs
+therefore count once, and a user goes offline only when the last tab
+closes. Connect and disconnect are cache increments, not database writes.
+
+Every counter expires PRESENCE_TTL seconds after the last heartbeat. A
+worker that dies without running disconnect, including during a restart,
+leaves a stale entry for at most that long. With REDIS_URL set the cache
+is shared by all workers. Otherwise it is per process, like the in-memory
+channel layer.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+TTL = getattr(settings, 'PRESENCE_TTL', 60)
+HEARTBEAT_INTERVAL = getattr(settings, 'PRESENCE_HEARTBEAT_INTERVAL', 25)
+ANYWHERE = 'anywhere'
+
+
+def _key(room, user_id):
+    return f'presence:{room}:{user_id}'
+
+
+def join(user_id, rooms):
+    """Count one more connection of ``user_id`` in each of ``rooms``; returns the rooms they just came online in."""
+    came_online = []
+    for room in rooms:
+        key = _key(room, user_id)
+        cache.add(key, 0, TTL)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.set(key, 1, TTL)
+            count = 1
+        # incr() keeps the old expiry; this connection is alive now
+        cache.touch(key, TTL)
+        if count == 1:
+            came_online.append(room)
+    return came_online
+
+
+def leave(user_id, rooms):
+    """Count one connection fewer in each of ``rooms``; returns the rooms they are now offline in."""
+    went_offline = []
+    for room in rooms:
+        key = _key(room, user_id)
+        try:
+            count = cache.decr(key)
+        except ValueError:
+            # Already expired
+            count = 0
+        if count <= 0:
+            cache.delete(key)
+            went_offline.append(room)
+    return went_offline
+
+
+def heartbeat(user_id, rooms):
+    """Keep ``user_id`` present in ``rooms`` for another TTL seconds."""
+    for room in rooms:
+        if not cache.touch(_key(room, user_id), TTL):
+            # Lapsed while the socket stayed open (late heartbeats); count this connection again
+            join(user_id, [room])
+
+
+def online(room, user_ids):
+    """The subset of ``user_ids`` present in ``room``, looked up in one cache round trip."""
+    user_ids = list(user_ids)
+    found = cache.get_many([_key(room, user_id) for user_id in user_ids])
+    return [user_id for user_id in user_ids if found.get(_key(room, user_id), 0) > 0]
+
+
+# For consumers: cache calls block, so run them off the event loop
+join_async = sync_to_async(join, thread_sensitive=False)
+leave_async = sync_to_async(leave, thread_sensitive=False)
+heartbeat_async = sync_to_async(heartbeat, thread_sensitive=False)
+online_async = sync_to_async(online, thread_sensitive=False)
@@ -0,0 +1,80 @@
+"""Likes on chat and community messages.
+
+Both message models have a ``likes`` many-to-many to User and a
+denormalized ``like_count``. The helpers here work on either model
+without ever loading the full list of likers.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers
+
+
+def _likes(model):
+    field = model._meta.get_field('likes')
+    return field.remote_field.through, f'{field.m2m_field_name()}_id', f'{field.m2m_reverse_field_name()}_id'
+
+
+def toggle_like(model, message_id, user_id, **scope):
+    """Like or unlike a message for a user; returns ``(liked, like_count)``.
+
+    Locks the message row, deletes the user's like or inserts one, and
+    moves ``like_count`` with an F() expression, all in one transaction.
+    Concurrent toggles on the same message queue up behind the lock.
+    ``scope`` narrows the lookup (e.g. ``conversation_id=...``) and
+    ``model.DoesNotExist`` is raised when nothing matches.
+    """
+    through, message_col, user_col = _likes(model)
+    with transaction.atomic():
+        like_count = model.objects.select_for_update().filter(pk=message_id, **scope).values_list(
+            'like_count', flat=True
+        ).get()
+        link = {message_col: message_id, user_col: user_id}
+        if through.objects.filter(**link).delete()[0]:
+            liked, delta = False, -1
+        else:
+            try:
+                with transaction.atomic():
+                    through.objects.create(**link)
+                liked, delta = True, 1
+            except IntegrityError:
+                # Already liked through a path that skipped the row lock
+                liked, delta = True, 0
+        if delta:
+            # update() skips auto_now, so stamp those fields (e.g. Message.updated_at) by hand
+            touched = {f.name: timezone.now() for f in model._meta.concrete_fields if getattr(f, 'auto_now', False)}
+            model.objects.filter(pk=message_id).update(like_count=F('like_count') + delta, **touched)
+    return liked, like_count + delta
+
+
+def liked_ids(model, user, message_ids):
+    """The subset of ``message_ids`` that ``user`` has liked, in one query."""
+    if not user or not user.is_authenticated or not message_ids:
+        return set()
+    through, message_col, user_col = _likes(model)
+    return set(through.objects.filter(**{user_col: user.id, f'{message_col}__in': message_ids})
+               .values_list(message_col, flat=True))
+
+
+class LikedListSerializer(serializers.ListSerializer):
+    """Looks up the request user's likes for every item in one query.
+
+    The result is stored in the context as ``liked_ids``, where
+    ``is_liked`` can read it.
+    """
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        request = self.context.get('request')
+        self.context['liked_ids'] = liked_ids(
+            self.child.Meta.model, request and request.user, [item.pk for item in items]
+        )
+        return super().to_representation(items)
+
+
+def is_liked(serializer, obj):
+    """``is_liked`` for a message serializer, batched when it runs under LikedListSerializer."""
+    if 'liked_ids' in serializer.context:
+        return obj.pk in serializer.context['liked_ids']
+    request = serializer.context.get('request')
+    return obj.pk in liked_ids(type(obj), request and request.user, [obj.pk])
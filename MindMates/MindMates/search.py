@@ -0,0 +1,139 @@
+"""Full-text search over private chat and community messages.
+
+PostgreSQL matches ``to_tsvector`` against the GIN expression index the
+apps' migrations create (see MindMates.operations.full_text_index_sql).
+SQLite queries the FTS5 table those migrations maintain with triggers.
+Either way a query is one ranked, scoped statement per message table.
+Snippets are HTML-escaped; only the ``<mark>`` tags around matches are markup.
+"""
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from Chats.models import Message
+from Communities.models import Community, CommunityMessage
+
+SEARCH_CONFIG = 'english'
+HIGHLIGHT_START, HIGHLIGHT_STOP = '<mark>', '</mark>'
+# What the database brackets matches with: control characters escape() leaves alone
+MATCH_START, MATCH_STOP = '\x02', '\x03'
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+
+
+def search(queryset, text, limit):
+    """The ``limit`` best matches for ``text`` in ``queryset``: ``(message, rank, snippet)``, best first."""
+    if connection.vendor == 'postgresql':
+        return _search_postgres(queryset, text, limit)
+    if connection.vendor == 'sqlite':
+        return _search_sqlite(queryset, text, limit)
+    return []
+
+
+def _search_postgres(queryset, text, limit):
+    from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+
+    vector = SearchVector('content', config=SEARCH_CONFIG)
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    matches = queryset.filter(is_deleted=False).annotate(document=vector).filter(document=query).annotate(
+        rank=SearchRank(vector, query),
+        snippet=SearchHeadline(
+            'content', query, config=SEARCH_CONFIG,
+            start_sel=MATCH_START, stop_sel=MATCH_STOP, max_words=25, min_words=10,
+        ),
+    ).order_by('-rank', '-id')[:limit]
+    return [(m, m.rank, highlight(m.snippet)) for m in matches]
+
+
+def _search_sqlite(queryset, text, limit):
+    # Quote every term so user input cannot inject FTS5 query syntax
+    match = ' '.join('"%s"' % term.replace('"', '""') for term in text.split())
+    fts = connection.ops.quote_name(queryset.model._meta.db_table + '_fts')
+    scope_sql, scope_params = queryset.filter(is_deleted=False).values('id').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, -bm25({fts}), snippet({fts}, 0, %s, %s, '…', 16) FROM {fts} "
+            f"WHERE {fts} MATCH %s AND rowid IN ({scope_sql}) ORDER BY 2 DESC, rowid DESC LIMIT %s",
+            [MATCH_START, MATCH_STOP, match, *scope_params, limit],
+        )
+        rows = cursor.fetchall()
+    messages = queryset.in_bulk([row[0] for row in rows])
+    return [(messages[pk], rank, highlight(snippet)) for pk, rank, snippet in rows if pk in messages]
+
+
+def highlight(snippet):
+    """Escape a snippet's text, then turn the match markers into ``<mark>`` tags."""
+    return escape(snippet).replace(MATCH_START, HIGHLIGHT_START).replace(MATCH_STOP, HIGHLIGHT_STOP)
+
+
+def chat_scope(user, conversation_id=None):
+    messages = Message.objects.filter(
+        Q(conversation__initiator=user) | Q(conversation__receiver=user)
+    ).select_related('sender')
+    if conversation_id:
+        messages = messages.filter(conversation_id=conversation_id)
+    return messages
+
+
+def community_scope(user, community_id=None):
+    messages = CommunityMessage.objects.filter(
+        community_id__in=Community.members.through.objects.filter(user_id=user.id).values('community_id')
+    ).select_related('sender')
+    if community_id:
+        messages = messages.filter(community_id=community_id)
+    return messages
+
+
+def search_result(message, rank, snippet):
+    result = {
+        'message_id': message.id,
+        'sender': {'id': message.sender_id, 'username': message.sender.username},
+        'snippet': snippet,
+        'rank': rank,
+        'timestamp': message.created_at.isoformat(),
+    }
+    if isinstance(message, Message):
+        result.update(type='chat', conversation_id=message.conversation_id)
+    else:
+        result.update(type='community', community_id=message.community_id)
+    return result
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search_messages(request):
+    """Ranked search across the caller's conversations and communities.
+
+    ``q`` is the query; ``in`` narrows it to ``chats`` or ``communities``,
+    and ``conversation`` / ``community`` to a single room. Pages are
+    numbered (``page``, ``page_size``).
+    """
+    text = request.query_params.get('q', '').strip()
+    if not text:
+        return Response({"error": "q is required"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        page = max(1, int(request.query_params.get('page', 1)))
+        page_size = max(1, min(int(request.query_params.get('page_size', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        return Response({"error": "page and page_size must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+
+    where = request.query_params.get('in', 'all')
+    conversation_id = request.query_params.get('conversation')
+    community_id = request.query_params.get('community')
+    # Merging two ranked lists: take enough of each to fill this page and tell if another exists
+    needed = page * page_size + 1
+    hits = []
+    if where in ('all', 'chats') and not community_id:
+        hits += search(chat_scope(request.user, conversation_id), text, needed)
+    if where in ('all', 'communities') and not conversation_id:
+        hits += search(community_scope(request.user, community_id), text, needed)
+    hits.sort(key=lambda hit: hit[1], reverse=True)
+
+    start = (page - 1) * page_size
+    return Response({
+        'results': [search_result(*hit) for hit in hits[start:start + page_size]],
+        'next_page': page + 1 if len(hits) > start + page_size else None,
+    })
@@ -49,7 +49,8 @@ INSTALLED_APPS = [
     "Users",
     "QueryMate",
     "Chats",
-    "Communities"
+    "Communities",
+    "MediaFiles",
 ]
 
 MIDDLEWARE = [
@@ -181,6 +182,26 @@ CORS_ALLOW_ALL_ORIGINS = True
 STATIC_URL = "static/"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# How /media/ responses carry the file: 'django' streams it from Python (with Range support),
+# 'x-accel' (nginx) and 'x-sendfile' (Apache, lighttpd) only send headers and let the proxy send the bytes.
+# For nginx, MEDIA_ACCEL_PREFIX must be an `internal` location aliased to MEDIA_ROOT.
+MEDIA_DELIVERY = os.environ.get('MEDIA_DELIVERY', 'django')
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# API clients authenticate with a bearer token, which <img src> and <a href> cannot send; they fetch
+# signed media URLs (POST /media-urls/) that work without it for this many seconds
+MEDIA_SIGNED_URL_MAX_AGE = 3600
+# Attachment limits; resumable uploads are assembled on disk so they can be larger
+CHAT_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+RESUMABLE_UPLOAD_MAX_SIZE = 100 * 1024 * 1024
+RESUMABLE_UPLOAD_DIR = os.path.join(BASE_DIR, 'tmp_uploads')
+# Resumable uploads idle this long are dropped, with their temp files, by manage.py sweep_media
+RESUMABLE_UPLOAD_EXPIRY_HOURS = 24
+# Downscaled WebP copies of every uploaded image, by name and longest side (see MediaFiles/variants.py)
+MEDIA_VARIANTS = {'thumb': 256, 'medium': 1024}
+MEDIA_VARIANT_FORMAT = os.environ.get('MEDIA_VARIANT_FORMAT', 'WEBP')  # or 'JPEG'
+MEDIA_PIPELINE_WORKERS = int(os.environ.get('MEDIA_PIPELINE_WORKERS', 2))
+# manage.py sweep_media: unreferenced files younger than this are left alone
+MEDIA_SWEEP_GRACE_HOURS = float(os.environ.get('MEDIA_SWEEP_GRACE_HOURS', 24))
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -193,8 +214,80 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': False,
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
+# manage.py archive_messages: move messages older than this to the archive tables,
+# and hard-delete soft-deleted messages once they have been deleted this long
+MESSAGE_ARCHIVE_AFTER_DAYS = int(os.environ.get('MESSAGE_ARCHIVE_AFTER_DAYS', 180))
+SOFT_DELETE_PURGE_AFTER_DAYS = int(os.environ.get('SOFT_DELETE_PURGE_AFTER_DAYS', 30))
+# Threads serving the WebSocket consumers' DB calls (see MindMates/db_executor.py)
+CONSUMER_DB_POOL_SIZE = int(os.environ.get('CONSUMER_DB_POOL_SIZE', 8))
+# Batched WebSocket message inserts (see MindMates/write_behind.py)
+WRITE_BEHIND = {
+    'ENABLED': os.environ.get('WRITE_BEHIND', '') == '1',
+    'FLUSH_INTERVAL': 0.005,
+    'MAX_BATCH': 100,
+}
+# Per-frame-type token buckets for WebSocket clients: (tokens per second, burst), for each
+# connection and for all of a user's connections in one worker (see MindMates/throttle.py)
+WS_RATE_LIMITS = {
+    'chat_message': {'connection': (5, 20), 'user': (10, 40)},
+    'file_share': {'connection': (0.5, 3), 'user': (1, 5)},
+    'file_upload': {'connection': (0.5, 3), 'user': (1, 5)},
+    'upload_init': {'connection': (1, 5), 'user': (2, 10)},
+    'like_message': {'connection': (5, 20), 'user': (10, 40)},
+    'edit_message': {'connection': (2, 10), 'user': (4, 20)},
+    'delete_message': {'connection': (2, 10), 'user': (4, 20)},
+    'mark_read': {'connection': (10, 30)},
+    'heartbeat': {'connection': (1, 5)},
+    # Binary chunks of up to CHAT_MAX_CHUNK_SIZE (256 KB): about 10 MB/s per connection
+    'upload_chunk': {'connection': (40, 80), 'user': (80, 160)},
 }
+# Frames a WebSocket client may fall behind, by the "received" count in its heartbeats, before it is
+# disconnected; also when it has not reported for WS_ACK_TIMEOUT seconds while that far behind.
+# Clients that never send "received" count as having read nothing.
+WS_MAX_UNACKED_FRAMES = 256
+WS_ACK_TIMEOUT = 60
+# manage.py runworkers: Daphne pings sockets idle this long and closes those that do not answer in time
+WS_PING_INTERVAL = 20
+WS_PING_TIMEOUT = 30
+# Group membership lapses after CHANNEL_GROUP_EXPIRY seconds unless renewed,
+# so sockets that vanish without a disconnect do not pile up in groups.
+CHANNEL_GROUP_EXPIRY = int(os.environ.get('CHANNEL_GROUP_EXPIRY', 6 * 60 * 60))
+# Seconds a user stays online after their last heartbeat; clients are told to beat every
+# PRESENCE_HEARTBEAT_INTERVAL seconds, comfortably inside the TTL
+PRESENCE_TTL = 60
+PRESENCE_HEARTBEAT_INTERVAL = 25
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    # Shared across processes: required for more than one worker (see `manage.py runworkers`)
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+                'prefix': 'mindmates',
+                'capacity': 1000,
+                'expiry': 60,
+                'group_expiry': CHANNEL_GROUP_EXPIRY,
+            },
+        },
+    }
+    # Presence (MindMates/presence.py) must be visible to every worker
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'mindmates',
+        },
+    }
+else:
+    # Single-process stand-in for development
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {
+                'capacity': 1000,
+                'expiry': 60,
+                'group_expiry': CHANNEL_GROUP_EXPIRY,
+            },
+        },
+    }
@@ -0,0 +1,114 @@
+"""Helpers shared by the apps' test suites.
+
+Benchmarks are ordinary tests that assert on what they can count (queries,
+executor hops, encodes) and print their timings through ``report()`` when
+the suite runs with BENCHMARK=1.
+"""
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from unittest import mock
+from channels.layers import InMemoryChannelLayer
+from channels.testing import WebsocketCommunicator
+from django.db import connection
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.backends.utils import CursorWrapper
+from rest_framework_simplejwt.tokens import AccessToken
+from MindMates.db_executor import get_executor
+
+
+def query_plan(queryset):
+    """EXPLAIN output for ``queryset``.
+
+    On PostgreSQL sequential scans are priced out first, so a small test
+    table still shows whether an index can serve the query at all.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            # Tests run inside a transaction, which undoes this afterwards
+            cursor.execute("SET LOCAL enable_seqscan = off")
+    return queryset.explain()
+
+
+def full_scans(plan):
+    """Tables the plan reads from start to end; empty when every access goes through an index."""
+    if connection.vendor == 'postgresql':
+        return re.findall(r'Seq Scan on (\S+)', plan)
+    # SQLite: "SCAN <table>" without "USING ... INDEX" is a full table scan
+    return [m.group(1) for m in re.finditer(r'\bSCAN (\S+)(?!\S)(?! USING)', plan)]
+
+
+@contextmanager
+def count_db_work():
+    """Count queries and commits issued on any thread, executor threads included, while the block runs."""
+    counts = {'queries': 0, 'commits': 0}
+    lock = threading.Lock()
+    execute, commit = CursorWrapper._execute_with_wrappers, BaseDatabaseWrapper.commit
+
+    def counting(key, method):
+        def wrapper(*args, **kwargs):
+            with lock:
+                counts[key] += 1
+            return method(*args, **kwargs)
+        return wrapper
+
+    with mock.patch.object(CursorWrapper, '_execute_with_wrappers', counting('queries', execute)), \
+            mock.patch.object(BaseDatabaseWrapper, 'commit', counting('commits', commit)):
+        yield counts
+
+
+class SharedChannelLayer(InMemoryChannelLayer):
+    """In-memory layer whose instances share channels and groups, as every worker shares one Redis.
+
+    Aliases configured with the same ``server`` behave like separate worker
+    processes connected to the same Redis; clear ``servers`` between tests.
+    """
+
+    servers = {}
+
+    def __init__(self, server='default', **kwargs):
+        super().__init__(**kwargs)
+        self.channels, self.groups = self.servers.setdefault(server, ({}, {}))
+
+    async def flush(self):
+        # In place: the other aliases hold the same dicts
+        self.channels.clear()
+        self.groups.clear()
+
+
+def report(title, rows):
+    """Print a benchmark table when BENCHMARK=1; ``rows`` maps a label to a dict of figures."""
+    if not os.environ.get('BENCHMARK'):
+        return
+    print(f"\n{title}")
+    for label, figures in rows.items():
+        print(f"  {label:<24}" + "  ".join(f"{key}={value}" for key, value in figures.items()))
+
+
+async def ws_connect(path, user, **auth):
+    """A communicator connected to ``path`` that has sent ``user``'s auth frame, plus any ``auth`` fields."""
+    from MindMates.asgi import application
+    communicator = WebsocketCommunicator(application, path)
+    connected, _ = await communicator.connect()
+    assert connected
+    await communicator.send_json_to({'type': 'auth', 'token': str(AccessToken.for_user(user)), **auth})
+    return communicator
+
+
+async def receive_type(communicator, frame_type, timeout=5):
+    """The next frame of ``frame_type``, skipping any others."""
+    while True:
+        frame = await communicator.receive_json_from(timeout)
+        if frame.get('type') == frame_type:
+            return frame
+
+
+async def measure_frame(communicator, frame, reply_type):
+    """Send ``frame`` and wait for ``reply_type``; returns ``(executor hops, seconds)``."""
+    completed = get_executor().stats()['completed']
+    started = time.perf_counter()
+    await communicator.send_json_to(frame)
+    await receive_type(communicator, reply_type)
+    return get_executor().stats()['completed'] - completed, time.perf_counter() - started
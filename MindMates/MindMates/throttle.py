@@ -0,0 +1,167 @@
+"""Rate limiting and outbound backpressure for the WebSocket consumers.
+
+Inbound frames pass through token buckets configured per frame type in
+WS_RATE_LIMITS. Binary upload chunks count as ``upload_chunk`` frames.
+Each connection has its own buckets, and all of a user's connections in
+a worker also share a per-user bucket. A frame over either limit gets a
+``throttled`` reply and is not handled.
+
+Daphne buffers outbound frames in Twisted, so ``send()`` never blocks
+and cannot reveal a slow reader. Instead each connection counts the
+frames it sends, and clients report how many they have received in the
+``received`` field of their heartbeats. A client more than
+WS_MAX_UNACKED_FRAMES behind at a heartbeat is disconnected. So is one
+that is that far behind and has not reported for WS_ACK_TIMEOUT seconds.
+A client that never reports is treated as having read nothing, with the
+silence counted from its first frame. Sockets that go silent altogether
+are dropped by Daphne's own keepalive pings, configured by
+WS_PING_INTERVAL and WS_PING_TIMEOUT (see ``manage.py runworkers``).
+"""
+import json
+import time
+from django.conf import settings
+
+RATE_LIMITS = getattr(settings, 'WS_RATE_LIMITS', {})
+MAX_UNACKED_FRAMES = getattr(settings, 'WS_MAX_UNACKED_FRAMES', 256)
+ACK_TIMEOUT = getattr(settings, 'WS_ACK_TIMEOUT', 60)
+SLOW_READER_CLOSE_CODE = 4008
+PRUNE_INTERVAL = 60
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``burst``; starts full."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available; 0 if one is available now."""
+        self.refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def idle(self, now):
+        # A bucket that has refilled completely is indistinguishable from a new one
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+# (user_id, frame type) -> TokenBucket, shared by the user's connections in this process
+_user_buckets = {}
+_last_prune = time.monotonic()
+
+
+def _user_bucket(user_id, frame_type, rate, burst):
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune > PRUNE_INTERVAL:
+        for key in [key for key, bucket in _user_buckets.items() if bucket.idle(now)]:
+            del _user_buckets[key]
+        _last_prune = now
+    bucket = _user_buckets.get((user_id, frame_type))
+    if bucket is None:
+        bucket = _user_buckets[(user_id, frame_type)] = TokenBucket(rate, burst)
+    return bucket
+
+
+class RateLimiter:
+    """The buckets one connection checks its frames against."""
+
+    def __init__(self, user_id, limits=None):
+        self.user_id = user_id
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.buckets = {}
+
+    def check(self, frame_type):
+        """Take a token for ``frame_type``; returns None if allowed, else seconds to wait."""
+        limit = self.limits.get(frame_type)
+        if limit is None:
+            return None
+        now = time.monotonic()
+        buckets = []
+        if 'connection' in limit:
+            if frame_type not in self.buckets:
+                self.buckets[frame_type] = TokenBucket(*limit['connection'])
+            buckets.append(self.buckets[frame_type])
+        if 'user' in limit:
+            buckets.append(_user_bucket(self.user_id, frame_type, *limit['user']))
+        wait = max([bucket.wait_time(now) for bucket in buckets], default=0)
+        if wait:
+            return wait
+        # Only spend tokens once every bucket agrees, so a refusal costs nothing
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return None
+
+
+class FlowControlMixin:
+    """Rate limits inbound frames and tracks how far behind the client is reading.
+
+    Mix in before AsyncWebsocketConsumer. Consumers call
+    ``await self.rate_limited(data)`` once authenticated and drop the
+    frame when it returns True. Heartbeat handlers call
+    ``await self.acknowledge(data)`` and stop when it returns True.
+    """
+    frames_sent = 0
+    frames_acked = 0
+    acked_at = None
+    reader_dropped = False
+
+    async def rate_limited(self, data, **reply):
+        """Take a token for ``data``'s frame type; True, after a ``throttled`` reply, if there was none.
+
+        ``reply`` adds fields to the throttled frame.
+        """
+        if getattr(self, 'limiter', None) is None:
+            self.limiter = RateLimiter(self.user.id)
+        frame_type = data.get('type')
+        wait = self.limiter.check(frame_type)
+        if wait is None:
+            return False
+        await self.send(text_data=json.dumps({
+            'type': 'throttled',
+            'frame': frame_type,
+            'client_id': data.get('client_id'),
+            'retry_after': round(wait, 3),
+            **reply,
+        }))
+        return True
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        if self.reader_dropped:
+            return
+        await super().send(text_data, bytes_data, close)
+        self.frames_sent += 1
+        if self.acked_at is None:
+            # Never acked: the client gets ACK_TIMEOUT from its first frame to start reporting
+            self.acked_at = time.monotonic()
+        # Behind, and silent about it for too long
+        if (
+            self.frames_sent - self.frames_acked > MAX_UNACKED_FRAMES
+            and time.monotonic() - self.acked_at > ACK_TIMEOUT
+        ):
+            await self.drop_slow_reader()
+
+    async def acknowledge(self, data):
+        """Record the ``received`` count of a heartbeat; True if the client was dropped for lagging."""
+        received = data.get('received')
+        if not isinstance(received, int) or not self.frames_acked <= received <= self.frames_sent:
+            return False
+        self.frames_acked = received
+        self.acked_at = time.monotonic()
+        if self.frames_sent - received > MAX_UNACKED_FRAMES:
+            await self.drop_slow_reader()
+            return True
+        return False
+
+    async def drop_slow_reader(self):
+        if self.reader_dropped:
+            return
+        self.reader_dropped = True
+        print(f"Closing slow WebSocket reader {self.channel_name}")
+        await self.close(SLOW_READER_CLOSE_CODE)
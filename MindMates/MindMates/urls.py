@@ -7,9 +7,11 @@ from django.urls import path, include
 from Users import routers as users_urls
 from QueryMate import routers as querymate_urls
 from django.conf import settings
-from django.conf.urls.static import static
 from Chats import routing 
 from Users.views import EmailTokenObtainPairView
+from MindMates.db_executor import executor_metrics
+from MindMates.search import search_messages
+from MediaFiles.views import sign_media_urls
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -30,7 +32,10 @@ urlpatterns = [
     # path('chats/', include('Chats.routing')),
     path("chats/", include("Chats.urls")),
     path("communities/",include("Communities.urls")),
+    path("search/messages/", search_messages, name="search-messages"),
+    path("metrics/db-executor/", executor_metrics, name="db-executor-metrics"),
+    path("media-urls/", sign_media_urls, name="media-urls"),
+    # Uploaded media, with access checks (see MediaFiles/views.py); served in every mode, not just DEBUG
+    path(settings.MEDIA_URL.lstrip('/'), include("MediaFiles.urls")),
     *auth_api_urls,  # OAuth2 URLs
-]
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
\ No newline at end of file
@@ -0,0 +1,95 @@
+"""Opt-in write-behind batching for WebSocket message inserts.
+
+With WRITE_BEHIND['ENABLED'] on, consumers hand unsaved message instances
+to a WriteBehindBuffer instead of saving them one by one. The buffer
+flushes with a single bulk_create, in one transaction, every
+FLUSH_INTERVAL seconds or as soon as MAX_BATCH messages are waiting.
+``add()`` returns a future that resolves only once the batch holding the
+message has been committed, so callers never ack a message that is not
+durable.
+
+Primary keys come from the insert itself, so a message has no id, and is
+not broadcast, until its batch has committed. Read cursors compare ids and
+rely on that: ids handed out ahead of the insert would not follow commit
+order.
+"""
+import asyncio
+import weakref
+from django.conf import settings
+from django.db import transaction
+from MindMates.db_executor import database_sync_to_async
+
+_config = getattr(settings, 'WRITE_BEHIND', {})
+ENABLED = _config.get('ENABLED', False)
+FLUSH_INTERVAL = _config.get('FLUSH_INTERVAL', 0.005)
+MAX_BATCH = _config.get('MAX_BATCH', 100)
+
+
+class WriteBehindBuffer:
+    """Per-model buffer of pending inserts.
+
+    ``after_flush`` is called with the saved objects inside the flush
+    transaction, for the bookkeeping a per-row ``save()`` would have done.
+    State is kept per event loop, because futures cannot cross loops.
+    """
+
+    def __init__(self, model, after_flush=None):
+        self.model = model
+        self.after_flush = after_flush
+        self._states = weakref.WeakKeyDictionary()
+
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            state = self._states[loop] = {'pending': [], 'timer': None, 'tasks': set()}
+        return state
+
+    def add(self, obj):
+        """Queue ``obj`` for the next flush; returns a future resolved when it is committed."""
+        state = self._state()
+        future = asyncio.get_running_loop().create_future()
+        state['pending'].append((obj, future))
+        if len(state['pending']) >= MAX_BATCH:
+            self._schedule(state, 0)
+        elif state['timer'] is None:
+            self._schedule(state, FLUSH_INTERVAL)
+        return future
+
+    def _schedule(self, state, delay):
+        if state['timer'] is not None:
+            state['timer'].cancel()
+        state['timer'] = asyncio.get_running_loop().call_later(delay, self._start_flush, state)
+
+    def _start_flush(self, state):
+        # The loop only keeps weak references to tasks; hold this one until it is done
+        task = asyncio.ensure_future(self.flush(state))
+        state['tasks'].add(task)
+        task.add_done_callback(state['tasks'].discard)
+
+    async def flush(self, state=None):
+        state = state or self._state()
+        if state['timer'] is not None:
+            state['timer'].cancel()
+            state['timer'] = None
+        batch, state['pending'] = state['pending'], []
+        if not batch:
+            return
+        objs = [obj for obj, _ in batch]
+        try:
+            await database_sync_to_async(self._write)(objs)
+        except Exception as e:
+            print(f"Write-behind flush of {len(objs)} {self.model.__name__} rows failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    def _write(self, objs):
+        with transaction.atomic():
+            self.model.objects.bulk_create(objs)
+            if self.after_flush is not None:
+                self.after_flush(objs)
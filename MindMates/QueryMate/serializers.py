@@ -42,6 +42,7 @@
 #         return question
 from rest_framework import serializers
 from .models import Tag, Question,Answer,Review
+from MediaFiles.fields import ImageVariantsField
 
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
@@ -74,9 +75,10 @@ class ReviewSerializer(serializers.ModelSerializer):
 class AnswerSerializer(serializers.ModelSerializer):
     review_answers = ReviewSerializer(many=True, read_only=True)
     user = serializers.StringRelatedField(read_only=True)
+    image_variants = ImageVariantsField(source='image')
     class Meta:
         model = Answer
-        fields = ['id', 'user', 'content','image','answerurl', 'created_at', 'updated_at','review_answers','upvote_count','downvote_count']
+        fields = ['id', 'user', 'content','image','image_variants','answerurl', 'created_at', 'updated_at','review_answers','upvote_count','downvote_count']
         read_only_fields = ['user', 'created_at', 'updated_at']
         
         
@@ -101,11 +103,12 @@ class QuestionSerializer(serializers.ModelSerializer):
     user_email = serializers.EmailField(source='user.email', read_only=True)
     author_id = serializers.IntegerField(source='user.id', read_only=True) 
     answer_count = serializers.IntegerField(source='answer.count', read_only=True) 
+    image_variants = ImageVariantsField(source='image')
     class Meta:
         
         model = Question
         fields = [
-            'id', 'title', 'description', 'image', 'user', 'answer', 'user_email', 'author_id',
+            'id', 'title', 'description', 'image', 'image_variants', 'user', 'answer', 'user_email', 'author_id',
             'created_at', 'updated_at', 'tags', 'tag_ids','upvote_count','downvote_count','is_owner','answer_count'
         ]
         read_only_fields = ['user', 'created_at', 'updated_at','is_owner', 'answer_count']
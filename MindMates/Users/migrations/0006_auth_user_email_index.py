@@ -0,0 +1,18 @@
+from django.db import migrations
+from MindMates.operations import create_index_sql
+
+# EmailTokenObtainSerializer logs users in by email, which auth_user does not index
+forwards, backwards = create_index_sql("auth_user", "users_auth_user_email_idx", ["email"])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("Users", "0005_alter_userprofile_user"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards, atomic=False),
+    ]
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
 from .models import UserProfile
+from MediaFiles.fields import ImageVariantsField
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
 
@@ -31,9 +32,10 @@ class EmailTokenObtainSerializer(TokenObtainPairSerializer):
         raise serializers.ValidationError("Invalid credentials")
 class UserProfileSerializer(serializers.ModelSerializer):
     user = serializers.HyperlinkedRelatedField(read_only=True,many=False,view_name="user-detail")
+    profile_picture_variants = ImageVariantsField(source='profile_picture')
     class Meta:
         model = UserProfile
-        fields = ['url',  'id', 'user', 'profile_picture' ] 
+        fields = ['url',  'id', 'user', 'profile_picture', 'profile_picture_variants'] 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=False)
     old_password = serializers.CharField(write_only=True, required=False)
@@ -1,3 +1,13 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from MindMates.testing import full_scans, query_plan
 
-# Create your tests here.
+
+class EmailLoginIndexTests(TestCase):
+    def test_email_lookup_uses_index(self):
+        for i in range(20):
+            User.objects.create(username=f'user{i}', email=f'user{i}@example.com')
+        # The lookup EmailTokenObtainSerializer.validate runs on every login
+        plan = query_plan(User.objects.filter(email='user7@example.com').order_by('pk')[:1])
+        self.assertEqual(full_scans(plan), [], plan)
+        self.assertIn('users_auth_user_email_idx', plan)